@@ -1,6 +1,8 @@
 import random
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from datetime import timedelta
 from django.core.validators import RegexValidator
@@ -70,3 +72,20 @@ class User(AbstractBaseUser, PermissionsMixin):
         if not self.otp_created_at or timezone.now() > self.otp_created_at + timedelta(minutes=validity_minutes):
             return False
         return True
+
+
+@receiver(post_save, sender=User)
+def invalidate_ws_auth_on_user_change(sender, instance, created, **kwargs):
+    """Cached websocket principals must not outlive a deactivation or password change."""
+    if created:
+        return
+    # set_password() leaves the raw value in _password until save() completes
+    if not instance.is_active or getattr(instance, "_password", None) is not None:
+        from accounts.services.auth_cache import invalidate_user_tokens
+        invalidate_user_tokens(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_ws_auth_on_user_delete(sender, instance, **kwargs):
+    from accounts.services.auth_cache import invalidate_user_tokens
+    invalidate_user_tokens(instance.id)
@@ -0,0 +1,72 @@
+"""
+Verified-token principal cache for websocket connects.
+
+JWTAuthMiddleware validates the access token (signature + expiry, no DB) and
+then looks up `ws_auth:<jti>`. On a hit the user is rebuilt from the cached
+fields without a query; other fields load lazily if something touches them.
+
+Every entry records the user's auth version (`ws_auth_ver:<user_id>`).
+Deactivating a user, changing their password or deleting them bumps the
+version, which invalidates every cached token for that user at once.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+WS_AUTH_CACHE_TTL = getattr(settings, "WS_AUTH_CACHE_TTL_SECONDS", 300)
+# Fields kept in the cached principal: what ChatConsumer and the chat helpers read
+PRINCIPAL_FIELDS = ("id", "email", "name", "role", "is_active", "is_staff", "is_superuser")
+
+
+def _token_key(jti):
+    return f"ws_auth:{jti}"
+
+
+def _version_key(user_id):
+    return f"ws_auth_ver:{user_id}"
+
+
+def get_cached_principal(jti):
+    """Return a user instance for a cached, still-valid jti, or None."""
+    try:
+        entry = cache.get(_token_key(jti))
+        if not entry:
+            return None
+        if cache.get(_version_key(entry["id"]), 0) != entry["ver"]:
+            return None
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
+        # from_db expects values in model field order; the rest stay deferred
+        names = [f.attname for f in User._meta.concrete_fields if f.attname in PRINCIPAL_FIELDS]
+        return User.from_db("default", names, [entry[n] for n in names])
+    except Exception as e:
+        logger.warning("WS auth cache lookup failed: %s", e)
+        return None
+
+
+def cache_principal(jti, user, token_exp):
+    """Cache `user` for this token until min(token expiry, WS_AUTH_CACHE_TTL)."""
+    ttl = min(int(token_exp - time.time()), WS_AUTH_CACHE_TTL)
+    if ttl <= 0 or not user.is_active:
+        return
+    try:
+        entry = {f: getattr(user, f) for f in PRINCIPAL_FIELDS}
+        entry["ver"] = cache.get(_version_key(user.id), 0)
+        cache.set(_token_key(jti), entry, timeout=ttl)
+    except Exception as e:
+        logger.warning("WS auth cache store failed for user %s: %s", user.id, e)
+
+
+def invalidate_user_tokens(user_id):
+    """Drop every cached principal for the user (version bump, no key scan)."""
+    key = _version_key(user_id)
+    try:
+        # Never expires on its own: an expired version would revive old entries
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+    except Exception as e:
+        logger.warning("WS auth cache invalidation failed for user %s: %s", user_id, e)
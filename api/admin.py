@@ -2,6 +2,7 @@ from django.contrib import admin
 
 from .models import (
     PerformanceAnalytics,
+    ShopDailyRollup,
     Shop, 
     Service, 
     ServiceCategory, 
@@ -9,6 +10,7 @@ from .models import (
     Promotion, 
     Slot, 
     SlotBooking, 
+    SlotHold,
     ServiceWishlist,
     VerificationFile,
     Reply,
@@ -236,6 +238,14 @@ class SlotBookingAdmin(admin.ModelAdmin):
     search_fields = ("user__username", "shop__name", "service__title")
     ordering = ("-start_time",)
 
+@admin.register(SlotHold)
+class SlotHoldAdmin(admin.ModelAdmin):
+    list_display = ("id", "slot", "user", "slot_booking", "source", "status", "expires_at", "resolved_at")
+    list_filter = ("status", "source", "created_at")
+    search_fields = ("user__email",)
+    raw_id_fields = ("slot", "user", "slot_booking")
+    ordering = ("-created_at",)
+
 @admin.register(ServiceWishlist)
 class ServiceWishlistAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'service', 'created_at')
@@ -329,6 +339,18 @@ class GlobalSettingsAdmin(admin.ModelAdmin):
     )
     search_fields = ()
     ordering = ('-updated_at',)
+    readonly_fields = ('propagation_status',)
+
+    def propagation_status(self, obj):
+        from .utils.plan_defaults import propagation_progress
+        progress = propagation_progress()
+        if not progress:
+            return "-"
+        total = progress.get("total")
+        done = f"{progress.get('processed', 0)}/{total}" if total is not None else "-"
+        finished = progress.get("finished_at") or progress.get("started_at") or progress.get("queued_at")
+        return f"{progress.get('status')} ({done} shops) {finished or ''}".strip()
+    propagation_status.short_description = "Propagation to Foundation shops"
 
     def has_add_permission(self, request):
         # Only allow one settings instance
@@ -343,6 +365,12 @@ class GlobalSettingsAdmin(admin.ModelAdmin):
 class PerformanceAnalyticsAdmin(admin.ModelAdmin):
     list_display = ('shop', 'total_revenue', 'total_bookings', 'updated_at')
     search_fields = ('shop__name',)
+
+@admin.register(ShopDailyRollup)
+class ShopDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('shop', 'date', 'bookings_total', 'bookings_completed', 'bookings_cancelled', 'computed_at')
+    list_filter = ('date',)
+    search_fields = ('shop__name',)
 if AIAutoFillSettings:
     @admin.register(AIAutoFillSettings)
     class AIAutoFillSettingsAdmin(admin.ModelAdmin):
@@ -1,10 +1,35 @@
 # api/consumers.py
+import asyncio
 import json
+import logging
+import time
+from datetime import datetime
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import ChatThread, Message
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ChatThread, Message, Slot
 from .serializers import MessageSerializer
-from .utils.fcm import notify_user
+from .tasks import send_chat_notification
+from .utils.presence import register_connection, unregister_connection
+from .utils.slot_events import slot_group_name
+from .utils.timezone_helpers import to_utc_iso
+
+logger = logging.getLogger(__name__)
+
+
+def limit_statement_time(seconds):
+    """
+    Inside an atomic block: make Postgres cancel any statement running longer
+    than `seconds`. The error aborts the block, so nothing it wrote commits.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [str(int(seconds * 1000))])
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -13,13 +38,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
         else:
             self.room_group_name = f"user_{user.id}"
+            self.active_thread_id = None
             await self.channel_layer.group_add(self.room_group_name, self.channel_name)
             await self.accept()
+            await self.touch_presence()
 
     async def disconnect(self, close_code):
         # Only discard from group if room_group_name was set (i.e., connect succeeded)
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            await sync_to_async(unregister_connection, thread_sensitive=False)(
+                self.scope["user"].id, self.channel_name
+            )
+
+    async def touch_presence(self):
+        await sync_to_async(register_connection, thread_sensitive=False)(
+            self.scope["user"].id, self.channel_name, self.active_thread_id
+        )
 
     async def receive(self, text_data):
         data = json.loads(text_data)
@@ -28,67 +63,229 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.handle_send_message(data)
         elif action == "mark_read":
             await self.handle_mark_read(data)
+        elif action == "open_thread":
+            # Client is looking at this thread: chat pushes for it are suppressed
+            self.active_thread_id = data.get("thread_id")
+        elif action == "close_thread":
+            self.active_thread_id = None
+        # Any frame (including {"action": "heartbeat"}) refreshes the presence TTL
+        await self.touch_presence()
 
     @database_sync_to_async
     def create_message(self, sender, thread_id, content):
-        thread = ChatThread.objects.get(id=thread_id)
-        message = Message.objects.create(thread=thread, sender=sender, content=content)
+        # One short hop: participant check with relations preloaded, then the
+        # insert (and the thread counter UPDATE) in one time-limited transaction.
+        with transaction.atomic():
+            limit_statement_time(settings.CHAT_DB_TIMEOUT_SECONDS)
+            thread = (
+                ChatThread.objects
+                .filter(id=thread_id)
+                .filter(Q(user=sender) | Q(shop__owner=sender))
+                .select_related("shop", "shop__owner", "user")
+                .first()
+            )
+            if not thread:
+                return None
+            message = Message.objects.create(thread=thread, sender=sender, content=content)
 
         # Determine correct recipient and is_owner flag
-        if sender == thread.user:
+        if sender.id == thread.user_id:
             recipient = thread.shop.owner
             is_owner = "false"  # Customer is sending
         else:
             recipient = thread.user
             is_owner = "true"  # Owner is sending
 
+        notification = None
         # Safety: never notify sender
-        if recipient != sender:
-            print(f"[DEBUG] Sender: {sender.email}, Recipient: {recipient.email}")
-            chat_notification_data = {
-                "thread_id": str(thread.id),
-                "shop_id": str(thread.shop.id),
-                "shop_name": thread.shop.name,
-                "sender_email": sender.email,
-                "is_owner": is_owner,
-                "message": content,
+        if recipient.id != sender.id:
+            notification = {
+                "recipient_id": recipient.id,
+                "message": f"New message from {sender.name or sender.email}",
+                "data": {
+                    "thread_id": str(thread.id),
+                    "shop_id": str(thread.shop_id),
+                    "shop_name": thread.shop.name,
+                    "sender_email": sender.email,
+                    "is_owner": is_owner,
+                    "message": content,
+                },
             }
-            notify_user(
-                recipient,
-                f"New message from {sender.name or sender.email}",
-                notification_type="chat",
-                data=chat_notification_data,
-            )
 
-        return MessageSerializer(message).data, recipient.id
+        message_data = MessageSerializer(message, context={"thread": thread}).data
+        return message_data, recipient.id, notification
+
+    @sync_to_async(thread_sensitive=False)
+    def enqueue_notification(self, notification):
+        # Broker publish runs off the shared DB thread; a broker outage must not break chat
+        try:
+            send_chat_notification.delay(
+                notification["recipient_id"], notification["message"], notification["data"]
+            )
+        except Exception as e:
+            logger.error("Failed to queue chat notification for user %s: %s",
+                         notification["recipient_id"], e)
 
     async def handle_send_message(self, data):
+        started = time.perf_counter()
         user = self.scope["user"]
-        thread_id = data["thread_id"]
-        content = data["content"]
-        message_data, recipient_id = await self.create_message(user, thread_id, content)
+        thread_id = data.get("thread_id")
+        content = (data.get("content") or "").strip()
+        if not thread_id or not content:
+            await self.send_error("thread_id and content are required.")
+            return
 
-        # Send to recipient
-        await self.channel_layer.group_send(
-            f"user_{recipient_id}",
-            {"type": "chat_message", "message": message_data},
-        )
+        # No asyncio timeout here: cancelling the await would not stop the DB
+        # thread, and a write reported as failed could still commit. The limit
+        # is statement_timeout, which rolls the insert back.
+        try:
+            result = await self.create_message(user, thread_id, content)
+        except DatabaseError as e:
+            logger.error("Chat insert failed (user=%s thread=%s): %s", user.id, thread_id, e)
+            await self.send_error("Message could not be saved, please retry.")
+            return
+        if result is None:
+            await self.send_error("Thread not found or access denied.")
+            return
+        message_data, recipient_id, notification = result
+
+        # Fan out first; push/in-app notification is handled by a worker
+        try:
+            await asyncio.wait_for(
+                self.channel_layer.group_send(
+                    f"user_{recipient_id}",
+                    {"type": "chat_message", "message": message_data},
+                ),
+                timeout=settings.CHAT_FANOUT_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            # The message is stored; the recipient picks it up via thread sync
+            logger.warning("Chat fan-out timed out (thread=%s recipient=%s)", thread_id, recipient_id)
 
         # Send back to sender
         await self.send(text_data=json.dumps({"type": "chat_message", "message": message_data}))
 
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms > settings.CHAT_ECHO_LATENCY_BUDGET_MS:
+            logger.warning("Chat echo latency %.1fms over budget (%sms) thread=%s",
+                           elapsed_ms, settings.CHAT_ECHO_LATENCY_BUDGET_MS, thread_id)
+        else:
+            logger.debug("Chat echo latency %.1fms thread=%s", elapsed_ms, thread_id)
+
+        if notification:
+            await self.enqueue_notification(notification)
+
+    async def send_error(self, detail):
+        await self.send(text_data=json.dumps({"type": "error", "detail": detail}))
+
     @database_sync_to_async
     def mark_messages_as_read(self, thread_id, user):
-        return Message.objects.filter(thread_id=thread_id, is_read=False).exclude(sender=user).update(is_read=True)
+        # Advance the reader's watermark instead of flipping is_read on every row
+        thread = (
+            ChatThread.objects
+            .filter(id=thread_id)
+            .filter(Q(user=user) | Q(shop__owner=user))
+            .only("id", "user_id", "last_message_id")
+            .first()
+        )
+        if not thread:
+            return None
+        thread.mark_read_for(user)
+        return thread.last_message_id
 
     async def handle_mark_read(self, data):
         thread_id = data["thread_id"]
         user = self.scope["user"]
-        await self.mark_messages_as_read(thread_id, user)
-        await self.send(text_data=json.dumps({"type": "mark_read", "thread_id": thread_id}))
+        last_read_id = await self.mark_messages_as_read(thread_id, user)
+        await self.send(text_data=json.dumps({
+            "type": "mark_read",
+            "thread_id": thread_id,
+            "last_read_message_id": last_read_id,
+        }))
 
     async def chat_message(self, event):
         await self.send(text_data=json.dumps(event))
     
     async def notification(self, event):
-        await self.send(text_data=json.dumps(event))
\ No newline at end of file
+        await self.send(text_data=json.dumps(event))
+
+
+class SlotAvailabilityConsumer(AsyncWebsocketConsumer):
+    """
+    Live capacity for the calendar days a client is looking at.
+
+    -> {"action": "subscribe", "shop_id": 1, "service_id": 2, "date": "2025-01-31"}
+    <- {"type": "subscribed", ..., "slots": [...]}           (current snapshot)
+    <- {"type": "slot_capacity", "slots": [{"slot_id", "capacity_left", ...}]}
+    -> {"action": "unsubscribe", "shop_id": 1, "service_id": 2, "date": "2025-01-31"}
+
+    Dates are interpreted like SlotListView's `date` query param.
+    """
+    MAX_SUBSCRIPTIONS = 14
+
+    async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.close()
+            return
+        self.subscriptions = set()
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for group in getattr(self, "subscriptions", ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+            shop_id, service_id = int(data["shop_id"]), int(data["service_id"])
+            day = datetime.strptime(data["date"], "%Y-%m-%d").date()
+        except (ValueError, KeyError, TypeError):
+            await self.send_error("shop_id, service_id and date (YYYY-MM-DD) are required.")
+            return
+
+        group = slot_group_name(shop_id, service_id, day)
+        action = data.get("action")
+        if action == "subscribe":
+            if group not in self.subscriptions and len(self.subscriptions) >= self.MAX_SUBSCRIPTIONS:
+                await self.send_error(f"At most {self.MAX_SUBSCRIPTIONS} subscriptions per connection.")
+                return
+            # Join before taking the snapshot so no change can fall in between
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.subscriptions.add(group)
+            slots = await self.slot_snapshot(shop_id, service_id, day)
+            await self.send(text_data=json.dumps({
+                "type": "subscribed",
+                "shop_id": shop_id,
+                "service_id": service_id,
+                "date": data["date"],
+                "slots": slots,
+            }))
+        elif action == "unsubscribe":
+            await self.channel_layer.group_discard(group, self.channel_name)
+            self.subscriptions.discard(group)
+
+    @database_sync_to_async
+    def slot_snapshot(self, shop_id, service_id, day):
+        start_of_day = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        end_of_day = timezone.make_aware(datetime.combine(day, datetime.max.time()))
+        return [
+            {
+                "slot_id": slot_id,
+                "start_time": to_utc_iso(start_time),
+                "end_time": to_utc_iso(end_time),
+                "capacity_left": capacity_left,
+            }
+            for slot_id, start_time, end_time, capacity_left in (
+                Slot.objects
+                .filter(shop_id=shop_id, service_id=service_id,
+                        start_time__gte=start_of_day, start_time__lte=end_of_day)
+                .order_by("start_time")
+                .values_list("id", "start_time", "end_time", "capacity_left")
+            )
+        ]
+
+    async def send_error(self, detail):
+        await self.send(text_data=json.dumps({"type": "error", "detail": detail}))
+
+    async def slot_capacity(self, event):
+        await self.send(text_data=json.dumps(event))
@@ -0,0 +1,134 @@
+"""
+Latency benchmark for REST chat sends.
+
+Default mode compares the websocket fan-out of one chat message the old way
+(three sequential async_to_sync(group_send) calls) with the batched
+api.utils.realtime.broadcast helper, on throwaway groups:
+
+    python manage.py benchmark_chat_send --iterations 500
+
+--rest additionally times the full OwnerMessageView POST for an existing
+thread (as its shop owner). Each request runs in a transaction that is rolled
+back, but the websocket events ARE delivered to the thread's participants, so
+use a test thread:
+
+    python manage.py benchmark_chat_send --rest --thread-id 42 --iterations 100
+"""
+import statistics
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.utils.realtime import broadcast
+
+
+def _summary(samples_ms):
+    samples = sorted(samples_ms)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return (
+        f"mean={statistics.mean(samples):.2f}ms p50={pick(0.50):.2f}ms "
+        f"p95={pick(0.95):.2f}ms p99={pick(0.99):.2f}ms max={samples[-1]:.2f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark chat message send latency (websocket fan-out and REST)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--rest', action='store_true', help='Also time the full REST reply endpoint')
+        parser.add_argument('--thread-id', type=int, help='Thread used for --rest')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        layer = get_channel_layer()
+        self.stdout.write(f"Layer: {layer}")
+        self._bench_fanout(layer, iterations)
+        if options['rest']:
+            if not options['thread_id']:
+                raise CommandError("--rest requires --thread-id")
+            self._bench_rest(options['thread_id'], iterations)
+
+    def _bench_fanout(self, layer, iterations):
+        tag = uuid.uuid4().hex[:8]
+        recipient_group, sender_group = f"bench_{tag}_r", f"bench_{tag}_s"
+        channels = []
+
+        async def setup():
+            for group in (recipient_group, sender_group):
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                channels.append((group, channel))
+
+        async def teardown():
+            for group, channel in channels:
+                await layer.group_discard(group, channel)
+            if hasattr(layer, "ring_size"):
+                # Redis layer: drop the queued benchmark messages without touching other keys
+                for index in range(layer.ring_size):
+                    connection = layer.connection(index)
+                    for _group, channel in channels:
+                        await connection.delete(layer.prefix + layer.non_local_name(channel))
+
+        async_to_sync(setup)()
+        message = {"type": "chat_message", "message": {"id": 0, "content": "x" * 120}}
+        notification = {"type": "notification", "notification": {"id": 0, "message": "bench"}}
+
+        legacy, batched = [], []
+        try:
+            for _ in range(iterations):
+                started = time.perf_counter()
+                async_to_sync(layer.group_send)(recipient_group, notification)
+                async_to_sync(layer.group_send)(recipient_group, message)
+                async_to_sync(layer.group_send)(sender_group, message)
+                legacy.append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                broadcast([
+                    (recipient_group, notification),
+                    (recipient_group, message),
+                    (sender_group, message),
+                ])
+                batched.append((time.perf_counter() - started) * 1000)
+
+                # Keep queues below capacity so drops don't skew timings
+                if hasattr(layer, "channels"):
+                    layer.channels.clear()
+                elif len(legacy) % 50 == 0:
+                    async_to_sync(teardown)()
+                    channels.clear()
+                    async_to_sync(setup)()
+        finally:
+            async_to_sync(teardown)()
+
+        self.stdout.write(f"fan-out x3 legacy : {_summary(legacy)}")
+        self.stdout.write(f"fan-out x3 batched: {_summary(batched)}")
+
+    def _bench_rest(self, thread_id, iterations):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from api.models import ChatThread
+        from api.views import OwnerMessageView
+
+        thread = ChatThread.objects.select_related("shop__owner").filter(id=thread_id).first()
+        if not thread:
+            raise CommandError(f"Thread {thread_id} not found")
+        factory = APIRequestFactory()
+        view = OwnerMessageView.as_view()
+
+        samples = []
+        for i in range(iterations):
+            request = factory.post(f"/api/threads/{thread.id}/reply/", {"content": f"benchmark {i}"}, format="json")
+            force_authenticate(request, user=thread.shop.owner)
+            with transaction.atomic():
+                started = time.perf_counter()
+                response = view(request, thread_id=thread.id)
+                samples.append((time.perf_counter() - started) * 1000)
+                transaction.set_rollback(True)
+            if response.status_code != 200:
+                raise CommandError(f"Unexpected status {response.status_code}: {response.data}")
+
+        self.stdout.write(f"REST reply        : {_summary(samples)}")
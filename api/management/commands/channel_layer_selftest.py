@@ -0,0 +1,101 @@
+"""
+Multi-process delivery check for the channel layer.
+
+Spawns N independent Python processes (each with its own Django setup and
+channel layer instance, like separate uvicorn/Celery workers). Every child
+joins a test group and waits; the parent then group_sends one message and a
+direct message per child. The run passes only when every child receives both.
+
+    python manage.py channel_layer_selftest --procs 4
+
+With the in-memory layer this is expected to FAIL, which is the point: it
+shows that cross-process delivery needs the Redis layer.
+"""
+import asyncio
+import multiprocessing as mp
+import os
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _child(group, ready_q, result_q, timeout):
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fidden.settings")
+    django.setup()
+    from channels.layers import get_channel_layer
+
+    async def run():
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        ready_q.put((os.getpid(), channel))
+        received = {}
+        try:
+            while len(received) < 2:
+                message = await asyncio.wait_for(layer.receive(channel), timeout=timeout)
+                received[message["kind"]] = (time.time() - message["sent_at"]) * 1000
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await layer.group_discard(group, channel)
+        result_q.put((os.getpid(), received))
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = "Verify channel layer delivery across separate processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procs', type=int, default=3, help='Number of receiver processes (default: 3)')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for delivery')
+
+    def handle(self, *args, **options):
+        procs, timeout = options['procs'], options['timeout']
+        layer = get_channel_layer()
+        self.stdout.write(f"Layer: {layer}")
+
+        group = f"selftest_{uuid.uuid4().hex[:12]}"
+        ctx = mp.get_context("spawn")
+        ready_q, result_q = ctx.Queue(), ctx.Queue()
+        children = [ctx.Process(target=_child, args=(group, ready_q, result_q, timeout)) for _ in range(procs)]
+        for p in children:
+            p.start()
+
+        try:
+            channels = dict(ready_q.get(timeout=60) for _ in range(procs))
+        except Exception:
+            for p in children:
+                p.terminate()
+            raise CommandError("Receiver processes did not start in time")
+
+        async_to_sync(layer.group_send)(group, {"type": "selftest", "kind": "group", "sent_at": time.time()})
+        for channel in channels.values():
+            async_to_sync(layer.send)(channel, {"type": "selftest", "kind": "direct", "sent_at": time.time()})
+
+        results = {}
+        for _ in range(procs):
+            try:
+                pid, received = result_q.get(timeout=timeout + 30)
+            except Exception:
+                break
+            results[pid] = received
+        for p in children:
+            p.join(timeout=5)
+
+        failures = 0
+        for pid in channels:
+            received = results.get(pid, {})
+            ok = {"group", "direct"} <= set(received)
+            failures += 0 if ok else 1
+            detail = ", ".join(f"{k}={v:.1f}ms" for k, v in sorted(received.items())) or "nothing received"
+            style = self.style.SUCCESS if ok else self.style.ERROR
+            self.stdout.write(style(f"pid {pid}: {'OK' if ok else 'FAIL'} ({detail})"))
+
+        if failures:
+            raise CommandError(f"{failures}/{procs} processes missed messages")
+        self.stdout.write(self.style.SUCCESS(f"Cross-process delivery OK for {procs} processes"))
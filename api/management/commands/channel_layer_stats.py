@@ -0,0 +1,39 @@
+"""
+Print channel layer health: dropped-message counters, group sizes and
+per-channel queue depth across all Redis shards.
+
+    python manage.py channel_layer_stats
+    python manage.py channel_layer_stats --top 50 --reset
+"""
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Show channel layer metrics (group sizes, dropped messages, queue depth)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='How many largest groups/deepest queues to list')
+        parser.add_argument('--reset', action='store_true', help='Reset the dropped-message counters after printing')
+
+    def handle(self, *args, **options):
+        layer = get_channel_layer()
+        if not hasattr(layer, "collect_stats"):
+            raise CommandError(
+                f"{layer.__class__.__name__} does not expose metrics; "
+                "configure the Redis channel layer (CHANNEL_LAYER_BACKEND=redis)."
+            )
+
+        stats = async_to_sync(layer.collect_stats)(top=options['top'])
+        self.stdout.write(json.dumps(stats, indent=2))
+
+        if stats["queues"]["at_capacity"]:
+            self.stdout.write(self.style.WARNING(
+                f"{stats['queues']['at_capacity']} channel(s) at capacity ({stats['capacity']})"
+            ))
+        if options['reset']:
+            async_to_sync(layer.reset_metrics)()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
@@ -0,0 +1,32 @@
+"""
+Refresh the per-shop daily analytics rollups (api.models.ShopDailyRollup).
+
+    python manage.py rebuild_analytics_rollups            # days changed since the watermark
+    python manage.py rebuild_analytics_rollups --full     # every day, e.g. after bulk edits or deletes
+    python manage.py rebuild_analytics_rollups --shop 12 --days 30
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.utils.analytics_rollups import rebuild_shop_days, refresh_daily_rollups
+
+
+class Command(BaseCommand):
+    help = "Refresh per-shop daily analytics rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every day of every shop')
+        parser.add_argument('--shop', type=int, help='Recompute one shop only (with --days)')
+        parser.add_argument('--days', type=int, default=30, help='Days back to recompute for --shop (default: 30)')
+
+    def handle(self, *args, **options):
+        if options['shop']:
+            today = timezone.localdate()
+            days = [today - timedelta(days=i) for i in range(options['days'] + 1)]
+            count = rebuild_shop_days(options['shop'], days)
+            self.stdout.write(f"Recomputed {count} days for shop {options['shop']}")
+            return
+        shops, days = refresh_daily_rollups(full=options['full'])
+        self.stdout.write(f"Recomputed {days} days across {shops} shops")
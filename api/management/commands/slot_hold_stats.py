@@ -0,0 +1,23 @@
+"""
+Hold ledger health: outcome counts and hold-to-booking conversion rate.
+
+    python manage.py slot_hold_stats --hours 24
+    python manage.py slot_hold_stats --hours 168 --shop 12
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.utils.holds import hold_metrics
+
+
+class Command(BaseCommand):
+    help = "Show slot hold outcomes and the hold-to-booking conversion rate"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Look-back window (default: 24)')
+        parser.add_argument('--shop', type=int, help='Limit to one shop id')
+
+    def handle(self, *args, **options):
+        metrics = hold_metrics(hours=options['hours'], shop_id=options['shop'])
+        self.stdout.write(json.dumps(metrics, indent=2))
@@ -6,16 +6,32 @@ from channels.middleware import BaseMiddleware
 def get_user_from_token(token):
     # Import inside function to delay until apps are ready
     from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
     from django.contrib.auth.models import AnonymousUser
+    from accounts.services.auth_cache import cache_principal, get_cached_principal
 
     jwt_auth = JWTAuthentication()
     try:
+        # Signature/expiry check is CPU only; the DB lookup is what we cache
         validated_token = jwt_auth.get_validated_token(token)
+    except Exception:
+        return AnonymousUser()
+
+    jti = validated_token.get(jwt_settings.JTI_CLAIM)
+    if jti:
+        user = get_cached_principal(jti)
+        if user is not None:
+            return user
+
+    try:
         user = jwt_auth.get_user(validated_token)
-        return user
     except Exception:
         return AnonymousUser()
 
+    if jti:
+        cache_principal(jti, user, validated_token["exp"])
+    return user
+
 
 class JWTAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
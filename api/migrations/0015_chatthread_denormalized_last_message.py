@@ -0,0 +1,84 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_thread_inbox_state(apps, schema_editor):
+    ChatThread = apps.get_model('api', 'ChatThread')
+    Message = apps.get_model('api', 'Message')
+
+    for thread in ChatThread.objects.select_related('shop').iterator():
+        last = Message.objects.filter(thread_id=thread.id).order_by('-timestamp').first()
+        unread = Message.objects.filter(thread_id=thread.id, is_read=False)
+        if last:
+            thread.last_message_id = last.id
+            thread.last_message_sender_id = last.sender_id
+            thread.last_message_content = last.content
+            thread.last_message_at = last.timestamp
+            thread.last_activity_at = last.timestamp
+        else:
+            thread.last_activity_at = thread.created_at
+        thread.owner_unread_count = unread.filter(sender_id=thread.user_id).count() if thread.user_id else 0
+        thread.user_unread_count = unread.exclude(sender_id=thread.user_id).count() if thread.user_id else unread.count()
+        thread.save(update_fields=[
+            'last_message', 'last_message_sender', 'last_message_content', 'last_message_at',
+            'last_activity_at', 'owner_unread_count', 'user_unread_count',
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_notification_inbox_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_content',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='owner_unread_count',
+            field=models.PositiveIntegerField(default=0, help_text='Messages from the customer not yet read by the owner'),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='user_unread_count',
+            field=models.PositiveIntegerField(default=0, help_text='Messages from the shop not yet read by the customer'),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['user', '-last_activity_at'], name='thread_user_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['shop', '-last_activity_at'], name='thread_shop_activity_idx'),
+        ),
+        migrations.RunPython(backfill_thread_inbox_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_message_indexes_threadreadstate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('booking', 'Booking'), ('autofill', 'Auto-fill offer')], default='booking', max_length=12)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('converted', 'Converted'), ('expired', 'Expired'), ('released', 'Released')], default='active', max_length=10)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('slot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='api.slot')),
+                ('slot_booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='hold', to='api.slotbooking')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_holds', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='slothold_status_expiry_idx'), models.Index(fields=['slot', 'status'], name='slothold_slot_status_idx')],
+            },
+        ),
+    ]
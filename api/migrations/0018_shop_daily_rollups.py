@@ -0,0 +1,60 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_slothold_ledger'),
+        ('payments', '0009_campaigndelivery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShopDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('bookings_total', models.PositiveIntegerField(default=0)),
+                ('bookings_completed', models.PositiveIntegerField(default=0)),
+                ('bookings_cancelled', models.PositiveIntegerField(default=0)),
+                ('bookings_no_show', models.PositiveIntegerField(default=0)),
+                ('bookings_late_cancel', models.PositiveIntegerField(default=0)),
+                ('unique_customers', models.PositiveIntegerField(default=0)),
+                ('new_customers', models.PositiveIntegerField(default=0)),
+                ('repeat_customers', models.PositiveIntegerField(default=0)),
+                ('service_counts', models.JSONField(blank=True, default=dict)),
+                ('completed_service_counts', models.JSONField(blank=True, default=dict)),
+                ('hour_counts', models.JSONField(blank=True, default=dict)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ratingreview',
+            index=models.Index(fields=['created_at'], name='ratingreview_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='shopdailyrollup',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='api.shop'),
+        ),
+        migrations.AddConstraint(
+            model_name='shopdailyrollup',
+            constraint=models.UniqueConstraint(fields=('shop', 'date'), name='uniq_shop_daily_rollup'),
+        ),
+    ]
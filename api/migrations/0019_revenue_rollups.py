@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 22:04
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def merge_days_and_fill_running_totals(apps, schema_editor):
+    """Fold duplicate (shop, day) rows into one, then set the running totals."""
+    Revenue = apps.get_model('api', 'Revenue')
+
+    kept = {}
+    totals = defaultdict(Decimal)
+    duplicates = []
+    for row in Revenue.objects.order_by('shop_id', 'timestamp', 'id').iterator():
+        key = (row.shop_id, row.timestamp)
+        if key in kept:
+            kept[key].revenue += row.revenue
+            duplicates.append(row.id)
+        else:
+            kept[key] = row
+    Revenue.objects.filter(id__in=duplicates).delete()
+
+    for row in kept.values():  # insertion order is (shop, day)
+        totals[row.shop_id] += row.revenue
+        row.running_total = totals[row.shop_id]
+    Revenue.objects.bulk_update(kept.values(), ['revenue', 'running_total'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_shop_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='revenue',
+            name='running_total',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Shop revenue up to and including this day', max_digits=12),
+        ),
+        migrations.RunPython(merge_days_and_fill_running_totals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='revenue',
+            constraint=models.UniqueConstraint(fields=('shop', 'timestamp'), name='uniq_revenue_shop_day'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 22:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_revenue_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='last_offered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['shop', 'opted_in_offers', 'service'], name='waitlist_shop_optin_svc_idx'),
+        ),
+    ]
@@ -5,10 +5,11 @@ from django.db import models
 from django.conf import settings
 from datetime import timedelta
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
 import uuid
 from subscriptions.models import SubscriptionPlan,ShopSubscription
 from django.db import transaction
@@ -122,11 +123,15 @@ class Shop(models.Model):
         help_text="When daily snapshot was last sent (stored in UTC)"
     )
 
+    @property
+    def entitlements(self):
+        """Frozen plan entitlements (subscriptions.utils.entitlements), cached."""
+        from subscriptions.utils.entitlements import get_entitlements
+        return get_entitlements(self)
+
     @property
     def ranking_power(self):
-        if hasattr(self, 'subscription') and self.subscription.is_active:
-            return self.subscription.plan.ranking_power
-        return 0
+        return self.entitlements.ranking_power
 
     @property
     def subscription_features(self):
@@ -134,43 +139,14 @@ class Shop(models.Model):
         Returns a dictionary of feature flags for the shop's current plan.
         Returns default (most restrictive) values if no active subscription.
         """
-        if hasattr(self, 'subscription') and self.subscription.is_active:
-            plan = self.subscription.plan
-            return {
-                'deposit_customization': plan.deposit_customization,
-                'priority_marketplace_ranking': plan.priority_marketplace_ranking,
-                'advanced_calendar_tools': plan.advanced_calendar_tools,
-                'auto_followups': plan.auto_followups,
-                'ai_assistant': plan.ai_assistant,
-                'performance_analytics': plan.performance_analytics,
-                'ghost_client_reengagement': plan.ghost_client_reengagement,
-            }
-        # Default features for inactive/no subscription
-        return {
-            'deposit_customization': 'default',
-            'priority_marketplace_ranking': False,
-            'advanced_calendar_tools': False,
-            'auto_followups': False,
-            'ai_assistant': 'addon',
-            'performance_analytics': 'none',
-            'ghost_client_reengagement': False,
-        }
+        return self.entitlements.features
 
     ##update all service new method
     def update_all_service_deposits(self):
-        """Update all services' deposit amounts based on shop's default percentage"""
+        """Update all services' deposit amounts based on shop's default percentage (one UPDATE)"""
         if self.default_deposit_type == 'percentage' and self.default_deposit_percentage:
-            self.services.filter(deposit_type='percentage').update(
-                deposit_percentage=self.default_deposit_percentage
-            )
-            # Calculate deposit_amount for each service
-            for service in self.services.all():
-                service.deposit_type = 'percentage'
-                service.deposit_percentage = self.default_deposit_percentage
-                base_price = service.discount_price if service.discount_price and service.discount_price > 0 else service.price
-                if base_price:
-                    service.deposit_amount = (base_price * self.default_deposit_percentage) / 100
-                    service.save(update_fields=['deposit_amount'])
+            from .utils.plan_defaults import recalculate_service_deposits
+            recalculate_service_deposits(self.services.all(), self.default_deposit_percentage)
 
     ## New method toa add default value to the shop but subscription based
     def apply_plan_defaults(self, overwrite=False):
@@ -182,9 +158,7 @@ class Shop(models.Model):
         from .models import GlobalSettings  # local import to avoid circulars
         settings = GlobalSettings.get_settings()
 
-        plan = None
-        if hasattr(self, 'subscription') and self.subscription and self.subscription.plan:
-            plan = self.subscription.plan.name
+        plan = self.entitlements.plan_name
 
         # Defaults from GlobalSettings
         dep_required = settings.default_deposit_required
@@ -233,71 +207,96 @@ class Shop(models.Model):
         # NEW: Update all services after shop settings change
         self.update_all_service_deposits()
 
+    # Fields whose changes trigger side effects in save(). Their loaded values
+    # are kept from from_db(), so save() needs no SELECT to diff them.
+    TRACKED_FIELDS = ("status", "default_deposit_percentage")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._loaded_values = {
+            **getattr(self, "_loaded_values", {}),
+            **{
+                name: self.__dict__[name] for name in self.TRACKED_FIELDS
+                if (fields is None or name in fields) and name in self.__dict__
+            },
+        }
+
+    def _previous_values(self, names):
+        """Last saved values of tracked `names`; only fields never loaded are read from the DB."""
+        loaded = getattr(self, "_loaded_values", {})
+        missing = [name for name in names if name not in loaded]
+        if missing and self.pk and not self._state.adding:
+            row = Shop.objects.filter(pk=self.pk).values(*missing).first()
+            loaded = {**loaded, **(row or {})}
+        return {name: loaded.get(name) for name in names}
+
     def save(self, *args, **kwargs):
-            print(f"Shop save() called for {self.name}")
-            
-            # --- Get Old State ---
-            old_percentage = None
-            orig_status = None
-            send_verification_notification = False
+        update_fields = kwargs.get("update_fields")
+        creating = self._state.adding
+        tracked = [
+            name for name in self.TRACKED_FIELDS
+            if update_fields is None or name in update_fields
+        ]
+        previous = {} if creating else self._previous_values(tracked)
 
-            if self.pk:  # Existing shop
-                try:
-                    # Get the original state from the database
-                    orig_shop = Shop.objects.get(pk=self.pk)
-                    old_percentage = orig_shop.default_deposit_percentage
-                    orig_status = orig_shop.status
-                    print(f"Old status: {orig_status}, New status: {self.status}")
-                    print(f"Old percentage: {old_percentage}, New percentage: {self.default_deposit_percentage}")
-                    
-                    # Check if the status is changing from 'pending' to 'verified'
-                    if orig_status == 'pending' and self.status == 'verified':
-                        send_verification_notification = True
-                        
-                except Shop.DoesNotExist:
-                    pass # This is a new shop
-
-            # --- Logic to run *before* save ---
-            
-            # Auto-update is_verified based on status
-            if self.status == "verified":
-                self.is_verified = True
-            else:
-                self.is_verified = False
+        # Auto-update is_verified based on status
+        if update_fields is None or "status" in update_fields:
+            self.is_verified = self.status == "verified"
+            if update_fields is not None and "is_verified" not in update_fields:
+                kwargs["update_fields"] = [*update_fields, "is_verified"]
 
-            # --- Call the original save method ---
-            super().save(*args, **kwargs)
+        super().save(*args, **kwargs)
 
-            # --- Logic to run *after* save ---
+        self._loaded_values = {
+            **getattr(self, "_loaded_values", {}),
+            **{name: getattr(self, name) for name in tracked},
+        }
+        if creating:
+            return
+
+        # 1. Update services if deposit percentage changed
+        if (
+            "default_deposit_percentage" in previous
+            and previous["default_deposit_percentage"] != self.default_deposit_percentage
+        ):
+            logger.info(
+                "Shop %s deposit percentage changed %s -> %s; updating services",
+                self.id, previous["default_deposit_percentage"], self.default_deposit_percentage,
+            )
+            self.update_all_service_deposits()
 
-            # 1. Update services if deposit percentage changed
-            if old_percentage != self.default_deposit_percentage:
-                print(f"Percentage changed! Updating services...")
-                self.update_all_service_deposits()
-            else:
-                print("No percentage change detected")
+        # 2. Send notification if verification just happened
+        if previous.get("status") == "pending" and self.status == "verified" and self.owner_id:
+            transaction.on_commit(self._notify_owner_verified)
+
+    def _notify_owner_verified(self):
+        try:
+            from .utils.fcm import notify_user
+            logger.info("Shop %s verified, sending notification to owner %s", self.id, self.owner_id)
+
+            notify_user(
+                user=self.owner,
+                message="Congratulations! Your shop has been verified.", # This is the short message
+                notification_type="shop_verified", # For a deep link handler
+                data={
+                    "title": "Your Shop is Live! ✨",
+                    "summary": f"Congratulations! Your shop '{self.name}' has been verified by our team and is now live.",
+                    "deep_link": f"fidden://shop/{self.id}", # Example deep link
+                    "shop_id": str(self.id)
+                }
+            )
+        except Exception as e:
+            # Log the error but don't crash the save operation
+            logger.error("Failed to send verification push notification to owner %s: %s", self.owner_id, e, exc_info=True)
 
-            # 2. Send notification if verification just happened
-            if send_verification_notification and self.owner:
-                try:
-                    from .utils.fcm import notify_user
-                    logger.info(f"Shop {self.id} verified, sending notification to owner {self.owner.id}")
-                    
-                    notify_user(
-                        user=self.owner,
-                        message="Congratulations! Your shop has been verified.", # This is the short message
-                        notification_type="shop_verified", # For a deep link handler
-                        data={
-                            "title": "Your Shop is Live! ✨",
-                            "summary": f"Congratulations! Your shop '{self.name}' has been verified by our team and is now live.",
-                            "deep_link": f"fidden://shop/{self.id}", # Example deep link
-                            "shop_id": str(self.id)
-                        }
-                    )
-                except Exception as e:
-                    # Log the error but don't crash the save operation
-                    logger.error(f"Failed to send verification push notification to owner {self.owner.id}: {e}", exc_info=True)
-    
     # helper (not required but handy)
     def get_intervals_for_date(self, date_obj):
         """Return a list of (start_time, end_time) for a given date.
@@ -473,9 +472,7 @@ class Service(models.Model):
             from .models import GlobalSettings
             settings = GlobalSettings.get_settings()
 
-            plan = None
-            if hasattr(self.shop, 'subscription') and self.shop.subscription and self.shop.subscription.plan:
-                plan = self.shop.subscription.plan.name
+            plan = self.shop.entitlements.plan_name
 
             if plan == 'Foundation':
                 if self.is_deposit_required is False:
@@ -535,6 +532,9 @@ class RatingReview(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["created_at"], name="ratingreview_created_idx"),
+        ]
 
     def __str__(self):
         if self.user:
@@ -614,6 +614,13 @@ class Slot(models.Model):
             dt = self.start_time
         return f"Slot #{self.pk} @ {dt:%Y-%m-%d %H:%M}"
 
+@receiver(post_save, sender=Slot)
+def push_slot_capacity_change(sender, instance, created, update_fields=None, **kwargs):
+    # Bookings, holds and cancellations all save with update_fields=["capacity_left"]
+    if not created and update_fields and "capacity_left" in update_fields:
+        from api.utils.slot_events import slot_capacity_changed
+        slot_capacity_changed([instance.id])
+
 class SlotBooking(models.Model):
     STATUS_CHOICES = [
         ('confirmed', 'Confirmed'),
@@ -658,6 +665,50 @@ class SlotBooking(models.Model):
         return f"Booking #{self.pk} @ {dt:%Y-%m-%d %H:%M}"
 
 
+class SlotHold(models.Model):
+    """
+    Ledger of capacity reserved for a pending (unpaid) SlotBooking.
+
+    Each hold owns one unit of Slot.capacity_left, so a slot can carry as many
+    concurrent holds as it has capacity. Holds end as `converted` (payment
+    succeeded), `released` (cancelled by user/task) or `expired` (released in
+    bulk by api.tasks.release_expired_slot_holds).
+    """
+    STATUS_ACTIVE = 'active'
+    STATUS_CONVERTED = 'converted'
+    STATUS_EXPIRED = 'expired'
+    STATUS_RELEASED = 'released'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_CONVERTED, 'Converted'),
+        (STATUS_EXPIRED, 'Expired'),
+        (STATUS_RELEASED, 'Released'),
+    ]
+    SOURCE_CHOICES = [
+        ('booking', 'Booking'),
+        ('autofill', 'Auto-fill offer'),
+    ]
+
+    slot = models.ForeignKey(Slot, on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='slot_holds')
+    slot_booking = models.OneToOneField(SlotBooking, on_delete=models.CASCADE, related_name='hold')
+    source = models.CharField(max_length=12, choices=SOURCE_CHOICES, default='booking')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Sweeper: active holds past expiry
+            models.Index(fields=['status', 'expires_at'], name='slothold_status_expiry_idx'),
+            models.Index(fields=['slot', 'status'], name='slothold_slot_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Hold #{self.pk} slot={self.slot_id} ({self.status})"
+
+
 class BookingAddOn(models.Model):
     """
     Represents an additional service added to a main booking.
@@ -765,13 +816,151 @@ class ChatThread(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name="threads")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized inbox state, maintained by `update_thread_on_new_message`
+    # so the thread list never has to look at the messages table.
+    last_message = models.ForeignKey(
+        "Message", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    last_message_sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    last_message_content = models.TextField(blank=True, default="")
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    user_unread_count = models.PositiveIntegerField(default=0, help_text="Messages from the shop not yet read by the customer")
+    owner_unread_count = models.PositiveIntegerField(default=0, help_text="Messages from the customer not yet read by the owner")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-last_activity_at"], name="thread_user_activity_idx"),
+            models.Index(fields=["shop", "-last_activity_at"], name="thread_shop_activity_idx"),
+        ]
+
+    def unread_count_for(self, user):
+        if user.id == self.user_id:
+            return self.user_unread_count
+        return self.owner_unread_count
+
+    def _unread_field_for(self, user):
+        return "user_unread_count" if user.id == self.user_id else "owner_unread_count"
+
+    def reset_unread_for(self, user):
+        """Zero the reader's unread counter with a single UPDATE."""
+        field = self._unread_field_for(user)
+        ChatThread.objects.filter(pk=self.pk).update(**{field: 0})
+        setattr(self, field, 0)
+
+    def mark_read_for(self, user):
+        """
+        Move the participant's read watermark up to the thread's last message
+        and drain their unread counter. Individual Message rows are not touched.
+
+        The watermark only moves forward (Greatest), so a stale instance can't
+        lower it. The counter is zeroed only if no message arrived since
+        `last_message_id` was loaded; otherwise it is recounted from the
+        messages above the watermark, so a concurrent increment is never lost.
+        """
+        read_up_to = self.last_message_id or 0
+        ThreadReadState.objects.bulk_create(
+            [ThreadReadState(thread=self, user=user, last_read_message_id=read_up_to)],
+            ignore_conflicts=True,
+        )
+        ThreadReadState.objects.filter(thread=self, user=user).update(
+            last_read_message_id=Greatest(F("last_read_message_id"), Value(read_up_to)),
+            updated_at=timezone.now(),
+        )
+
+        field = self._unread_field_for(user)
+        drained = ChatThread.objects.filter(pk=self.pk, last_message_id=self.last_message_id).update(**{field: 0})
+        if not drained:
+            # Same rule as update_thread_on_new_message: the owner side counts
+            # the customer's messages, the customer side everyone else's.
+            from_other_side = Q(sender_id=self.user_id) if field == "owner_unread_count" else ~Q(sender_id=self.user_id)
+            watermark = ThreadReadState.objects.filter(
+                thread=self, user=user
+            ).values_list("last_read_message_id", flat=True).first() or 0
+            unread = (
+                Message.objects
+                .filter(from_other_side, thread_id=OuterRef("pk"), id__gt=watermark)
+                .order_by()
+                .values("thread_id")
+                .annotate(n=Count("id"))
+                .values("n")
+            )
+            ChatThread.objects.filter(pk=self.pk).update(
+                **{field: Coalesce(Subquery(unread, output_field=models.PositiveIntegerField()), Value(0))}
+            )
+            self.refresh_from_db(fields=[field])
+        else:
+            setattr(self, field, 0)
+
+        # Reading the thread re-arms chat push for the next message
+        from api.utils.presence import reset_chat_push_window
+        reset_chat_push_window(user.id, self.id)
+
 class Message(models.Model):
     thread = models.ForeignKey(ChatThread, on_delete=models.CASCADE, related_name="messages")
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
+    # Legacy per-row flag; read state now lives in ThreadReadState watermarks.
     is_read = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # History pages (cursor on -timestamp) and "since id" delta sync
+            models.Index(fields=["thread", "-timestamp"], name="message_thread_ts_idx"),
+            models.Index(fields=["thread", "id"], name="message_thread_id_idx"),
+        ]
+
+
+class ThreadReadState(models.Model):
+    """
+    Per-participant read watermark: every message in `thread` with
+    id <= last_read_message_id has been read by `user`.
+    """
+    thread = models.ForeignKey(ChatThread, on_delete=models.CASCADE, related_name="read_states")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="thread_read_states")
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["thread", "user"], name="uniq_thread_read_state")
+        ]
+
+    def __str__(self):
+        return f"Thread #{self.thread_id} read by {self.user_id} up to {self.last_read_message_id}"
+
+
+@receiver(post_save, sender=Message)
+def update_thread_on_new_message(sender, instance, created, **kwargs):
+    """
+    Keep ChatThread's last-message snapshot and unread counters in sync.
+    One UPDATE, no reads: the recipient side is resolved in SQL by comparing
+    the sender with the thread's customer.
+    """
+    if not created:
+        return
+    sent_by_customer = Q(user_id=instance.sender_id)
+    ChatThread.objects.filter(pk=instance.thread_id).update(
+        last_message_id=instance.id,
+        last_message_sender_id=instance.sender_id,
+        last_message_content=instance.content,
+        last_message_at=instance.timestamp,
+        last_activity_at=instance.timestamp,
+        owner_unread_count=Case(
+            When(sent_by_customer, then=F("owner_unread_count") + 1),
+            default=F("owner_unread_count"),
+            output_field=models.PositiveIntegerField(),
+        ),
+        user_unread_count=Case(
+            When(sent_by_customer, then=F("user_unread_count")),
+            default=F("user_unread_count") + 1,
+            output_field=models.PositiveIntegerField(),
+        ),
+    )
+
 class Device(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="devices", on_delete=models.CASCADE)
     fcm_token = models.CharField(max_length=255)
@@ -788,6 +977,39 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Inbox listing: newest first per recipient (cursor pagination)
+            models.Index(fields=['recipient', '-created_at'], name='notif_recipient_created_idx'),
+            # Unread counters / bulk mark-read
+            models.Index(fields=['recipient', 'is_read'], name='notif_recipient_read_idx'),
+        ]
+
+
+class ArchivedNotification(models.Model):
+    """
+    Cold storage for notifications moved out of the live inbox by
+    `api.tasks.archive_old_notifications`. Not exposed through the API.
+    """
+    original_id = models.BigIntegerField(db_index=True)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_notifications")
+    message = models.CharField(max_length=512)
+    notification_type = models.CharField(max_length=50, default="chat")
+    data = models.JSONField(default=dict, blank=True)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+
+@receiver(post_save, sender=Notification)
+def bump_unread_notification_counter(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        from api.utils.notifications import adjust_unread_count
+        adjust_unread_count(instance.recipient_id, 1)
+
 class Revenue(models.Model):
     shop = models.ForeignKey(
         "Shop",
@@ -803,11 +1025,20 @@ class Revenue(models.Model):
         auto_now_add=True,
         help_text="Revenue record date"
     )
+    running_total = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        help_text="Shop revenue up to and including this day"
+    )
 
     class Meta:
         ordering = ["-timestamp"]
         verbose_name = "Revenue"
         verbose_name_plural = "Revenues"
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "timestamp"], name="uniq_revenue_shop_day"),
+        ]
 
     def __str__(self):
         return f"{self.shop.name} – {self.revenue} at {self.timestamp:%Y-%m-%d}"
@@ -918,14 +1149,9 @@ class GlobalSettings(models.Model):
 # Update the GlobalSettings signal
 @receiver(post_save, sender=GlobalSettings)
 def update_foundation_shops_on_settings_change(sender, instance, **kwargs):
-    foundation_shops = Shop.objects.filter(
-        subscription__plan__name=SubscriptionPlan.FOUNDATION,
-        subscription__status=ShopSubscription.STATUS_ACTIVE
-    )
-
-    for shop in foundation_shops:
-        shop.apply_plan_defaults(overwrite=True)
-        # This will now also update all services via update_all_service_deposits()
+    # Chunked background job (api.tasks.propagate_global_settings), queued after commit
+    from .utils.plan_defaults import schedule_propagation
+    schedule_propagation()
 
 class PerformanceAnalytics(models.Model):
     shop = models.OneToOneField(Shop, on_delete=models.CASCADE, related_name='analytics')
@@ -943,6 +1169,81 @@ class PerformanceAnalytics(models.Model):
 
     def __str__(self):
         return f"Analytics for {self.shop.name}"
+
+
+class ShopDailyRollup(models.Model):
+    """
+    Per-shop, per-day booking and rating counters (day = booking creation
+    date). Maintained incrementally by api.utils.analytics_rollups; shop
+    analytics are summed from these rows instead of scanning bookings.
+    """
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+    bookings_total = models.PositiveIntegerField(default=0)
+    bookings_completed = models.PositiveIntegerField(default=0)
+    bookings_cancelled = models.PositiveIntegerField(default=0)
+    bookings_no_show = models.PositiveIntegerField(default=0)
+    bookings_late_cancel = models.PositiveIntegerField(default=0)
+    unique_customers = models.PositiveIntegerField(default=0)
+    # Customers whose first / second booking at the shop was made this day
+    new_customers = models.PositiveIntegerField(default=0)
+    repeat_customers = models.PositiveIntegerField(default=0)
+    # {service_id: count} over all / completed bookings, {hour: count} by slot start hour
+    service_counts = models.JSONField(default=dict, blank=True)
+    completed_service_counts = models.JSONField(default=dict, blank=True)
+    hour_counts = models.JSONField(default=dict, blank=True)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'date'], name='uniq_shop_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"Rollup {self.shop_id} {self.date}"
+
+
+class RollupWatermark(models.Model):
+    """High-water mark of an incremental job: changes before `position` are already applied."""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class RollupDirtyDay(models.Model):
+    """
+    A (shop, day) whose rollup must be recomputed on the next refresh because
+    of a change the updated_at watermark can't see: a deleted booking, or a
+    deleted or edited review. Plain shop_id, so rows written while a shop is
+    being deleted don't break the cascade.
+    """
+    shop_id = models.BigIntegerField()
+    date = models.DateField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Dirty {self.shop_id} {self.date}"
+
+
+@receiver(post_delete, sender="payments.Booking", dispatch_uid="rollups_booking_deleted")
+def on_booking_deleted_mark_rollup(sender, instance, **kwargs):
+    from api.utils.analytics_rollups import mark_booking_deleted
+    mark_booking_deleted(instance)
+
+
+@receiver(post_save, sender=RatingReview, dispatch_uid="rollups_review_saved")
+@receiver(post_delete, sender=RatingReview, dispatch_uid="rollups_review_deleted")
+def on_review_changed_mark_rollup(sender, instance, created=False, **kwargs):
+    # New reviews are picked up by created_at; edits and deletes are not
+    if created:
+        return
+    from api.utils.analytics_rollups import mark_days_dirty
+    mark_days_dirty(instance.shop_id, [instance.created_at])
     
 
 
@@ -1056,9 +1357,15 @@ class WaitlistEntry(models.Model):
     service = models.ForeignKey(Service, on_delete=models.CASCADE, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     opted_in_offers = models.BooleanField(default=True, help_text="User agrees to receive short-notice offers.")
-    
+    # Last auto-fill offer sent to this user for the shop (api.utils.waitlist)
+    last_offered_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         unique_together = ('user', 'shop', 'service')
+        indexes = [
+            # Candidate ranking: opted-in entries of a shop
+            models.Index(fields=['shop', 'opted_in_offers', 'service'], name='waitlist_shop_optin_svc_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} on waitlist for {self.shop.name}"
@@ -28,4 +28,17 @@ class ReviewCursorPagination(CursorPagination):
 
 class MessageCursorPagination(CursorPagination):
     page_size = 10
-    ordering = '-timestamp'
\ No newline at end of file
+    ordering = '-timestamp'
+
+class NotificationCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'top'
+    max_page_size = 100
+    ordering = '-created_at'  # served by the (recipient, -created_at) index
+
+
+class ThreadCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'top'
+    max_page_size = 100
+    ordering = '-last_activity_at'  # keyset on the denormalized activity time
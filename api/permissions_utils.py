@@ -27,8 +27,8 @@ class PlanBasedPermissionMixin:
                 return SubscriptionPlan.FOUNDATION
         
         # Get subscription from the shop (not the service)
-        if shop and hasattr(shop, 'subscription') and shop.subscription.is_active:
-            return shop.subscription.plan.name
+        if shop:
+            return shop.entitlements.active_plan_name
         return SubscriptionPlan.FOUNDATION
     
     def check_field_permission(self, field_name, plan_name, validated_data):
@@ -126,11 +126,7 @@ def get_modification_permissions(user):
     Returns a dictionary with permission flags.
     """
     try:
-        shop = user.shop
-        if hasattr(shop, 'subscription') and shop.subscription.is_active:
-            plan_name = shop.subscription.plan.name
-        else:
-            plan_name = SubscriptionPlan.FOUNDATION
+        plan_name = user.shop.entitlements.active_plan_name
     except:
         plan_name = SubscriptionPlan.FOUNDATION
     
@@ -1,7 +1,8 @@
 # api/routing.py
 from django.urls import re_path
-from .consumers import ChatConsumer
+from .consumers import ChatConsumer, SlotAvailabilityConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/$', ChatConsumer.as_asgi()),
+    re_path(r'ws/slots/$', SlotAvailabilityConsumer.as_asgi()),
 ]
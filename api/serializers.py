@@ -33,6 +33,7 @@ from math import radians, cos, sin, asin, sqrt
 from django.db.models.functions import Coalesce
 from django.db.models import Avg, Count, Q, Value, FloatField
 from api.utils.helper_function import get_distance
+from api.utils.holds import create_hold
 from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
@@ -583,6 +584,12 @@ class SlotBookingSerializer(serializers.ModelSerializer):
             slot.capacity_left -= 1
             slot.save(update_fields=['capacity_left'])
 
+            # Hold flows (SlotBookingView, HoldSlotAndBookView) keep the unit only
+            # until payment or hold expiry; checkout bookings have no expiry
+            hold_source = self.context.get("hold_source")
+            if hold_source:
+                create_hold(booking, source=hold_source)
+
         return booking
 
 class ShopListSerializer(serializers.Serializer):
@@ -1060,23 +1067,38 @@ class ShopRatingReviewSerializer(serializers.ModelSerializer):
 class MessageSerializer(serializers.ModelSerializer):
     sender_email = serializers.CharField(source="sender.email", read_only=True)
     sender_id = serializers.SerializerMethodField()
-    thread_id = serializers.IntegerField(source="thread.id", read_only=True)
+    thread_id = serializers.IntegerField(read_only=True)
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
         fields = ["id", "thread_id", "sender_id", "sender_email", "content", "timestamp", "is_read"]
 
     def get_sender_id(self, obj):
-        # If the sender is the shop owner, return the shop id; otherwise return the user id
+        # If the sender is the shop owner, return the shop id; otherwise return the user id.
+        # Views listing one thread pass it in context (with shop preloaded) to avoid
+        # walking thread.shop.owner per message.
         try:
-            if obj.thread and obj.thread.shop and obj.thread.shop.owner_id == obj.sender_id:
-                return obj.thread.shop_id
+            thread = self.context.get("thread") or obj.thread
+            if thread and thread.shop and thread.shop.owner_id == obj.sender_id:
+                return thread.shop_id
         except Exception:
             pass
         return obj.sender_id
 
+    def get_is_read(self, obj):
+        # Views pass the participants' read watermarks ({user_id: last_read_message_id})
+        # together with the thread; a message is read once its recipient's watermark passes it.
+        read_upto = self.context.get("read_upto")
+        thread = self.context.get("thread")
+        if obj.is_read or read_upto is None or thread is None:
+            return obj.is_read
+        recipient_id = thread.shop.owner_id if obj.sender_id == thread.user_id else thread.user_id
+        return obj.id <= read_upto.get(recipient_id, 0)
+
 class ChatThreadSerializer(serializers.ModelSerializer):
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
     shop_name = serializers.CharField(source="shop.name", read_only=True)
     user_email = serializers.CharField(source="user.email", read_only=True)
     user_name = serializers.CharField(source="user.name", read_only=True)
@@ -1095,18 +1117,41 @@ class ChatThreadSerializer(serializers.ModelSerializer):
             "user_name",
             "user_img",
             "last_message",
+            "unread_count",
+            "last_activity_at",
             "created_at",
         ]
 
     def get_last_message(self, obj):
-        request = self.context.get('request')
+        """
+        Built from the denormalized columns on ChatThread (no per-thread query).
+        Same shape as MessageSerializer. Needs `last_message_sender` and `shop`
+        to be select_related by the caller.
+        """
         last_message_only = self.context.get('last_message_only', False)
+        if not last_message_only or not obj.last_message_id:
+            return None
+
+        sender_id = obj.last_message_sender_id
+        sent_by_owner = sender_id is not None and sender_id == obj.shop.owner_id
+        # Read by the recipient when the recipient's unread counter is drained
+        recipient_unread = obj.user_unread_count if sent_by_owner else obj.owner_unread_count
+        sender = obj.last_message_sender
+        return {
+            "id": obj.last_message_id,
+            "thread_id": obj.id,
+            "sender_id": obj.shop_id if sent_by_owner else sender_id,
+            "sender_email": sender.email if sender else None,
+            "content": obj.last_message_content,
+            "timestamp": serializers.DateTimeField().to_representation(obj.last_message_at) if obj.last_message_at else None,
+            "is_read": recipient_unread == 0,
+        }
 
-        if last_message_only:
-            last_message = obj.messages.order_by('-timestamp').first()
-            if last_message:
-                return MessageSerializer(last_message, context={'request': request}).data
-        return None
+    def get_unread_count(self, obj):
+        request = self.context.get('request')
+        if not request:
+            return None
+        return obj.unread_count_for(request.user)
 
     def to_representation(self, instance):
         rep = super().to_representation(instance)
@@ -1182,7 +1227,7 @@ class DeviceSerializer(serializers.ModelSerializer):
         return device
 
 class RevenueSerializer(serializers.ModelSerializer):
-    shop_id = serializers.ReadOnlyField(source='shop.id')
+    shop_id = serializers.ReadOnlyField()
 
     class Meta:
         model = Revenue
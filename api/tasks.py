@@ -5,22 +5,18 @@ from datetime import datetime, timedelta
 from django.utils import timezone
 from django.conf import settings
 from celery import shared_task
-from django.core.mail import send_mail
 from django.db.models import Count, Avg, Sum, F
-from api.utils.phones import get_user_phone
+from api.utils.slot_events import slot_capacity_changed
 from api.utils.slots import generate_slots_for_service
-from api.utils.sms import send_sms
-from api.utils.zapier import send_klaviyo_event
-from payments.models import Booking, TransactionLog
+from payments.models import Booking
 from .models import AutoFillLog, Notification, PerformanceAnalytics, Revenue, Service, Slot, SlotBooking, Shop, WeeklySummary
 from api import models
 from .utils.fcm import notify_user, send_push_notification
 from subscriptions.models import SubscriptionPlan
 from django.db import transaction
 from django.contrib.auth import get_user_model
-import time, uuid, json
+import time, uuid
 from django.utils.timezone import now as tz_now
-from api.utils.sms import send_sms
 
 logger = logging.getLogger(__name__)
 
@@ -38,436 +34,190 @@ from subscriptions.models import SubscriptionPlan, ShopSubscription
 @shared_task(name="api.tasks.generate_weekly_ai_reports", bind=True, max_retries=2, default_retry_delay=60)
 def generate_weekly_ai_reports(self):
     """
-    Generates weekly AI reports for eligible shops.
-    
-    V1 Fix: Added idempotency check using shop timezone to prevent duplicate sends.
+    Fan out the weekly AI reports for eligible shops.
+
+    Metrics for every eligible shop are computed here with one grouped query
+    per metric (api.utils.weekly_reports), then shops are delivered in
+    batches of WEEKLY_REPORT_BATCH_SIZE by generate_weekly_ai_report_batch.
+    Shops already sent this week (shop timezone) are skipped.
     """
+    from api.utils.analytics_rollups import refresh_daily_rollups
     from api.utils.timezone_helpers import was_sent_this_week
-    
+    from api.utils.weekly_reports import collect_weekly_metrics, serialize_metrics
+
     logger.info("Starting weekly AI report generation...")
 
-    eligible_shops = Shop.objects.select_related(
-        "owner", "subscription", "subscription__plan"
-    ).filter(
+    eligible_shops = Shop.objects.filter(
         # EITHER the plan includes AI (like Icon)
         Q(subscription__plan__ai_assistant=SubscriptionPlan.AI_INCLUDED) |
         # OR the user has purchased the AI add-on
         Q(subscription__has_ai_addon=True)
-    ).distinct()
-    
-    if not eligible_shops.exists():
+    ).distinct().only("id", "owner_id", "time_zone", "last_weekly_wrap_sent_at")
+
+    shops = [
+        shop for shop in eligible_shops
+        if shop.owner_id and not was_sent_this_week(shop, shop.last_weekly_wrap_sent_at)
+    ]
+    if not shops:
         logger.info("No shops eligible for AI reports this week.")
         return "No shops"
 
-    for shop in eligible_shops.iterator():
-        from zoneinfo import ZoneInfo
-        
-        # Get shop's timezone
-        try:
-            shop_tz = ZoneInfo(shop.time_zone)
-        except Exception:
-            shop_tz = ZoneInfo("UTC")
-            
-        # Calculate window based on Shop's Local Time
-        # We want the last 7 days ending NOW (shop time)
-        now_loc = timezone.now().astimezone(shop_tz)
-        
-        end_dt = now_loc
-        start_dt = end_dt - timedelta(days=7)
-        
-        # Comparison window (previous week)
-        prev_start = start_dt - timedelta(days=7)
-        prev_end = start_dt
-
-        # V1 IDEMPOTENCY CHECK: Skip if already sent this week (using shop timezone)
-        if was_sent_this_week(shop, shop.last_weekly_wrap_sent_at):
-            logger.info(f"Skipping shop {shop.id} - weekly wrap already sent this week (shop tz: {shop.time_zone})")
-            continue
-        
-        owner = shop.owner
-        if not owner:
-            continue
-
-        #
-        # 1. BOOKINGS THIS WEEK
-        #
-        paid_this_week = (
-            Booking.objects
-            .filter(
-                shop=shop,
-                status="completed",
-                created_at__gte=start_dt,
-                created_at__lte=end_dt,
-            )
-            .select_related("slot", "slot__service")  # slot is SlotBooking, slot.service is Service
+    end_dt = timezone.now()
+    start_dt = end_dt - timedelta(days=7)
+    refresh_daily_rollups()  # the appointment figures come from the rollups
+    metrics = serialize_metrics(collect_weekly_metrics(shops, start_dt, end_dt))
+
+    batch_size = max(1, getattr(settings, "WEEKLY_REPORT_BATCH_SIZE", 25))
+    batches = 0
+    for i in range(0, len(shops), batch_size):
+        shop_ids = [shop.id for shop in shops[i:i + batch_size]]
+        generate_weekly_ai_report_batch.delay(
+            shop_ids, end_dt.isoformat(), {str(sid): metrics[str(sid)] for sid in shop_ids}
         )
+        batches += 1
 
-        total_appointments = paid_this_week.count()
+    logger.info(f"Queued weekly AI reports for {len(shops)} shops in {batches} batches.")
+    return f"Queued {len(shops)} shops"
 
-        #
-        # 2. REVENUE THIS WEEK (sum TransactionLog.payment-type rows for this shop in window)
-        #
-        total_revenue = (
-            TransactionLog.objects
-            .filter(
-                shop=shop,
-                transaction_type="payment",
-                created_at__gte=start_dt,
-                created_at__lte=end_dt,
-            )
-            .aggregate(s=Sum("amount"))["s"]
-            or Decimal("0.00")
-        )
-
-        #
-        # 3. PREVIOUS WEEK REVENUE (for growth_rate)
-        #
-        prev_revenue = (
-            TransactionLog.objects
-            .filter(
-                shop=shop,
-                transaction_type="payment",
-                created_at__gte=prev_start,
-                created_at__lte=prev_end,
-            )
-            .aggregate(s=Sum("amount"))["s"]
-            or Decimal("0.00")
-        )
-
-        if prev_revenue > 0:
-            growth_rate = float(((total_revenue - prev_revenue) / prev_revenue) * 100)
-        else:
-            growth_rate = 0.0
-
-        #
-        # V1 FIX: REVENUE BREAKDOWN (deposits, checkout, tips)
-        # For better dashboard data credibility
-        #
-        from payments.models import Payment
-        
-        # Get all completed payments for this shop in the time window
-        completed_payments = Payment.objects.filter(
-            booking__shop=shop,
-            status="succeeded",
-            created_at__gte=start_dt,
-            created_at__lte=end_dt,
-        )
-        
-        # Deposits: Sum of deposit_paid where is_deposit=True
-        revenue_deposits = completed_payments.filter(
-            is_deposit=True
-        ).aggregate(
-            total=Sum("deposit_paid")
-        )["total"] or Decimal("0.00")
-        
-        # Tips: Sum of tips_amount from all payments
-        revenue_tips = completed_payments.aggregate(
-            total=Sum("tips_amount")
-        )["total"] or Decimal("0.00")
-        
-        # Checkout: Sum of balance_paid (remaining amount paid at checkout)
-        revenue_checkout = completed_payments.aggregate(
-            total=Sum("balance_paid")
-        )["total"] or Decimal("0.00")
-        # Add tips to checkout since tips are collected at checkout
-        revenue_checkout = revenue_checkout + revenue_tips
-
-        #
-        # 4. REBOOKING RATE
-        #    % of unique clients from last 7 days who ALSO booked (completed) >=2 times in last 30 days
-        #
-        last_30 = end_dt - timedelta(days=30)
-
-        clients_this_week = paid_this_week.values_list("user_id", flat=True).distinct()
-
-        rebooked_clients = (
-            Booking.objects
-            .filter(
-                shop=shop,
-                status="completed",
-                user_id__in=clients_this_week,
-                created_at__gte=last_30,
-                created_at__lte=end_dt,
-            )
-            .values("user_id")
-            .annotate(c=Count("id"))
-            .filter(c__gte=2)
-            .count()
-        )
-
-        unique_clients = len(set(clients_this_week))
-        rebooking_rate = (rebooked_clients / unique_clients * 100.0) if unique_clients else 0.0
-
-        #
-        # 5. NO-SHOW RECOVERY
-        #
-        no_shows_filled = (
-            AutoFillLog.objects
-            .filter(
-                shop=shop,
-                status="completed",
-                created_at__gte=start_dt,
-                created_at__lte=end_dt,
-                filled_by_booking__isnull=False,
-            )
-            .values("filled_by_booking_id")
-            .distinct()
-            .count()
-        )
-
-        #
-        # 6. TOP SERVICE
-        #
-        top_service_name = ""
-        top_service_count = 0
-        top_service_row = (
-            paid_this_week
-            .values("slot__service_id", "slot__service__title")
-            .annotate(cnt=Count("id"))
-            .order_by("-cnt")
-            .first()
-        )
-        if top_service_row:
-            top_service_name = top_service_row["slot__service__title"] or ""
-            top_service_count = top_service_row["cnt"]
-
-        #
-        # 7. NEXT WEEK FORECAST
-        #
-        next_week_start = (end_dt + timedelta(days=1)).date()
-        next_week_end = next_week_start + timedelta(days=6)
-
-        open_slots_next_week = Slot.objects.filter(
-            shop=shop,
-            start_time__date__gte=next_week_start,
-            start_time__date__lte=next_week_end,
-            capacity_left__gt=0,
-        ).count()
-
-        avg_ticket = (total_revenue / total_appointments) if total_appointments else Decimal("0.00")
-        forecast_estimated_revenue = avg_ticket * Decimal(open_slots_next_week)
-
-        #
-        # 8. COACHING TEXT / CTA CARDS
-        #
-        ai_motivation = (
-            "You didn’t just serve clients — you built confidence and trust this week. "
-            "Let’s carry that momentum into next week."
-        )
-
-        revenue_booster_text = (
-            f"Promote your {top_service_name} first thing Monday. "
-            f"It was booked {top_service_count} times this week and drove great reviews. "
-            "Want me to generate an IG caption + booking link?"
-            if top_service_name
-            else
-            "Promote your top service in Stories Monday morning. "
-            "Ask people to DM you for a spot — I can draft the caption + link."
-        )
 
-        retention_play_text = (
-            "Some clients haven’t rebooked yet. Offer them a ‘Next Week Loyalty Boost’ — "
-            "10% off if they book within 7 days. Want me to prep that SMS blast?"
-        )
-
-        ai_recommendations = {
-            "revenue_booster": {
-                "headline": "Revenue Booster",
-                "text": revenue_booster_text,
-                "cta_label": "Yes, Create It",
-                "cta_action": "generate_marketing_caption",
-            },
-            "retention_play": {
-                "headline": "Retention Play",
-                "text": retention_play_text,
-                "cta_label": "Send via Email",
-                "cta_action": "send_loyalty_email",   # <-- changed from send_loyalty_sms
-            },
-            "forecast": {
-                "open_slots_next_week": open_slots_next_week,
-                "forecast_estimated_revenue": float(forecast_estimated_revenue),
-            },
-        }
-
-        #
-        # 9. SAVE WeeklySummary
-        #
-        summary = WeeklySummary.objects.create(
-            shop=shop,
-            provider=owner,
-            week_start_date=start_dt.date(),
-            week_end_date=end_dt.date(),
-            total_appointments=total_appointments,
-            revenue_generated=total_revenue,
-            # V1 Fix: Revenue breakdown for data credibility
-            revenue_deposits=revenue_deposits,
-            revenue_checkout=revenue_checkout,
-            revenue_tips=revenue_tips,
-            rebooking_rate=rebooking_rate,
-            growth_rate=growth_rate,
-            no_shows_filled=no_shows_filled,
-            top_service=top_service_name,
-            top_service_count=top_service_count,
-            open_slots_next_week=open_slots_next_week,
-            forecast_estimated_revenue=forecast_estimated_revenue,
-            ai_motivation=ai_motivation,
-            ai_recommendations=ai_recommendations,
-            delivered_channels=[],
-        )
-
-        deep_link = f"fidden://weekly-recap/{summary.id}"
-
-        #
-        # 10. APP NOTIFICATION + PUSH
-        #
-        report_title = "Your Weekly Business Snapshot ✨"
-        push_summary = (
-            f"Hey {getattr(owner, 'name', '') or ''} — you wrapped another great week. "
-            f"${float(total_revenue):.2f} earned, {no_shows_filled} no-shows saved. "
-            "Tap to see your gameplan."
-        )
+@shared_task(name="api.tasks.generate_weekly_ai_report_batch", bind=True, max_retries=3, default_retry_delay=120)
+def generate_weekly_ai_report_batch(self, shop_ids, end_iso, metrics):
+    """
+    Build and deliver the weekly reports of a batch of shops from the
+    precomputed `metrics` ({shop_id: figures}).
+
+    Per shop: one WeeklySummary for the week (reused on retry), one in-app
+    notification plus push, and the email; `delivered_channels` records what
+    went out so a retry never repeats a channel. Emails share one SMTP
+    connection and the Klaviyo events go out in one webhook call. Only the
+    shops that failed are retried.
+    """
+    from django.core.mail import EmailMessage, get_connection
+    from api.utils.timezone_helpers import was_sent_this_week
+    from api.utils.weekly_reports import build_weekly_report, klaviyo_event
+    from api.utils.zapier import send_klaviyo_events
 
-        detailed_message = (
-            f"Here's your weekly wrap-up from your AI partner, "
-            f"{shop.ai_partner_name or 'Amara'}!\n\n"
-            f"✨ You served {total_appointments} clients this week.\n"
-            f"💵 You earned ${float(total_revenue):.2f} in total bookings.\n"
-            f"🔁 Rebooking rate: {rebooking_rate:.0f}%.\n"
-            f"⏱ You filled {no_shows_filled} last-minute cancellations.\n"
-            f"🗓 {open_slots_next_week} open slots next week.\n\n"
-            "You’re not just running a business — you’re building a movement. "
-            "Let’s make next week your strongest yet."
-        )
+    end_dt = datetime.fromisoformat(end_iso)
+    start_dt = end_dt - timedelta(days=7)
+    shops = Shop.objects.select_related("owner", "subscription", "subscription__plan").filter(id__in=shop_ids)
 
-        Notification.objects.create(
-            recipient=owner,
-            message=detailed_message,
-            notification_type="ai_report",
-            data={
-                "title": report_title,
-                "deep_link": deep_link,
-                "weekly_summary_id": str(summary.id),
-            },
-        )
+    done, failed, emails = [], [], []
+    for shop in shops:
+        if not shop.owner or was_sent_this_week(shop, shop.last_weekly_wrap_sent_at):
+            continue
+        owner = shop.owner
+        try:
+            report = build_weekly_report(shop, metrics[str(shop.id)], start_dt, end_dt)
+            summary = (
+                WeeklySummary.objects
+                .filter(shop=shop, week_end_date=report["summary"]["week_end_date"])
+                .first()
+            ) or WeeklySummary.objects.create(shop=shop, provider=owner, delivered_channels=[], **report["summary"])
+            deep_link = f"fidden://weekly-recap/{summary.id}"
+            channels = list(summary.delivered_channels or [])
+
+            if "in_app" not in channels:
+                notification = Notification.objects.create(
+                    recipient=owner,
+                    message=report["detailed_message"],
+                    notification_type="ai_report",
+                    data={
+                        "title": report["title"],
+                        "deep_link": deep_link,
+                        "weekly_summary_id": str(summary.id),
+                    },
+                )
+                channels.append("in_app")
+                try:
+                    send_push_notification(
+                        owner,
+                        title=report["title"],
+                        message=report["push_summary"],
+                        data={
+                            "summary": report["push_summary"],
+                            "deep_link": deep_link,
+                            "weekly_summary_id": str(summary.id),
+                            "notification_id": str(notification.id),
+                            "type": "ai_report",
+                            "click_action": "FLUTTER_NOTIFICATION_CLICK",
+                        },
+                    )
+                    channels.append("push")
+                except Exception:
+                    logger.exception("Weekly report push failed for owner %s", owner.id)
+
+            summary.delivered_channels = channels
+            summary.save(update_fields=["delivered_channels"])
+
+            recipient_email = (getattr(owner, "email", "") or "").strip()
+            if recipient_email and "email" not in channels:
+                emails.append((summary, EmailMessage(
+                    subject=report["email_subject"],
+                    body=report["email_body"],
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    to=[recipient_email],
+                )))
+            done.append((shop, summary, deep_link))
+        except Exception:
+            logger.exception("Weekly AI report failed for shop %s", shop.id)
+            failed.append(shop.id)
 
+    # Email copies over one SMTP connection
+    if emails:
         try:
-            notify_user(
-                owner,
-                message=report_title,
-                notification_type="ai_report",
-                data={
-                    "summary": push_summary,
-                    "deep_link": deep_link,
-                    "weekly_summary_id": str(summary.id),
-                },
-            )
-            delivered_channels = ["in_app", "push"]
+            with get_connection(fail_silently=False) as connection:
+                for summary, message in emails:
+                    try:
+                        connection.send_messages([message])
+                        summary.delivered_channels = [*summary.delivered_channels, "email"]
+                        summary.save(update_fields=["delivered_channels"])
+                    except Exception:
+                        logger.exception("Failed to send weekly summary email to %s", message.to[0])
         except Exception:
-            logger.exception("notify_user failed for owner %s", owner.id)
-            delivered_channels = ["in_app"]
-
-        #
-        # 11. EMAIL COPY
-        #
-        recipient_email = (getattr(owner, "email", "") or "").strip()
-        if recipient_email:
-            email_subject = f"[Fidden] {report_title}"
-            email_body = (
-                detailed_message
-                + "\n\n"
-                + ai_motivation
-                + "\n\nRevenue Booster:\n- "
-                + revenue_booster_text
-                + "\n\nRetention Play:\n- "
-                + retention_play_text
-            )
-            try:
-                send_mail(
-                    subject=email_subject,
-                    message=email_body,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[recipient_email],
-                    fail_silently=False,
-                )
-                delivered_channels.append("email")
-            except Exception:
-                logger.exception("Failed to send weekly summary email to %s", recipient_email)
+            logger.exception("Weekly summary email connection failed")
 
-        summary.delivered_channels = delivered_channels
-        summary.save(update_fields=["delivered_channels"])
-        
+    if done:
         # V1 Fix: Mark weekly wrap as sent (stored in UTC) to prevent duplicates
-        shop.last_weekly_wrap_sent_at = timezone.now()
-        shop.save(update_fields=['last_weekly_wrap_sent_at'])
-
-        #
-        # 12. PERFORMANCE ANALYTICS SNAPSHOT
-        #
-        PerformanceAnalytics.objects.update_or_create(
-            shop=shop,
-            defaults={
-                "total_revenue": total_revenue,
-                "total_bookings": total_appointments,
-                "no_shows_filled": no_shows_filled,
-                "top_service": top_service_name,
-                "week_start_date": start_dt.date(),
-                "updated_at": timezone.now(),
-            },
+        now = timezone.now()
+        Shop.objects.filter(id__in=[shop.id for shop, _, _ in done]).update(last_weekly_wrap_sent_at=now)
+
+        PerformanceAnalytics.objects.bulk_create(
+            [
+                PerformanceAnalytics(
+                    shop=shop,
+                    total_revenue=summary.revenue_generated,
+                    total_bookings=summary.total_appointments,
+                    no_shows_filled=summary.no_shows_filled,
+                    top_service=summary.top_service,
+                    week_start_date=summary.week_start_date,
+                )
+                for shop, summary, _ in done
+            ],
+            update_conflicts=True,
+            unique_fields=["shop"],
+            update_fields=["total_revenue", "total_bookings", "no_shows_filled", "top_service", "week_start_date", "updated_at"],
         )
 
-        #
-        # 13. KLAVIYO EVENT ENRICHMENT
-        #
-        try:
-            email_for_klaviyo = getattr(owner, "email", None)
+        events = []
+        for shop, summary, deep_link in done:
+            email_for_klaviyo = getattr(shop.owner, "email", None)
             if email_for_klaviyo:
-                profile_payload = {
-                    "plan": getattr(
-                        getattr(getattr(shop, "subscription", None), "plan", None),
-                        "name",
-                        None,
-                    ),
-                    "plan_status": getattr(
-                        getattr(shop, "subscription", None),
-                        "status",
-                        None,
-                    ),
-                    "ai_addon": bool(
-                        getattr(getattr(shop, "subscription", None), "ai_assistant", False)
-                    ),
-                    "shop_id": shop.id,
-                }
-
-                event_props = {
-                    "shop_id": shop.id,
-                    "weekly_summary_id": str(summary.id),
-                    "week_start": str(start_dt.date()),
-                    "week_end": str(end_dt.date()),
-                    "total_appointments": total_appointments,
-                    "total_revenue": float(total_revenue),
-                    "growth_rate": growth_rate,
-                    "rebooking_rate": rebooking_rate,
-                    "no_shows_filled": no_shows_filled,
-                    "top_service": top_service_name,
-                    "top_service_count": top_service_count,
-                    "open_slots_next_week": open_slots_next_week,
-                    "forecast_estimated_revenue": float(forecast_estimated_revenue),
-                    "ai_motivation": ai_motivation,
-                    "ai_recommendations": ai_recommendations,
-                    "deep_link": deep_link,
-                }
-
-                send_klaviyo_event(
-                    email=email_for_klaviyo,
-                    event_name="Weekly Recap Ready",
-                    profile=profile_payload,
-                    event_props=event_props,
-                )
-        except Exception:
-            logger.exception("[klaviyo] weekly recap sync failed for shop %s", shop.id)
+                profile, event_props = klaviyo_event(shop, summary, deep_link)
+                events.append({
+                    "email": email_for_klaviyo,
+                    "event_name": "Weekly Recap Ready",
+                    "profile": profile,
+                    "event_props": event_props,
+                })
+        send_klaviyo_events(events)
+
+    if failed:
+        try:
+            raise self.retry(args=(failed, end_iso, {str(sid): metrics[str(sid)] for sid in failed}))
+        except self.MaxRetriesExceededError:
+            logger.error("Weekly AI reports gave up for shops %s", failed)
 
-    logger.info("Finished weekly AI report generation for all shops.")
-    return "ok"
+    return f"{len(done)} weekly reports delivered, {len(failed)} failed."
 
 
 @shared_task(name="api.tasks.regenerate_shop_slots_task")
@@ -502,7 +252,7 @@ def trigger_no_show_auto_fill(self, booking_id):
     """
     from django.db import transaction
     from payments.models import Booking
-    from api.models import Slot, SlotBooking, AutoFillLog, WaitlistEntry
+    from api.models import Slot, SlotBooking, AutoFillLog
 
     # -- Load booking & guardrails
     booking = (
@@ -546,7 +296,7 @@ def trigger_no_show_auto_fill(self, booking_id):
             .first()
         )
         if slot_booking:
-            Booking.objects.filter(id=booking.id).update(slot_id=slot_booking.id)
+            Booking.objects.filter(id=booking.id).update(slot_id=slot_booking.id, updated_at=timezone.now())
             logger.info("[autofill] repaired SlotBooking: booking=%s -> slot_booking=%s",
                         booking.id, slot_booking.id)
         else:
@@ -575,6 +325,7 @@ def trigger_no_show_auto_fill(self, booking_id):
 
     # -- Free 1 capacity on the original slot
     Slot.objects.filter(id=slot.id).update(capacity_left=F('capacity_left') + 1)
+    slot_capacity_changed([slot.id])
 
     # -- Decide which slot to offer
     now = timezone.now()
@@ -606,51 +357,63 @@ def trigger_no_show_auto_fill(self, booking_id):
     log.id, getattr(slot_for_offers, "id", None), booking.id
     )
 
-    # -- Candidate selection (exclude original user, dedupe)
-    qs = (
-        WaitlistEntry.objects
-        .filter(shop=shop, opted_in_offers=True)
-        .select_related('user', 'service')
-    )
-
-    def _dedupe(seq):
-        seen = set()
-        out = []
-        for x in seq:
-            if x not in seen:
-                out.append(x)
-                seen.add(x)
-        return out
-
-    candidates = []
-    for entry in qs:
-        if entry.user_id == booking.user_id:
-            continue  # don't ping the same user who just no-showed
-        score = 5 if (service_id and entry.service_id == service_id) else 0
-        candidates.append((entry.user_id, score))
-
-    if not candidates:
-        AutoFillLog.objects.filter(original_booking=booking).update(status='failed_no_candidates')
-        return "No candidates."
-
-    candidates.sort(key=lambda t: t[1], reverse=True)
-    user_ids_ranked = _dedupe([uid for (uid, _) in candidates])
-    top_ids  = user_ids_ranked[:5]
-    next_ids = user_ids_ranked[5:25]
-
     logger.info(
         "[autofill] enqueue original_slot.id=%s offered_slot.id=%s slot_booking.id=%s service_id=%s",
         slot.id, slot_for_offers.id, slot_booking.id, service_id
     )
 
-    # -- Outreach
-    send_autofill_offers.delay(slot_for_offers.id, top_ids, "push")
-    if next_ids:
-        send_autofill_offers.apply_async(args=[slot_for_offers.id, next_ids, "email"], countdown=60)
-
-    AutoFillLog.objects.filter(original_booking=booking).update(status='outreach_started')
+    # -- Outreach in waves (api.utils.waitlist), each re-checking the slot
+    AutoFillLog.objects.filter(id=log.id).update(status='outreach_started')
+    run_autofill_wave.delay(log.id, 0)
     return "Outreach started."
 
+
+@shared_task(bind=True, name="api.tasks.run_autofill_wave", max_retries=3, default_retry_delay=30)
+def run_autofill_wave(self, log_id, wave):
+    """
+    Offer the log's slot to the next best-ranked waitlist users, then queue
+    the following wave. Stops as soon as the slot is filled or taken.
+    """
+    from api.models import AutoFillLog
+    from api.utils.waitlist import AUTOFILL_WAVES, mark_offered, outreach_open, rank_candidates
+
+    log = (
+        AutoFillLog.objects
+        .select_related('offered_slot', 'original_booking')
+        .filter(id=log_id).first()
+    )
+    if not log or not log.offered_slot_id or wave >= len(AUTOFILL_WAVES):
+        return "Nothing to do."
+    if not outreach_open(log):
+        logger.info("[autofill] log %s wave %s skipped: slot filled or outreach closed", log_id, wave)
+        return "Outreach closed."
+
+    size, channel, _ = AUTOFILL_WAVES[wave]
+    slot = log.offered_slot
+    try:
+        user_ids = rank_candidates(
+            log.shop_id,
+            slot.service_id,
+            limit=size,
+            exclude_user_ids=[getattr(log.original_booking, "user_id", None)],
+        )
+        if not user_ids:
+            if wave == 0:
+                AutoFillLog.objects.filter(id=log_id).update(status='failed_no_candidates')
+                return "No candidates."
+            return "No more candidates."
+        mark_offered(log.shop_id, user_ids)
+    except Exception as e:
+        logger.error(f"[autofill] wave {wave} of log {log_id} failed: {e}", exc_info=True)
+        raise self.retry(exc=e)
+
+    send_autofill_offers.delay(slot.id, user_ids, channel)
+    if wave + 1 < len(AUTOFILL_WAVES):
+        run_autofill_wave.apply_async(args=[log_id, wave + 1], countdown=AUTOFILL_WAVES[wave + 1][2])
+    logger.info("[autofill] log %s wave %s offered slot %s to %s users via %s",
+                log_id, wave, slot.id, len(user_ids), channel)
+    return f"Wave {wave}: {len(user_ids)} offers via {channel}."
+
 # api/tasks.py
 @shared_task(name="api.tasks.send_autofill_offers")
 def send_autofill_offers(slot_id, user_ids, channel):
@@ -660,6 +423,7 @@ def send_autofill_offers(slot_id, user_ids, channel):
     interpret slot_id as a SlotBooking.pk and map to its Slot.
     """
     from .models import Slot, SlotBooking
+    from .utils.autofill_offers import dispatch_offers, offer_still_open
     started_at = tz_now()
     t0 = time.monotonic()
     run_id = str(uuid.uuid4())[:8]
@@ -667,18 +431,6 @@ def send_autofill_offers(slot_id, user_ids, channel):
     def _dt(ms=0):
         return f"{int((time.monotonic() - t0) * 1000)}ms"
 
-    def _safe(obj):
-        try:
-            return json.dumps(obj, ensure_ascii=False)
-        except Exception:
-            return str(obj)
-
-    def _redact(email):
-        if not email or "@" not in email:
-            return email
-        name, host = email.split("@", 1)
-        return (name[:1] + "***@" + host)
-
     logger.info("[autofill:%s] start slot_id=%s users=%s channel=%s at=%s",
                 run_id, slot_id, user_ids, channel, started_at.isoformat())
 
@@ -701,148 +453,30 @@ def send_autofill_offers(slot_id, user_ids, channel):
         logger.warning("[autofill:%s] %s abort: no slot", run_id, _dt())
         return "No slot."
 
-    # 2) Capacity guard
-    cap = (slot.capacity_left or 0)
-    logger.info("[autofill:%s] %s capacity_left=%s", run_id, _dt(), cap)
-    if cap <= 0:
-        logger.info("[autofill:%s] %s abort: slot filled", run_id, _dt())
+    # 2) Capacity / outreach guard (re-checked before every micro-batch)
+    if not offer_still_open(slot.id):
+        logger.info("[autofill:%s] %s abort: slot filled or outreach closed", run_id, _dt())
         return "Slot was filled before this wave."
 
-    # 3) Users via AUTH_USER_MODEL
+    # 3) Users via AUTH_USER_MODEL, in ranked order
     User = get_user_model()
-    users_qs = User.objects.filter(id__in=user_ids).only("id", "email")
-    users = list(users_qs)
+    by_id = User.objects.in_bulk(user_ids)
+    users = [by_id[uid] for uid in dict.fromkeys(user_ids) if uid in by_id]
     logger.info("[autofill:%s] %s matched_users=%d ids=%s",
                 run_id, _dt(), len(users), [u.id for u in users])
     if not users:
         return "No recipients."
 
-    # 4) Compose content (localize time for display + payload)
-    start_local = timezone.localtime(slot.start_time)  # uses settings.TIME_ZONE
-    human_time = start_local.strftime("%I:%M %p on %b %d")
-    iso_local = start_local.isoformat()
+    # 4) Notifications + channel delivery in micro-batches
+    result = dispatch_offers(slot, users, channel)
 
-    subject = "An opening just became available!"
-    message_body = (
-        f"{slot.shop.name} just had a {slot.service.title} spot open up at "
-        f"{human_time}. First come, first served!"
+    logger.info("[autofill:%s] done elapsed=%s notified=%d push_sent=%d sms_sent=%d email_sent=%d stopped=%s slot_id=%s",
+                run_id, _dt(), result["notified"], result["push"], result["sms"], result["email"],
+                result["stopped"], slot.id)
+    return (
+        f"push={result['push']}, sms={result['sms']}, email={result['email']}, "
+        f"recipients={result['notified']}/{len(users)}, channel={channel}"
     )
-    shortlink = f"https://your-app.com/book/{slot.id}"
-    full_message = f"{message_body}\n\nTap to book: {shortlink}"
-
-    data = {
-        "type": "autofill_offer",
-        "action": "book_offer",
-        "slot_id": str(slot.id),
-        "shop_id": str(slot.shop_id),
-        "service_id": str(slot.service_id),
-        "serviceName": slot.service.title or "",
-        "service_img": getattr(slot.service, "image_url", "") or "",
-        "shopName": slot.shop.name or "",
-        "shopAddress": getattr(slot.shop, "address", "") or "",
-        "serviceDurationMinutes": str(getattr(slot.service, "duration", 0)),
-        "start_time": iso_local,  # localized ISO for client rendering
-        "price": str(getattr(slot.service, "price", 0) or 0),
-        "discountPrice": str(getattr(slot.service, "discount_price", "") or ""),
-        "deeplink": f"fidden://book/{slot.id}",
-        "url": shortlink,
-        "title": subject,
-        "body": message_body,
-    }
-    logger.info("[autofill:%s] %s payload=%s", run_id, _dt(), _safe(data))
-
-    # 5) Push + Email + SMS
-    sent_push = 0
-    sent_email = 0
-    sent_sms = 0
-
-    # ❶ Persist a Notification for every user (no delivery here)
-    for u in users:
-        try:
-            notify_user(
-                user=u,
-                message=message_body,
-                notification_type="autofill_offer",
-                data=data,
-                debug=False,
-                dry_run=True,  # persist only
-            )
-        except Exception as e:
-            logger.warning("[autofill:%s] %s notify_user failed user_id=%s err=%s",
-                           run_id, _dt(), getattr(u, "id", None), e, exc_info=True)
-
-    # ❷ Push (deliver only when channel includes push)
-    if channel in ("push", "sms_push", "email_push"):
-        logger.info("[autofill:%s] %s entering push branch channel=%s", run_id, _dt(), channel)
-        for u in users:
-            try:
-                send_push_notification(
-                    user=u,
-                    title=subject,
-                    message=message_body,
-                    data=data,
-                    debug=False,
-                    dry_run=False,
-                )
-                sent_push += 1
-            except Exception as e:
-                logger.warning("[autofill:%s] %s push failed user_id=%s err=%s",
-                               run_id, _dt(), getattr(u, "id", None), e, exc_info=True)
-
-        # ❸ SMS (deliver only when channel includes sms)
-    if channel in ("sms", "sms_push", "email_sms", "all"):
-            logger.info("[autofill:%s] %s entering sms branch channel=%s", run_id, _dt(), channel)
-            for u in users:
-                phone = get_user_phone(u)  # central helper
-                if not phone:
-                    logger.debug(
-                        "[autofill:%s] %s user_id=%s has no phone number",
-                        run_id, _dt(), getattr(u, "id", None)
-                    )
-                    continue
-
-                sms_body = (
-                    f"Fidden: Slot available! {slot.service.title} at {slot.shop.name} "
-                    f"{human_time}. Book now: {shortlink}"
-                )
-                try:
-                    if send_sms(phone, sms_body):
-                        sent_sms += 1
-                except Exception as e:
-                    logger.warning(
-                        "[autofill:%s] %s SMS failed user_id=%s phone=%s err=%s",
-                        run_id, _dt(), getattr(u, "id", None), phone, e, exc_info=True
-                    )
-
-
-    # ❹ Email
-    if channel in ("email", "email_push", "email_sms", "all"):
-        logger.info("[autofill:%s] %s entering email branch channel=%s", run_id, _dt(), channel)
-        for u in users:
-            email = getattr(u, "email", None)
-            logger.debug("[autofill:%s] %s email candidate user_id=%s email=%s",
-                         run_id, _dt(), getattr(u, "id", None), _redact(email))
-            if not email:
-                continue
-            try:
-                send_mail(
-                    subject=f"[Fidden] {subject}",
-                    message=full_message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[email],
-                    fail_silently=False,
-                )
-                sent_email += 1
-                logger.debug("[autofill:%s] %s email sent user_id=%s email=%s",
-                             run_id, _dt(), getattr(u, "id", None), _redact(email))
-            except Exception as e:
-                logger.warning("[autofill:%s] %s email failed user_id=%s email=%s err=%s",
-                               run_id, _dt(), getattr(u, "id", None), _redact(email), e, exc_info=True)
-
-    elapsed = _dt()
-    logger.info("[autofill:%s] done elapsed=%s push_sent=%d sms_sent=%d email_sent=%d slot_id=%s",
-                run_id, elapsed, sent_push, sent_sms, sent_email, slot.id)
-    return f"push={sent_push}, sms={sent_sms}, email={sent_email}, recipients={len(users)}, channel={channel}"
 
 @shared_task(name="api.tasks.test_notification_persistence")
 def test_notification_persistence(user_id: int, msg: str = "persistence probe"):
@@ -854,42 +488,70 @@ def test_notification_persistence(user_id: int, msg: str = "persistence probe"):
     n = notify_user(u, msg, notification_type="probe", data={"probe": "1"}, dry_run=True)
     return f"created notification id={n.id} for user={u.id}"
 
+@shared_task(name="api.tasks.send_chat_notification", bind=True, max_retries=3, default_retry_delay=30)
+def send_chat_notification(self, recipient_id, message, data=None):
+    """
+    In-app Notification row + FCM push for a chat message.
+    Queued by ChatConsumer so the websocket path never waits on FCM; skipped
+    when the recipient has the thread open or was pushed for it recently.
+    """
+    from api.utils.presence import reset_chat_push_window, should_notify_chat
+
+    data = data or {}
+    thread_id = data.get("thread_id")
+    if thread_id and not should_notify_chat(recipient_id, thread_id):
+        return "suppressed (recipient in thread or push window open)"
+
+    U = get_user_model()
+    recipient = U.objects.filter(id=recipient_id).prefetch_related("devices").first()
+    if not recipient:
+        return "no such user"
+    try:
+        notify_user(recipient, message, notification_type="chat", data=data)
+    except Exception as e:
+        logger.error("Chat notification failed for user %s: %s", recipient_id, e, exc_info=True)
+        if thread_id:
+            # Give the window back, or the retry would find it taken and skip
+            reset_chat_push_window(recipient_id, thread_id)
+        raise self.retry(exc=e)
+    return f"notified user={recipient_id}"
+
 @shared_task
-def calculate_analytics():
-    for shop in Shop.objects.all():
-        bookings = Booking.objects.filter(shop=shop)
-        total_bookings = bookings.count()
-
-        # Basic Analytics
-        total_revenue = shop.revenues.aggregate(total=Sum('revenue'))['total'] or 0 # Use Sum directly
-        average_rating = shop.ratings.aggregate(avg=Avg('rating'))['avg'] or 0.0
-
-        # Moderate Analytics
-        cancellation_rate = (bookings.filter(status='cancelled').count() / total_bookings * 100) if total_bookings > 0 else 0
-
-        # Advanced Analytics
-        repeat_customer_rate = 0
-        if total_bookings > 0:
-            customer_counts = bookings.values('user').annotate(count=Count('id'))
-            repeat_customers = sum(1 for c in customer_counts if c['count'] > 1)
-            total_customers = len(customer_counts)
-            repeat_customer_rate = (repeat_customers / total_customers * 100) if total_customers > 0 else 0
-
-        top_service = bookings.values('slot__service__title').annotate(count=Count('id')).order_by('-count').first()
-        peak_booking_time = bookings.values('slot__start_time__hour').annotate(count=Count('id')).order_by('-count').first()
-
-        PerformanceAnalytics.objects.update_or_create(
-            shop=shop,
-            defaults={
-                'total_revenue': total_revenue,
-                'total_bookings': total_bookings,
-                'average_rating': average_rating,
-                'cancellation_rate': cancellation_rate,
-                'repeat_customer_rate': repeat_customer_rate,
-                'top_service': top_service['slot__service__title'] if top_service else None,
-                'peak_booking_time': f"{peak_booking_time['slot__start_time__hour']}:00" if peak_booking_time else None,
-            }
-        )
+def refresh_analytics_rollups():
+    """Keep the daily rollups (growth suggestions, weekly reports) close to live."""
+    from api.utils.analytics_rollups import refresh_daily_rollups
+
+    shops, days = refresh_daily_rollups()
+    return f"Rollups refreshed: {days} days across {shops} shops."
+
+
+@shared_task
+def calculate_analytics(full=False):
+    """
+    Refresh the daily rollups for days changed since the last run, then
+    rebuild every shop's PerformanceAnalytics from them (see
+    api.utils.analytics_rollups).
+    """
+    from api.utils.analytics_rollups import refresh_daily_rollups, shop_analytics_from_rollups
+
+    refresh_daily_rollups(full=full)
+    analytics = shop_analytics_from_rollups()
+    empty = {
+        'total_revenue': 0, 'total_bookings': 0, 'average_rating': 0.0, 'cancellation_rate': 0,
+        'repeat_customer_rate': 0, 'top_service': None, 'peak_booking_time': None,
+    }
+    rows = [
+        PerformanceAnalytics(shop_id=shop_id, **analytics.get(shop_id, empty))
+        for shop_id in Shop.objects.values_list('id', flat=True)
+    ]
+    PerformanceAnalytics.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['shop'],
+        update_fields=[*empty, 'updated_at'],
+    )
+    return f"Analytics updated for {len(rows)} shops."
 
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
@@ -918,91 +580,12 @@ def prefill_slots(self, days_ahead=14):
 
 @shared_task(bind=True, max_retries=2, default_retry_delay=60)
 def send_upcoming_slot_reminders(self, window_minutes=30):
-    """Send reminders via email, push, and save to DB for upcoming confirmed bookings."""
-    now = timezone.now()
-    window_end = now + timedelta(minutes=window_minutes)
-
-    try:
-        from payments.models import Booking
-
-        # If your canonical “confirmed” state is 'confirmed' (matches SlotBooking usage),
-        # use that. If payments.Booking uses a different value, update here.
-        CONFIRMED = "confirmed"
-
-        upcoming = (
-            Booking.objects
-            .select_related(
-                "user", "shop", "slot", "slot__service"  # <-- FIX: pull service via slot
-            )
-            .filter(
-                status=CONFIRMED,                  # <-- FIX: use the real confirmed state
-                slot__start_time__gte=now,
-                slot__start_time__lte=window_end,
-            )
-        )
-
-        sent_count = 0
-
-        for b in upcoming:
-            user = b.user
-            shop = b.shop
-            service = b.slot.service  # <-- FIX: service comes from slot
-            start_local = timezone.localtime(b.slot.start_time)
-
-            subject = f"Reminder: {service.title} at {shop.name}"
-            display_name = getattr(user, "name", None) or getattr(user, "email", "there")
-
-            full_message = (
-                f"Hi {display_name},\n\nJust a reminder that your booking for {service.title} "
-                f"at {shop.name} is coming up soon!\n\n"
-                f"Date & Time: {start_local.strftime('%A, %b %d at %I:%M %p')}\n\nSee you there!"
-            )
-            push_body = f"Your {service.title} booking at {shop.name} is at {start_local.strftime('%I:%M %p')}."
-
-            push_data = {
-                "type": "booking_reminder",
-                "booking_id": str(b.id),
-                "shop_id": str(shop.id),
-                "service_id": str(service.id),
-                "start_time": b.slot.start_time.isoformat(),
-                # you can add a deeplink here, too
-            }
-
-            client_phone = getattr(user, 'phone_number', None)
-            if client_phone:
-                sms_body = f"Fidden Reminder: Your {service.title} booking at {shop.name} is at {start_local.strftime('%I:%M %p')} today."
-                send_sms(client_phone, sms_body)
-            else:
-                 logger.warning(f"[Reminder] Cannot send SMS reminder to user {user.id}, no phone number.")
-
-            # Email (optional)
-            email = getattr(user, "email", None)
-            if email:
-                try:
-                    send_mail(subject, full_message, settings.DEFAULT_FROM_EMAIL, [email], fail_silently=False)
-                except Exception as e:
-                    logger.warning(f"[Reminder] Failed to send email to {email}: {e}")
-
-            # Persist in DB + send push
-            try:
-                notify_user(
-                    user=user,
-                    message=push_body,
-                    notification_type="booking_reminder",
-                    data={**push_data, "title": subject},
-                    dry_run=False,  # ensure we actually send push
-                )
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"[Reminder] Failed for booking {b.id} user {user.id}: {e}", exc_info=True)
-
-        logger.info(f"[Reminder] Processed {sent_count} reminders for upcoming slots.")
-        return f"Processed {sent_count} reminders."
-
-    except Exception as e:
-        logger.error(f"[Reminder Task] Error: {e}", exc_info=True)
-        raise self.retry(exc=e)
-
+    """
+    Superseded by payments.tasks.dispatch_booking_reminders, which sends the
+    scheduled BookingReminder rows; kept so queued calls still run.
+    """
+    from payments.tasks import dispatch_booking_reminders
+    return dispatch_booking_reminders()
 
 
 @shared_task(bind=True, max_retries=2, default_retry_delay=60)
@@ -1039,6 +622,7 @@ def cleanup_old_cancelled_bookings(self, days=7, batch_size=1000):
                     Slot.objects.filter(id=slot_id).update(
                         capacity_left=F("capacity_left") + inc
                     )
+                slot_capacity_changed(incr_by_slot.keys())
 
                 # Bulk delete the batch
                 SlotBooking.objects.filter(id__in=[b.id for b in batch]).delete()
@@ -1057,6 +641,109 @@ def cleanup_old_cancelled_bookings(self, days=7, batch_size=1000):
         logger.error(f"[Cleanup Task] Error: {e}", exc_info=True)
         raise self.retry(exc=e)
 
+@shared_task(bind=True, max_retries=2, default_retry_delay=60)
+def archive_old_notifications(self, read_days=90, unread_days=180, batch_size=1000):
+    """
+    Move old notifications out of the live inbox table into ArchivedNotification.
+    Read notifications are archived after `read_days`, unread ones after `unread_days`.
+    Locks a batch with SELECT ... FOR UPDATE SKIP LOCKED, copies it with one
+    bulk INSERT and removes it with one DELETE.
+    """
+    from api.models import ArchivedNotification
+    from api.utils.notifications import reset_unread_count
+
+    now = timezone.now()
+    read_cutoff = now - timedelta(days=read_days)
+    unread_cutoff = now - timedelta(days=unread_days)
+    total_archived = 0
+
+    try:
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Notification.objects
+                    .select_for_update(skip_locked=True)  # requires PostgreSQL
+                    .filter(
+                        Q(is_read=True, created_at__lt=read_cutoff)
+                        | Q(created_at__lt=unread_cutoff)
+                    )
+                    .order_by("id")[:batch_size]
+                )
+                if not batch:
+                    break
+
+                ArchivedNotification.objects.bulk_create([
+                    ArchivedNotification(
+                        original_id=n.id,
+                        recipient_id=n.recipient_id,
+                        message=n.message,
+                        notification_type=n.notification_type,
+                        data=n.data,
+                        is_read=n.is_read,
+                        created_at=n.created_at,
+                    )
+                    for n in batch
+                ])
+                Notification.objects.filter(id__in=[n.id for n in batch]).delete()
+
+            # Unread rows left the inbox -> cached counters are stale
+            for user_id in {n.recipient_id for n in batch if not n.is_read}:
+                reset_unread_count(user_id)
+
+            total_archived += len(batch)
+            if len(batch) < batch_size:
+                break
+
+        msg = f"[Notifications] Archived {total_archived} notifications."
+        logger.info(msg)
+        return msg
+
+    except Exception as e:
+        logger.error(f"[Notification Archive Task] Error: {e}", exc_info=True)
+        raise self.retry(exc=e)
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=60)
+def release_expired_slot_holds(self, batch_size=500, max_batches=20):
+    """
+    Sweep the SlotHold ledger: cancel unpaid bookings whose hold expired and
+    return their capacity with one UPDATE per slot. Runs every minute.
+    """
+    from api.utils.holds import release_expired_holds
+
+    totals = {"converted": 0, "expired": 0, "released": 0}
+    try:
+        for _ in range(max_batches):
+            result = release_expired_holds(batch_size=batch_size)
+            for key, value in result.items():
+                totals[key] += value
+            if sum(result.values()) < batch_size:
+                break
+    except Exception as e:
+        logger.error(f"[Slot Hold Sweeper] Error: {e}", exc_info=True)
+        raise self.retry(exc=e)
+
+    if any(totals.values()):
+        logger.info("[Slot Hold Sweeper] converted=%s expired=%s released=%s",
+                    totals["converted"], totals["expired"], totals["released"])
+    return totals
+
+@shared_task(name="api.tasks.propagate_global_settings", bind=True, max_retries=3, default_retry_delay=60)
+def propagate_global_settings(self, run_id):
+    """
+    Apply GlobalSettings to every active Foundation shop and its services in
+    chunks, reporting progress to the cache (api.utils.plan_defaults).
+    """
+    from api.utils.plan_defaults import propagate_global_settings as propagate
+
+    try:
+        processed = propagate(run_id)
+    except Exception as e:
+        logger.error(f"[GlobalSettings Propagation] Error: {e}", exc_info=True)
+        raise self.retry(exc=e)
+    return f"GlobalSettings applied to {processed} shops."
+
+# Superseded by the SlotHold ledger + release_expired_slot_holds; kept so
+# already-queued tasks still run. Cancelling here also releases the hold.
 @shared_task
 def auto_cancel_booking(booking_id):
     try:
@@ -1073,6 +760,9 @@ def auto_cancel_booking(booking_id):
         if booking.slot.capacity_left is not None:
             booking.slot.capacity_left += 1
             booking.slot.save(update_fields=["capacity_left"])
+        models.SlotHold.objects.filter(slot_booking=booking, status="active").update(
+            status="released", resolved_at=timezone.now()
+        )
 
         if booking.shop.capacity is not None:
             booking.shop.capacity += 1
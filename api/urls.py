@@ -30,6 +30,8 @@ from .views import (
     RegisterDeviceView,
     NotificationsView,
     NotificationDetailView,
+    NotificationUnreadCountView,
+    NotificationMarkReadView,
     WeeklyShopRevenueView,
     GrowthSuggestionView,
     CouponListCreateAPIView,
@@ -37,6 +39,8 @@ from .views import (
     UserCouponRetrieveAPIView,
     BestServicePerShopView,
     ThreadDetailsView,
+    ThreadSyncView,
+    ThreadMarkReadView,
     AIAutoFillSettingsView,
     HoldSlotAndBookView,
     GalleryItemView,
@@ -67,11 +71,15 @@ urlpatterns = [
     path('shops/rating-reviews/<int:shop_id>/', ShopRatingReviewsView.as_view(), name='shop-rating-reviews'),
     path("threads/", ThreadListView.as_view(), name="thread-list"),
     path("threads/<int:thread_id>/", ThreadDetailsView.as_view(), name="thread-detail"),
+    path("threads/<int:thread_id>/sync/", ThreadSyncView.as_view(), name="thread-sync"),
+    path("threads/<int:thread_id>/read/", ThreadMarkReadView.as_view(), name="thread-mark-read"),
     path("threads/<int:shop_id>/send/", UserMessageView.as_view(), name="user-send-message"),
     path("threads/<int:thread_id>/reply/", OwnerMessageView.as_view(), name="owner-reply-message"),
     path('register-device/', RegisterDeviceView.as_view(), name='register-device'),
     path("notifications/", NotificationsView.as_view(), name="user-notifications"),
     path("notifications/<int:pk>/", NotificationDetailView.as_view(), name="notification-detail"),
+    path("notifications/unread-count/", NotificationUnreadCountView.as_view(), name="notification-unread-count"),
+    path("notifications/mark-read/", NotificationMarkReadView.as_view(), name="notification-mark-read"),
     path('shop/<int:shop_id>/revenues/', WeeklyShopRevenueView.as_view(), name='weekly-shop-revenues'),
     path("growth-suggestions/", GrowthSuggestionView.as_view(), name="growth-suggestions"),
     path('coupons/', CouponListCreateAPIView.as_view(), name='coupon-list-create'),
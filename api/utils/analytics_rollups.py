@@ -0,0 +1,292 @@
+# api/utils/analytics_rollups.py
+"""
+Incremental per-shop daily rollups (api.models.ShopDailyRollup).
+
+`refresh_daily_rollups` finds the (shop, day) pairs touched since the last
+run, from Booking.updated_at and RatingReview.created_at, and recomputes only
+those days with a handful of grouped queries per shop. A booking belongs to
+the day it was created, so status changes (completed, cancelled, no-show)
+just mark that day dirty again. Booking.save adds updated_at to any
+update_fields, and queryset updates of bookings must set it themselves.
+Deleted bookings and edited or deleted reviews leave no timestamp behind, so
+signal receivers in api.models record their days as RollupDirtyDay rows in
+the same transaction, and the next refresh consumes them. The first run, or
+`full=True`, rebuilds every day.
+
+`shop_analytics_from_rollups` derives the PerformanceAnalytics figures
+from the rollups and the daily Revenue rows, and `summed_rollups` gives the
+summed counters to growth suggestions and the weekly report. Their cost
+depends on the number of shop-days, not on the number of bookings.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, F, Q, Sum, Window
+from django.db.models.functions import ExtractHour, RowNumber, TruncDate
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = "shop_daily_rollups"
+# Re-read changes slightly older than the watermark: rows written by
+# transactions that committed after the previous run started
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+STATUS_COUNTERS = {
+    "bookings_completed": "completed",
+    "bookings_cancelled": "cancelled",
+    "bookings_no_show": "no-show",
+    "bookings_late_cancel": "late-cancel",
+}
+
+
+def _changed_days(since=None):
+    """{shop_id: {day, ...}} for bookings and ratings changed since `since` (all if None)."""
+    from api.models import RatingReview
+    from payments.models import Booking
+
+    bookings = Booking.objects.all()
+    ratings = RatingReview.objects.all()
+    if since is not None:
+        bookings = bookings.filter(updated_at__gte=since)
+        ratings = ratings.filter(created_at__gte=since)
+
+    dirty = defaultdict(set)
+    for qs in (bookings, ratings):
+        pairs = qs.annotate(day=TruncDate("created_at")).values_list("shop_id", "day").distinct()
+        for shop_id, day in pairs:
+            dirty[shop_id].add(day)
+    return dirty
+
+
+def mark_days_dirty(shop_id, timestamps):
+    """Queue the days of `timestamps` (local dates) for the next refresh."""
+    from api.models import RollupDirtyDay
+
+    days = {timezone.localdate(ts) for ts in timestamps if ts}
+    RollupDirtyDay.objects.bulk_create([RollupDirtyDay(shop_id=shop_id, date=day) for day in days])
+
+
+def mark_booking_deleted(booking):
+    """
+    Queue the deleted booking's day, plus the days of the customer's next two
+    bookings at the shop: their first/second-booking ranks move up.
+    """
+    from payments.models import Booking
+
+    later = (
+        Booking.objects
+        .filter(shop_id=booking.shop_id, user_id=booking.user_id, created_at__gt=booking.created_at)
+        .order_by("created_at", "id")
+        .values_list("created_at", flat=True)[:2]
+    ) if booking.created_at else []
+    mark_days_dirty(booking.shop_id, [booking.created_at, *later])
+
+
+def _day_bounds(days):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(min(days), time.min), tz)
+    end = timezone.make_aware(datetime.combine(max(days) + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def rebuild_shop_days(shop_id, days):
+    """Recompute the rollup rows of one shop for the given days (upsert)."""
+    from api.models import RatingReview, ShopDailyRollup
+    from payments.models import Booking
+
+    days = set(days)
+    if not days:
+        return 0
+    start, end = _day_bounds(days)
+    bookings = (
+        Booking.objects
+        .filter(shop_id=shop_id, created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate("created_at"))
+    )
+    rows = {day: ShopDailyRollup(shop_id=shop_id, date=day) for day in days}
+
+    counters = {name: Count("id", filter=Q(status=value)) for name, value in STATUS_COUNTERS.items()}
+    for r in bookings.values("day").annotate(
+        bookings_total=Count("id"), unique_customers=Count("user_id", distinct=True), **counters
+    ):
+        if r["day"] in rows:
+            for field, value in r.items():
+                if field != "day":
+                    setattr(rows[r["day"]], field, value)
+
+    for r in bookings.values("day", "slot__service_id").annotate(
+        total=Count("id"), completed=Count("id", filter=Q(status="completed"))
+    ):
+        row = rows.get(r["day"])
+        if row is None or r["slot__service_id"] is None:
+            continue
+        key = str(r["slot__service_id"])
+        row.service_counts[key] = r["total"]
+        if r["completed"]:
+            row.completed_service_counts[key] = r["completed"]
+
+    for r in bookings.annotate(hour=ExtractHour("slot__start_time")).values("day", "hour").annotate(c=Count("id")):
+        if r["day"] in rows and r["hour"] is not None:
+            rows[r["day"]].hour_counts[str(r["hour"])] = r["c"]
+
+    # First and second booking of each customer seen on these days
+    ranked = (
+        Booking.objects
+        .filter(shop_id=shop_id, user_id__in=bookings.values("user_id"))
+        .annotate(
+            rank=Window(RowNumber(), partition_by=[F("user_id")], order_by=[F("created_at").asc(), F("id").asc()]),
+            day=TruncDate("created_at"),
+        )
+        .filter(rank__lte=2)
+        .values_list("day", "rank")
+    )
+    for day, rank in ranked:
+        if day in rows:
+            if rank == 1:
+                rows[day].new_customers += 1
+            else:
+                rows[day].repeat_customers += 1
+
+    for r in (
+        RatingReview.objects
+        .filter(shop_id=shop_id, created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate("created_at"))
+        .values("day")
+        .annotate(rating_sum=Sum("rating"), rating_count=Count("id"))
+    ):
+        if r["day"] in rows:
+            rows[r["day"]].rating_sum = r["rating_sum"] or 0
+            rows[r["day"]].rating_count = r["rating_count"]
+
+    update_fields = [
+        "bookings_total", *STATUS_COUNTERS, "unique_customers", "new_customers", "repeat_customers",
+        "service_counts", "completed_service_counts", "hour_counts", "rating_sum", "rating_count", "computed_at",
+    ]
+    ShopDailyRollup.objects.bulk_create(
+        rows.values(),
+        update_conflicts=True,
+        unique_fields=["shop", "date"],
+        update_fields=update_fields,
+    )
+    return len(rows)
+
+
+def refresh_daily_rollups(full=False):
+    """Bring the rollups up to date. Returns (shops, days) recomputed."""
+    from api.models import RollupDirtyDay, RollupWatermark, Shop
+
+    started = timezone.now()
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+    since = None if full or watermark is None else watermark.position - WATERMARK_OVERLAP
+
+    dirty = _changed_days(since)
+    # Queued rows are consumed by id: rows added while this run rebuilds stay
+    queued = list(RollupDirtyDay.objects.values_list("id", "shop_id", "date"))
+    for _, shop_id, day in queued:
+        dirty[shop_id].add(day)
+    live_shops = set(Shop.objects.filter(id__in=dirty.keys()).values_list("id", flat=True))
+
+    days = 0
+    for shop_id, shop_days in dirty.items():
+        if shop_id in live_shops:
+            days += rebuild_shop_days(shop_id, shop_days)
+    if queued:
+        RollupDirtyDay.objects.filter(id__in=[row[0] for row in queued]).delete()
+
+    RollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={"position": started})
+    logger.info("[Rollups] Recomputed %s days across %s shops (since=%s)", days, len(dirty), since)
+    return len(dirty), days
+
+
+SUMMED_FIELDS = (
+    "bookings_total", *STATUS_COUNTERS, "new_customers", "repeat_customers",
+)
+
+
+def summed_rollups(shop_ids, date_from=None, date_to=None):
+    """
+    {shop_id: totals} over the shops' rollup days in [date_from, date_to]
+    (all days when None), in one query. Totals hold SUMMED_FIELDS plus the
+    merged `service_counts` / `completed_service_counts` Counters. Summing
+    new_customers gives the distinct customers (each one's first booking),
+    repeat_customers those with two or more bookings.
+    """
+    from api.models import ShopDailyRollup
+
+    rollups = ShopDailyRollup.objects.filter(shop_id__in=shop_ids)
+    if date_from is not None:
+        rollups = rollups.filter(date__gte=date_from)
+    if date_to is not None:
+        rollups = rollups.filter(date__lte=date_to)
+
+    totals = {
+        shop_id: {
+            **dict.fromkeys(SUMMED_FIELDS, 0),
+            "service_counts": Counter(),
+            "completed_service_counts": Counter(),
+        }
+        for shop_id in shop_ids
+    }
+    for row in rollups.values("shop_id", *SUMMED_FIELDS, "service_counts", "completed_service_counts"):
+        t = totals[row["shop_id"]]
+        for field in SUMMED_FIELDS:
+            t[field] += row[field]
+        t["service_counts"].update(row["service_counts"])
+        t["completed_service_counts"].update(row["completed_service_counts"])
+    return totals
+
+
+def shop_analytics_from_rollups(shop_ids=None):
+    """
+    {shop_id: PerformanceAnalytics field values} summed from the rollups and
+    Revenue rows. Shops with neither are absent; callers default them to zero.
+    """
+    from api.models import Revenue, Service, ShopDailyRollup
+
+    rollups = ShopDailyRollup.objects.all()
+    revenues = Revenue.objects.all()
+    if shop_ids is not None:
+        rollups = rollups.filter(shop_id__in=shop_ids)
+        revenues = revenues.filter(shop_id__in=shop_ids)
+
+    totals = {
+        r["shop_id"]: r
+        for r in rollups.values("shop_id").annotate(
+            total=Sum("bookings_total"),
+            cancelled=Sum("bookings_cancelled"),
+            customers=Sum("new_customers"),
+            repeat=Sum("repeat_customers"),
+            rating_sum=Sum("rating_sum"),
+            rating_count=Sum("rating_count"),
+        )
+    }
+    revenue_by_shop = dict(revenues.values("shop_id").annotate(t=Sum("revenue")).values_list("shop_id", "t"))
+
+    services, hours = defaultdict(Counter), defaultdict(Counter)
+    for shop_id, service_counts, hour_counts in rollups.values_list("shop_id", "service_counts", "hour_counts"):
+        services[shop_id].update(service_counts)
+        hours[shop_id].update(hour_counts)
+
+    top_service_ids = {
+        shop_id: int(counter.most_common(1)[0][0]) for shop_id, counter in services.items() if counter
+    }
+    titles = dict(Service.objects.filter(id__in=top_service_ids.values()).values_list("id", "title"))
+
+    analytics = {}
+    for shop_id in set(totals) | set(revenue_by_shop):
+        t = totals.get(shop_id, {})
+        total = t.get("total") or 0
+        customers, rating_count = t.get("customers") or 0, t.get("rating_count") or 0
+        peak = hours[shop_id].most_common(1)
+        analytics[shop_id] = {
+            "total_revenue": revenue_by_shop.get(shop_id) or 0,
+            "total_bookings": total,
+            "average_rating": (t["rating_sum"] / rating_count) if rating_count else 0.0,
+            "cancellation_rate": (t["cancelled"] / total * 100) if total else 0,
+            "repeat_customer_rate": (t["repeat"] / customers * 100) if customers else 0,
+            "top_service": titles.get(top_service_ids.get(shop_id)),
+            "peak_booking_time": f"{peak[0][0]}:00" if peak else None,
+        }
+    return analytics
@@ -0,0 +1,167 @@
+# api/utils/autofill_offers.py
+"""
+Auto-fill offer dispatcher (used by api.tasks.send_autofill_offers).
+
+A wave's recipients go out in micro-batches of AUTOFILL_DISPATCH_BATCH_SIZE.
+Before each batch one query re-checks that the slot still has future
+capacity and that its AutoFillLog is still open (the payment outbox marks it
+completed once an offer is booked). Each batch gets:
+  - one bulk INSERT of the in-app Notifications (bulk_notify, which also
+    bumps the cached unread counters),
+  - one FCM send_each for all recipients' devices (api.utils.fcm.send_push_batch),
+  - one SMTP connection for its emails,
+  - the SMS messages (Twilio takes one message per call).
+The earliest, best-ranked recipients hear first, and nobody is offered a
+slot that has already been taken.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from api.utils.fcm import send_push_batch
+from api.utils.notifications import bulk_notify
+from api.utils.phones import get_user_phone
+from api.utils.sms import send_sms
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_BATCH_SIZE = getattr(settings, "AUTOFILL_DISPATCH_BATCH_SIZE", 10)
+OPEN_STATUSES = ("initiated", "outreach_started")
+
+PUSH_CHANNELS = ("push", "sms_push", "email_push")
+SMS_CHANNELS = ("sms", "sms_push", "email_sms", "all")
+EMAIL_CHANNELS = ("email", "email_push", "email_sms", "all")
+
+
+def offer_still_open(slot_id):
+    """The slot has future capacity and no closed AutoFillLog points at it (one query)."""
+    from api.models import Slot
+
+    return Slot.objects.filter(
+        Q(autofill_log__isnull=True) | Q(autofill_log__status__in=OPEN_STATUSES),
+        id=slot_id,
+        capacity_left__gt=0,
+        start_time__gt=timezone.now(),
+    ).exists()
+
+
+def offer_content(slot):
+    """Subject, bodies and payload of the offer for `slot` (with shop and service loaded)."""
+    start_local = timezone.localtime(slot.start_time)  # uses settings.TIME_ZONE
+    human_time = start_local.strftime("%I:%M %p on %b %d")
+
+    subject = "An opening just became available!"
+    message_body = (
+        f"{slot.shop.name} just had a {slot.service.title} spot open up at "
+        f"{human_time}. First come, first served!"
+    )
+    shortlink = f"https://your-app.com/book/{slot.id}"
+    data = {
+        "type": "autofill_offer",
+        "action": "book_offer",
+        "slot_id": str(slot.id),
+        "shop_id": str(slot.shop_id),
+        "service_id": str(slot.service_id),
+        "serviceName": slot.service.title or "",
+        "service_img": getattr(slot.service, "image_url", "") or "",
+        "shopName": slot.shop.name or "",
+        "shopAddress": getattr(slot.shop, "address", "") or "",
+        "serviceDurationMinutes": str(getattr(slot.service, "duration", 0)),
+        "start_time": start_local.isoformat(),  # localized ISO for client rendering
+        "price": str(getattr(slot.service, "price", 0) or 0),
+        "discountPrice": str(getattr(slot.service, "discount_price", "") or ""),
+        "deeplink": f"fidden://book/{slot.id}",
+        "url": shortlink,
+        "title": subject,
+        "body": message_body,
+    }
+    return {
+        "subject": subject,
+        "message": message_body,
+        "email_body": f"{message_body}\n\nTap to book: {shortlink}",
+        "sms_body": (
+            f"Fidden: Slot available! {slot.service.title} at {slot.shop.name} "
+            f"{human_time}. Book now: {shortlink}"
+        ),
+        "data": data,
+    }
+
+
+def _send_emails(users, content):
+    messages = [
+        EmailMessage(
+            subject=f"[Fidden] {content['subject']}",
+            body=content["email_body"],
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[u.email],
+        )
+        for u in users if u.email
+    ]
+    if not messages:
+        return 0
+    try:
+        with get_connection() as connection:
+            return connection.send_messages(messages) or 0
+    except Exception as e:
+        logger.warning("[autofill] email batch of %d failed: %s", len(messages), e, exc_info=True)
+        return 0
+
+
+def _send_sms(users, content):
+    sent = 0
+    for u in users:
+        phone = get_user_phone(u)
+        if not phone:
+            continue
+        try:
+            if send_sms(phone, content["sms_body"]):
+                sent += 1
+        except Exception as e:
+            logger.warning("[autofill] SMS failed user_id=%s err=%s", u.id, e, exc_info=True)
+    return sent
+
+
+def dispatch_offers(slot, users, channel, batch_size=DISPATCH_BATCH_SIZE):
+    """
+    Offer `slot` to `users` (in order) over `channel`, stopping as soon as the
+    slot is taken. Returns the counts sent and whether it stopped early.
+    """
+    from api.models import Notification
+
+    content = offer_content(slot)
+    result = {"notified": 0, "push": 0, "sms": 0, "email": 0, "stopped": False}
+
+    for start in range(0, len(users), batch_size):
+        if not offer_still_open(slot.id):
+            result["stopped"] = True
+            logger.info("[autofill] slot %s taken; %d recipients not contacted", slot.id, len(users) - start)
+            break
+        batch = users[start:start + batch_size]
+
+        notifications = bulk_notify([
+            Notification(
+                recipient_id=u.id,
+                message=content["message"],
+                notification_type="autofill_offer",
+                data=content["data"],
+            )
+            for u in batch
+        ])
+        result["notified"] += len(notifications)
+
+        if channel in PUSH_CHANNELS:
+            result["push"] += send_push_batch(
+                (n.recipient_id, content["subject"], content["message"],
+                 {**content["data"], "notification_id": str(n.id) if n.id else "",
+                  "click_action": "FLUTTER_NOTIFICATION_CLICK"})
+                for n in notifications
+            )
+        if channel in SMS_CHANNELS:
+            result["sms"] += _send_sms(batch, content)
+        if channel in EMAIL_CHANNELS:
+            result["email"] += _send_emails(batch, content)
+
+    return result
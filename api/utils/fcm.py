@@ -1,12 +1,19 @@
 # api/utils/fcm.py
-import json, os, tempfile, traceback
-from typing import Any, Dict, Optional, List
+import json, logging, os, tempfile, traceback
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional, List, Tuple
 from django.conf import settings
-from api.models import Notification
+from api.models import Device, Notification
 import firebase_admin
 from firebase_admin import credentials, messaging
 
 
+logger = logging.getLogger(__name__)
+
+# FCM accepts at most 500 messages per send_each call
+FCM_BATCH_LIMIT = 500
+
+
 def _init_firebase() -> None:
     if firebase_admin._apps:
         return
@@ -142,6 +149,59 @@ def send_push_notification(
         traceback.print_exc()
 
 
+def send_push_batch(
+        items: Iterable[Tuple[int, str, str, Optional[Dict[str, Any]]]],
+        *,
+        dry_run: bool = False,
+) -> int:
+    """
+    Push many (user_id, title, message, data) notifications at once: one
+    query for the device tokens, FCM send_each in chunks of 500, and one
+    DELETE for the tokens FCM rejected. Returns the users reached.
+    """
+    items = list(items)
+    _init_firebase()
+    if not items or not firebase_admin._apps:
+        return 0
+
+    tokens_by_user: Dict[int, List[str]] = defaultdict(list)
+    for user_id, token in Device.objects.filter(user_id__in={i[0] for i in items}).values_list("user_id", "fcm_token"):
+        if _valid(token):
+            tokens_by_user[user_id].append(token)
+
+    messages, owners = [], []
+    android = _android_cfg()
+    for user_id, title, message, data in items:
+        for token in tokens_by_user.get(user_id, ()):
+            messages.append(messaging.Message(
+                token=token,
+                notification=messaging.Notification(title=title, body=message),
+                data=_stringify(data),
+                android=android,
+                apns=_apns_cfg(title, message),
+            ))
+            owners.append((user_id, token))
+
+    reached, dead = set(), []
+    for start in range(0, len(messages), FCM_BATCH_LIMIT):
+        chunk = messages[start:start + FCM_BATCH_LIMIT]
+        try:
+            batch = messaging.send_each(chunk, dry_run=dry_run)
+        except Exception as e:
+            logger.warning("FCM send_each failed for %d messages: %s", len(chunk), e)
+            continue
+        for (user_id, token), response in zip(owners[start:start + FCM_BATCH_LIMIT], batch.responses):
+            if response.success:
+                reached.add(user_id)
+            elif isinstance(response.exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError)) \
+                    or "not found" in str(response.exception).lower():
+                dead.append(token)
+    if dead:
+        Device.objects.filter(fcm_token__in=dead).delete()
+        logger.info("Removed %d invalid FCM tokens", len(dead))
+    return len(reached)
+
+
 ##########this is the old one ###########
 
 # def notify_user(
@@ -1,10 +1,12 @@
 from typing import List, Dict
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.timezone import now, timedelta
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import Sum, Q, Exists, OuterRef
 import logging
 
-from api.models import Revenue, Shop, Service, RatingReview, Slot, SlotBooking
-from payments.models import Booking
+from api.models import Revenue, Shop, Service, RatingReview
+from api.utils.analytics_rollups import summed_rollups
 
 logger = logging.getLogger(__name__)
 
@@ -18,18 +20,77 @@ SERVICE_BOOKING_LOW_THRESHOLD = 3
 SERVICE_RATING_LOW_THRESHOLD = 3.5
 HIGH_RATING_THRESHOLD = 4.5
 
+GROWTH_SUGGESTIONS_CACHE_TTL = getattr(settings, "GROWTH_SUGGESTIONS_CACHE_SECONDS", 300)
+
+
+def _cache_key(shop_id):
+    return f"growth_suggestions_{shop_id}"
+
+
+def _booking_metrics(shop_id):
+    """Booking counts, customers and per-service counts summed from the shop's daily rollups."""
+    totals = summed_rollups([shop_id])[shop_id]
+    return {
+        "total_bookings": totals["bookings_total"],
+        "cancelled_bookings": totals["bookings_cancelled"],
+        "completed_bookings": totals["bookings_completed"],
+        "total_users": totals["new_customers"],
+        "repeat_users": totals["repeat_customers"],
+        "service_counts": totals["service_counts"],
+    }
+
+
+def _service_summary(shop_id, service_counts):
+    """Per-service booking count (from the rollups) and rating flags, one row per service of the shop."""
+    services = (
+        Service.objects
+        .filter(shop_id=shop_id)
+        .annotate(
+            has_low_rating=Exists(
+                RatingReview.objects.filter(service_id=OuterRef("pk"), rating__lt=SERVICE_RATING_LOW_THRESHOLD)
+            ),
+            has_high_rating=Exists(
+                RatingReview.objects.filter(service_id=OuterRef("pk"), rating__gte=HIGH_RATING_THRESHOLD)
+            ),
+        )
+        .values("id", "has_low_rating", "has_high_rating")
+    )
+    return [
+        {**service, "bookings": service_counts.get(str(service["id"]), 0)}
+        for service in services
+    ]
+
+
 def generate_growth_suggestions(shop_id: int) -> List[Dict]:
+    """
+    Growth suggestions for a shop, cached for GROWTH_SUGGESTIONS_CACHE_TTL.
+    A miss costs four queries (shop, revenue, the shop's daily rollups,
+    services); booking figures are as fresh as the rollups.
+    """
+    key = _cache_key(shop_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    suggestions, ok = _generate_growth_suggestions(shop_id)
+    if ok:
+        cache.set(key, suggestions, timeout=GROWTH_SUGGESTIONS_CACHE_TTL)
+    return suggestions
+
+
+def _generate_growth_suggestions(shop_id):
+    """(suggestions, ok); `ok` is False when something failed and the result must not be cached."""
     suggestions: Dict[str, Dict] = {}
 
     try:
-        shop = Shop.objects.get(id=shop_id)
+        shop = Shop.objects.only("id", "is_verified").get(id=shop_id)
 
         if not shop.is_verified:
             return [{
                 "suggestion_title": "Get Your Shop Verified",
                 "short_description": "Verify your shop to unlock all growth features and attract more customers.",
                 "category": "operational"
-            }]
+            }], True
 
         today = now().date()
         last_week = today - timedelta(days=7)
@@ -38,49 +99,39 @@ def generate_growth_suggestions(shop_id: int) -> List[Dict]:
         # -----------------------
         # Revenue calculation
         # -----------------------
-        revenue_data = Revenue.objects.filter(shop_id=shop_id)
-        current_revenue = revenue_data.filter(timestamp__gte=last_week).aggregate(total=Sum("revenue"))["total"] or 0
-        prev_revenue = revenue_data.filter(timestamp__range=(prev_week, last_week)).aggregate(total=Sum("revenue"))["total"] or 0
+        revenue = Revenue.objects.filter(shop_id=shop_id).aggregate(
+            current=Sum("revenue", filter=Q(timestamp__gte=last_week)),
+            previous=Sum("revenue", filter=Q(timestamp__range=(prev_week, last_week))),
+        )
+        current_revenue = revenue["current"] or 0
+        prev_revenue = revenue["previous"] or 0
         revenue_growth = ((current_revenue - prev_revenue) / prev_revenue * 100) if prev_revenue > 0 else 0
 
         # -----------------------
         # Booking & utilization
         # -----------------------
-        bookings_qs = Booking.objects.filter(shop_id=shop_id)
-        total_bookings = bookings_qs.count()
-        cancelled_bookings = bookings_qs.filter(status="cancelled").count()
-        completed_bookings = bookings_qs.filter(status="completed").count()
-        cancellation_rate = (cancelled_bookings / total_bookings * 100) if total_bookings > 0 else 0
-        utilization = (completed_bookings / total_bookings * 100) if total_bookings > 0 else 0
+        metrics = _booking_metrics(shop_id)
+        total_bookings = metrics["total_bookings"]
+        cancellation_rate = (metrics["cancelled_bookings"] / total_bookings * 100) if total_bookings > 0 else 0
+        utilization = (metrics["completed_bookings"] / total_bookings * 100) if total_bookings > 0 else 0
 
-        repeat_users = bookings_qs.values("user").annotate(count=Count("id")).filter(count__gt=1).count()
-        total_users = bookings_qs.values("user").distinct().count()
-        repeat_rate = (repeat_users / total_users * 100) if total_users > 0 else 0
+        total_users = metrics["total_users"]
+        repeat_rate = (metrics["repeat_users"] / total_users * 100) if total_users > 0 else 0
 
         # -----------------------
         # Service-based analysis
         # -----------------------
-        low_booking_services = Service.objects.filter(
-            shop_id=shop_id,
-            slots__bookings__isnull=True
-        ).distinct()
-
-        low_rating_services = Service.objects.filter(
-            shop_id=shop_id,
-            ratings__rating__lt=SERVICE_RATING_LOW_THRESHOLD
-        ).distinct()
-
-        high_rating_services = Service.objects.filter(
-            shop_id=shop_id,
-            ratings__rating__gte=HIGH_RATING_THRESHOLD
-        ).distinct()
+        services = _service_summary(shop_id, metrics["service_counts"])
+        has_low_booking_services = any(s["bookings"] < SERVICE_BOOKING_LOW_THRESHOLD for s in services)
+        has_low_rating_services = any(s["has_low_rating"] for s in services)
+        has_high_rating_services = any(s["has_high_rating"] for s in services)
 
         # -----------------------
         # Suggestion Engine
         # -----------------------
 
         # -------- Discount Suggestions --------
-        if repeat_rate < REPEAT_RATE_THRESHOLD or low_booking_services.exists():
+        if repeat_rate < REPEAT_RATE_THRESHOLD or has_low_booking_services:
             suggestions["discount"] = {
                 "suggestion_title": "Offer Discounts to Boost Bookings",
                 "short_description": f"Some services have low bookings or repeat rate is low. Offer discounts or bundle promotions to attract new and returning customers.",
@@ -100,7 +151,7 @@ def generate_growth_suggestions(shop_id: int) -> List[Dict]:
             }
 
         # -------- Operational Suggestions --------
-        if cancellation_rate > CANCELLATION_RATE_THRESHOLD or low_rating_services.exists():
+        if cancellation_rate > CANCELLATION_RATE_THRESHOLD or has_low_rating_services:
             suggestions["operational"] = {
                 "suggestion_title": "Enhance Customer Experience",
                 "short_description": "High cancellations or low ratings detected. Review service quality, training, and booking policies to improve satisfaction.",
@@ -112,7 +163,7 @@ def generate_growth_suggestions(shop_id: int) -> List[Dict]:
                 "short_description": "Some slots are fully booked. Consider increasing capacity, extending hours, or optimizing staffing.",
                 "category": "operational"
             }
-        elif high_rating_services.exists() and repeat_rate < 50:
+        elif has_high_rating_services and repeat_rate < 50:
             suggestions["operational"] = {
                 "suggestion_title": "Upsell High-Rated Services",
                 "short_description": "Some services have high ratings but low repeat bookings. Promote them to increase repeat business.",
@@ -143,6 +194,7 @@ def generate_growth_suggestions(shop_id: int) -> List[Dict]:
         logger.warning(f"Shop {shop_id} does not exist.")
     except Exception as e:
         logger.exception(f"Error generating growth suggestions for shop {shop_id}: {e}")
+        return list(suggestions.values()), False
 
     # Return suggestions as a list (1 per category)
-    return list(suggestions.values())
+    return list(suggestions.values()), True
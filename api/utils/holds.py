@@ -0,0 +1,229 @@
+# api/utils/holds.py
+"""
+Slot hold ledger helpers (see api.models.SlotHold).
+
+Bookings made through the hold flows (SlotBookingView, HoldSlotAndBookView)
+reserve one unit of slot capacity through an active hold; checkout bookings
+created by the payment views have no hold and no expiry. Creating the
+PaymentIntent or PayPal order extends the hold to
+SLOT_HOLD_PAYMENT_TTL_SECONDS. Payment success converts the hold; otherwise
+the periodic sweeper cancels the booking and gives the capacity back, one
+UPDATE per slot. A payment that still succeeds after that goes through
+`reclaim_expired_booking`.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HOLD_TTL_SECONDS = getattr(settings, "SLOT_HOLD_TTL_SECONDS", 300)
+PAYMENT_HOLD_TTL_SECONDS = getattr(settings, "SLOT_HOLD_PAYMENT_TTL_SECONDS", 1800)
+
+
+def create_hold(slot_booking, source="booking", ttl_seconds=None):
+    """Record the capacity a pending booking has just taken (call inside its transaction)."""
+    from api.models import SlotHold
+
+    ttl = ttl_seconds or HOLD_TTL_SECONDS
+    return SlotHold.objects.create(
+        slot_id=slot_booking.slot_id,
+        user_id=slot_booking.user_id,
+        slot_booking=slot_booking,
+        source=source,
+        expires_at=timezone.now() + timedelta(seconds=ttl),
+    )
+
+
+def active_hold_for(user, slot):
+    """The user's unexpired hold on `slot`, with its booking, if any."""
+    from api.models import SlotHold
+
+    return (
+        SlotHold.objects
+        .select_related("slot_booking")
+        .filter(user=user, slot=slot, status=SlotHold.STATUS_ACTIVE, expires_at__gt=timezone.now())
+        .first()
+    )
+
+
+def extend_hold(slot_booking_id, ttl_seconds=None):
+    """Push the booking's active hold out to `ttl_seconds` from now (payment started)."""
+    from api.models import SlotHold
+
+    ttl = ttl_seconds or PAYMENT_HOLD_TTL_SECONDS
+    return SlotHold.objects.filter(
+        slot_booking_id=slot_booking_id,
+        status=SlotHold.STATUS_ACTIVE,
+        expires_at__lt=timezone.now() + timedelta(seconds=ttl),
+    ).update(expires_at=timezone.now() + timedelta(seconds=ttl))
+
+
+def add_ons_to_hold(hold, add_on_ids):
+    """
+    Attach add-ons to a held booking (call inside the slot lock). Validated the
+    way SlotBookingSerializer validates them; end_time is recomputed from the
+    service plus every add-on on the booking. Raises ValidationError.
+    """
+    from rest_framework.exceptions import ValidationError
+    from api.models import BookingAddOn, Service, SlotBooking
+
+    booking = hold.slot_booking
+    add_on_ids = set(add_on_ids or [])
+    add_ons = list(Service.objects.filter(id__in=add_on_ids, shop_id=booking.shop_id, is_active=True))
+    if len(add_ons) != len(add_on_ids):
+        raise ValidationError("One or more add-on services are invalid or do not belong to this shop.")
+
+    existing = set(booking.add_ons.values_list("service_id", flat=True))
+    new_add_ons = [addon for addon in add_ons if addon.id not in existing]
+    if not new_add_ons:
+        return booking
+
+    total_duration = (booking.service.duration or 30) + sum(
+        (service.duration or 30)
+        for service in Service.objects.filter(id__in=existing | {addon.id for addon in add_ons})
+    )
+    end_time = booking.start_time + timedelta(minutes=total_duration)
+    overlapping = SlotBooking.objects.filter(
+        user_id=booking.user_id, status="confirmed",
+        start_time__lt=end_time, end_time__gt=booking.start_time,
+    ).exclude(id=booking.id)
+    if overlapping.exists():
+        raise ValidationError("You already have a booking that overlaps this slot (including add-ons).")
+
+    for addon in new_add_ons:
+        # save() snapshots the add-on price
+        BookingAddOn.objects.create(booking=booking, service=addon)
+    SlotBooking.objects.filter(id=booking.id).update(end_time=end_time)
+    booking.end_time = end_time
+    return booking
+
+
+def reclaim_expired_booking(slot_booking):
+    """
+    A payment succeeded for a booking the sweeper already cancelled. Take a
+    unit of the slot again under the slot lock and confirm the booking.
+    Returns False when that isn't possible (slot full or started, or the
+    booking was cancelled by something other than hold expiry); the caller
+    refunds then.
+    """
+    from api.models import Slot, SlotBooking, SlotHold
+    from api.utils.slot_events import slot_capacity_changed
+
+    with transaction.atomic():
+        slot = Slot.objects.select_for_update().get(id=slot_booking.slot_id)
+        booking = SlotBooking.objects.select_for_update().get(id=slot_booking.id)
+        if booking.status != "cancelled":
+            return True
+        expired = SlotHold.objects.filter(slot_booking_id=booking.id, status=SlotHold.STATUS_EXPIRED)
+        if not expired.exists() or slot.capacity_left <= 0 or slot.start_time <= timezone.now():
+            return False
+
+        Slot.objects.filter(id=slot.id).update(capacity_left=F("capacity_left") - 1)
+        SlotBooking.objects.filter(id=booking.id).update(status="confirmed")
+        expired.update(status=SlotHold.STATUS_CONVERTED, resolved_at=timezone.now())
+        slot_capacity_changed([slot.id])
+
+    slot_booking.status = "confirmed"
+    logger.info("Booking %s paid after its hold expired; slot %s reclaimed", slot_booking.id, slot.id)
+    return True
+
+
+def convert_hold(slot_booking_id):
+    """Payment succeeded: the held capacity is now a real booking."""
+    from api.models import SlotHold
+
+    return SlotHold.objects.filter(
+        slot_booking_id=slot_booking_id, status=SlotHold.STATUS_ACTIVE
+    ).update(status=SlotHold.STATUS_CONVERTED, resolved_at=timezone.now())
+
+
+def release_expired_holds(batch_size=500):
+    """
+    Release one batch of expired holds. Returns counts per outcome.
+
+    - booking paid in the meantime       -> converted
+    - booking still pending              -> booking cancelled, capacity restored, expired
+    - booking already cancelled elsewhere -> released (capacity was restored by that path)
+    """
+    from api.models import Slot, SlotBooking, SlotHold
+    from api.utils.slot_events import slot_capacity_changed
+
+    now = timezone.now()
+    with transaction.atomic():
+        holds = list(
+            SlotHold.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=SlotHold.STATUS_ACTIVE, expires_at__lte=now)
+            .order_by("expires_at")
+            .values_list("id", "slot_booking_id")[:batch_size]
+        )
+        if not holds:
+            return {"converted": 0, "expired": 0, "released": 0}
+
+        booking_to_hold = {booking_id: hold_id for hold_id, booking_id in holds}
+        bookings = list(
+            SlotBooking.objects
+            .select_for_update()
+            .filter(id__in=booking_to_hold.keys())
+            .values_list("id", "slot_id", "status", "payment_status")
+        )
+
+        paid, to_cancel = [], []
+        per_slot = {}
+        for booking_id, slot_id, status, payment_status in bookings:
+            if payment_status == "success":
+                paid.append(booking_id)
+            elif status != "cancelled":
+                to_cancel.append(booking_id)
+                per_slot[slot_id] = per_slot.get(slot_id, 0) + 1
+
+        if to_cancel:
+            SlotBooking.objects.filter(id__in=to_cancel).update(status="cancelled")
+            for slot_id, count in per_slot.items():
+                Slot.objects.filter(id=slot_id).update(capacity_left=F("capacity_left") + count)
+            slot_capacity_changed(per_slot.keys())
+
+        converted_ids = [booking_to_hold[b] for b in paid]
+        expired_ids = [booking_to_hold[b] for b in to_cancel]
+        released_ids = set(booking_to_hold.values()) - set(converted_ids) - set(expired_ids)
+        for status, ids in (
+            (SlotHold.STATUS_CONVERTED, converted_ids),
+            (SlotHold.STATUS_EXPIRED, expired_ids),
+            (SlotHold.STATUS_RELEASED, released_ids),
+        ):
+            if ids:
+                SlotHold.objects.filter(id__in=ids).update(status=status, resolved_at=now)
+
+    return {"converted": len(converted_ids), "expired": len(expired_ids), "released": len(released_ids)}
+
+
+def hold_metrics(hours=24, shop_id=None):
+    """Hold outcomes over the last `hours` and the hold-to-booking conversion rate."""
+    from api.models import SlotHold
+
+    qs = SlotHold.objects.filter(created_at__gte=timezone.now() - timedelta(hours=hours))
+    if shop_id:
+        qs = qs.filter(slot__shop_id=shop_id)
+    counts = qs.aggregate(
+        total=Count("id"),
+        active=Count("id", filter=Q(status=SlotHold.STATUS_ACTIVE)),
+        converted=Count("id", filter=Q(status=SlotHold.STATUS_CONVERTED)),
+        expired=Count("id", filter=Q(status=SlotHold.STATUS_EXPIRED)),
+        released=Count("id", filter=Q(status=SlotHold.STATUS_RELEASED)),
+        autofill_resolved=Count("id", filter=Q(source="autofill") & ~Q(status=SlotHold.STATUS_ACTIVE)),
+        autofill_converted=Count("id", filter=Q(source="autofill", status=SlotHold.STATUS_CONVERTED)),
+    )
+    # Rates only over resolved holds; active ones have no outcome yet
+    resolved = counts["converted"] + counts["expired"] + counts["released"]
+    counts["conversion_rate"] = round(counts["converted"] / resolved, 4) if resolved else None
+    counts["autofill_conversion_rate"] = (
+        round(counts["autofill_converted"] / counts["autofill_resolved"], 4)
+        if counts["autofill_resolved"] else None
+    )
+    counts["window_hours"] = hours
+    return counts
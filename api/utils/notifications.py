@@ -0,0 +1,91 @@
+# api/utils/notifications.py
+import logging
+from collections import Counter
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+UNREAD_COUNT_TTL = 60 * 60 * 24  # 1 day; recomputed from the DB on miss
+
+
+def _unread_key(user_id):
+    return f"notif_unread_{user_id}"
+
+
+def get_unread_count(user_id):
+    """
+    Cached unread notification count for a user.
+    Falls back to a COUNT on the (recipient, is_read) index on cache miss.
+    """
+    from api.models import Notification
+
+    key = _unread_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+        cache.set(key, count, timeout=UNREAD_COUNT_TTL)
+    return max(int(count), 0)
+
+
+def adjust_unread_count(user_id, delta):
+    """
+    Apply a +/- delta to the cached counter. If the key is not cached yet
+    there is nothing to adjust; the next read recomputes it.
+    """
+    if not user_id or not delta:
+        return
+    key = _unread_key(user_id)
+    try:
+        if delta > 0:
+            cache.incr(key, delta)
+        else:
+            value = cache.decr(key, -delta)
+            if value < 0:
+                cache.delete(key)
+    except ValueError:
+        # Key missing -> lazy recompute on next read
+        pass
+    except Exception as e:
+        logger.warning("Unread counter update failed for user %s: %s", user_id, e)
+        cache.delete(key)
+
+
+def reset_unread_count(user_id):
+    cache.delete(_unread_key(user_id))
+
+
+def bulk_notify(notifications):
+    """
+    Insert unsaved Notification objects with one bulk INSERT and bump each
+    recipient's cached unread counter. bulk_create skips post_save, so bulk
+    callers must go through here rather than Notification.objects.bulk_create.
+    Returns the created notifications.
+    """
+    from api.models import Notification
+
+    created = Notification.objects.bulk_create(notifications)
+    unread = Counter(n.recipient_id for n in created if not n.is_read)
+    for user_id, count in unread.items():
+        adjust_unread_count(user_id, count)
+    return created
+
+
+def mark_notifications_read(user, ids=None):
+    """
+    Mark a user's unread notifications as read with a single UPDATE.
+    `ids` optionally limits the update to specific notifications.
+    Returns the number of rows updated.
+    """
+    from api.models import Notification
+
+    qs = Notification.objects.filter(recipient=user, is_read=False)
+    if ids is not None:
+        qs = qs.filter(id__in=ids)
+    updated = qs.update(is_read=True)
+
+    if ids is None:
+        cache.set(_unread_key(user.id), 0, timeout=UNREAD_COUNT_TTL)
+    elif updated:
+        adjust_unread_count(user.id, -updated)
+    return updated
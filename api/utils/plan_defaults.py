@@ -0,0 +1,150 @@
+# api/utils/plan_defaults.py
+"""
+Set-based deposit recalculation and GlobalSettings propagation.
+
+`recalculate_service_deposits` recomputes deposit_amount for a queryset of
+services with one UPDATE (base price = discount_price when > 0, else price).
+
+Saving GlobalSettings no longer walks every Foundation shop in the admin
+request. `schedule_propagation` records a run and, after commit, queues
+`api.tasks.propagate_global_settings`, which applies the defaults to the
+Foundation shops in id-ordered chunks (two UPDATEs per chunk) and writes
+its progress to the cache (`propagation_progress`). A newer save supersedes
+a run that is still going; the newer run starts again from the first shop.
+"""
+import logging
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, PositiveIntegerField, Q, Value, When
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_KEY = "global_settings_propagation"
+PROGRESS_TTL = 7 * 24 * 3600
+BATCH_SIZE = getattr(settings, "GLOBAL_SETTINGS_PROPAGATION_BATCH_SIZE", 200)
+
+
+def recalculate_service_deposits(services, percentage):
+    """
+    Set percentage-type services to `percentage` and recompute every
+    priced service's deposit_amount from it. Returns the rows updated.
+    """
+    factor = Decimal(percentage) / Decimal(100)
+    base_price = Case(When(discount_price__gt=0, then=F("discount_price")), default=F("price"))
+    return services.update(
+        deposit_percentage=Case(
+            When(deposit_type="percentage", then=Value(percentage)),
+            default=F("deposit_percentage"),
+            output_field=PositiveIntegerField(),
+        ),
+        deposit_amount=Case(
+            When(
+                Q(discount_price__gt=0) | Q(price__gt=0),
+                then=ExpressionWrapper(base_price * Value(factor), output_field=DecimalField(max_digits=10, decimal_places=2)),
+            ),
+            default=F("deposit_amount"),
+        ),
+    )
+
+
+def foundation_shops():
+    from api.models import Shop
+    from subscriptions.models import ShopSubscription, SubscriptionPlan
+
+    return Shop.objects.filter(
+        subscription__plan__name=SubscriptionPlan.FOUNDATION,
+        subscription__status=ShopSubscription.STATUS_ACTIVE,
+    )
+
+
+def apply_global_defaults(shop_ids, global_settings):
+    """Overwrite the shops' policy fields with the global defaults (apply_plan_defaults(overwrite=True) for Foundation)."""
+    from api.models import Service, Shop
+
+    with transaction.atomic():
+        Shop.objects.filter(id__in=shop_ids).update(
+            is_deposit_required=global_settings.default_deposit_required,
+            default_deposit_type=global_settings.default_deposit_type,
+            default_deposit_percentage=global_settings.default_deposit_percentage,
+            free_cancellation_hours=global_settings.default_free_cancellation_hours,
+            cancellation_fee_percentage=global_settings.default_cancellation_fee_percentage,
+            no_refund_hours=global_settings.default_no_refund_hours,
+        )
+        if global_settings.default_deposit_type == "percentage" and global_settings.default_deposit_percentage:
+            recalculate_service_deposits(
+                Service.objects.filter(shop_id__in=shop_ids), global_settings.default_deposit_percentage
+            )
+
+
+def propagation_progress():
+    """Progress of the latest GlobalSettings propagation run, or None."""
+    return cache.get(PROGRESS_KEY)
+
+
+def _set_progress(run_id, **fields):
+    """Update the run's progress; returns None once a newer run has replaced it."""
+    progress = cache.get(PROGRESS_KEY) or {}
+    if progress.get("run_id") != run_id:
+        return None
+    progress.update(fields)
+    cache.set(PROGRESS_KEY, progress, PROGRESS_TTL)
+    return progress
+
+
+def schedule_propagation():
+    """Start a new run after the current transaction commits. Returns its run id."""
+    run_id = uuid.uuid4().hex
+    cache.set(PROGRESS_KEY, {
+        "run_id": run_id,
+        "status": "queued",
+        "total": None,
+        "processed": 0,
+        "queued_at": timezone.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+    }, PROGRESS_TTL)
+
+    def dispatch():
+        from api.tasks import propagate_global_settings
+
+        try:
+            propagate_global_settings.delay(run_id)
+        except Exception as e:
+            logger.error("GlobalSettings propagation %s not dispatched: %s", run_id, e)
+            _set_progress(run_id, status="failed", error=str(e)[:500])
+
+    transaction.on_commit(dispatch)
+    return run_id
+
+
+def propagate_global_settings(run_id, batch_size=BATCH_SIZE):
+    """Apply the current GlobalSettings to every active Foundation shop, chunk by chunk."""
+    from api.models import GlobalSettings
+
+    global_settings = GlobalSettings.get_settings()
+    shops = foundation_shops().order_by("id")
+    running = _set_progress(
+        run_id, status="running", total=shops.count(), processed=0, started_at=timezone.now().isoformat()
+    )
+
+    processed, last_id = 0, 0
+    while running:
+        shop_ids = list(shops.filter(id__gt=last_id).values_list("id", flat=True)[:batch_size])
+        if not shop_ids:
+            break
+        apply_global_defaults(shop_ids, global_settings)
+        processed += len(shop_ids)
+        last_id = shop_ids[-1]
+        running = _set_progress(run_id, processed=processed)
+
+    if not running:
+        logger.info("GlobalSettings propagation %s superseded after %s shops", run_id, processed)
+        return processed
+    _set_progress(run_id, status="done", processed=processed, finished_at=timezone.now().isoformat())
+    logger.info("GlobalSettings propagation %s applied to %s shops", run_id, processed)
+    return processed
@@ -0,0 +1,156 @@
+# api/utils/presence.py
+"""
+Chat presence registry.
+
+Each websocket connection registers its channel name in a per-user Redis set
+(`presence:user:<id>`) and keeps a per-connection key
+(`presence:conn:<channel>`) holding the thread the client has open. Both
+keys carry a heartbeat TTL, so a crashed worker never leaves a user
+"online" for longer than PRESENCE_TTL.
+
+Without django-redis (LocMem in development) the same information is kept
+in a plain cache dict per user.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TTL = getattr(settings, "CHAT_PRESENCE_TTL_SECONDS", 90)
+PUSH_COALESCE_WINDOW = getattr(settings, "CHAT_PUSH_COALESCE_SECONDS", 60)
+
+
+def _user_key(user_id):
+    return f"presence:user:{user_id}"
+
+
+def _conn_key(channel_name):
+    return f"presence:conn:{channel_name}"
+
+
+def _redis():
+    """Raw redis client when the default cache is django-redis, else None."""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except Exception:
+        return None
+
+
+def _conn_value(thread_id):
+    return str(thread_id) if thread_id else ""
+
+
+# ---------------------------------------------------------------------------
+# Registry maintenance (called by ChatConsumer)
+# ---------------------------------------------------------------------------
+
+def register_connection(user_id, channel_name, thread_id=None):
+    """Register or refresh a connection; doubles as the heartbeat."""
+    try:
+        r = _redis()
+        if r is not None:
+            pipe = r.pipeline()
+            pipe.sadd(_user_key(user_id), channel_name)
+            pipe.expire(_user_key(user_id), PRESENCE_TTL)
+            pipe.set(_conn_key(channel_name), _conn_value(thread_id), ex=PRESENCE_TTL)
+            pipe.execute()
+            return
+        conns = cache.get(_user_key(user_id)) or {}
+        conns[channel_name] = (_conn_value(thread_id), time.time() + PRESENCE_TTL)
+        cache.set(_user_key(user_id), conns, timeout=PRESENCE_TTL)
+    except Exception as e:
+        logger.warning("Presence register failed for user %s: %s", user_id, e)
+
+
+def unregister_connection(user_id, channel_name):
+    try:
+        r = _redis()
+        if r is not None:
+            pipe = r.pipeline()
+            pipe.srem(_user_key(user_id), channel_name)
+            pipe.delete(_conn_key(channel_name))
+            pipe.execute()
+            return
+        conns = cache.get(_user_key(user_id)) or {}
+        conns.pop(channel_name, None)
+        if conns:
+            cache.set(_user_key(user_id), conns, timeout=PRESENCE_TTL)
+        else:
+            cache.delete(_user_key(user_id))
+    except Exception as e:
+        logger.warning("Presence unregister failed for user %s: %s", user_id, e)
+
+
+# ---------------------------------------------------------------------------
+# Lookups
+# ---------------------------------------------------------------------------
+
+def _active_threads(user_id):
+    """
+    Thread values ("" = connected, no thread open) for the user's live
+    connections. Stale set members whose connection key expired are pruned.
+    """
+    r = _redis()
+    if r is not None:
+        members = [m.decode() if isinstance(m, bytes) else m for m in r.smembers(_user_key(user_id))]
+        if not members:
+            return []
+        values = r.mget([_conn_key(m) for m in members])
+        stale = [m for m, v in zip(members, values) if v is None]
+        if stale:
+            r.srem(_user_key(user_id), *stale)
+        return [v.decode() if isinstance(v, bytes) else v for v in values if v is not None]
+
+    now = time.time()
+    conns = cache.get(_user_key(user_id)) or {}
+    return [thread for thread, expires_at in conns.values() if expires_at > now]
+
+
+def is_online(user_id):
+    try:
+        return bool(_active_threads(user_id))
+    except Exception as e:
+        logger.warning("Presence lookup failed for user %s: %s", user_id, e)
+        return False
+
+
+def is_viewing_thread(user_id, thread_id):
+    """True when one of the user's live connections has `thread_id` open."""
+    try:
+        return str(thread_id) in _active_threads(user_id)
+    except Exception as e:
+        logger.warning("Presence lookup failed for user %s: %s", user_id, e)
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Chat notification policy
+# ---------------------------------------------------------------------------
+
+def should_notify_chat(recipient_id, thread_id):
+    """
+    Decide whether a chat message warrants a Notification row + push.
+
+    - Recipient has the thread open on a live socket -> no (they already
+      received the message over the `user_<id>` group).
+    - Otherwise at most one notification per (recipient, thread) per
+      PUSH_COALESCE_WINDOW; later messages in the burst are collapsed.
+    - Cache unavailable -> yes (fail open: pushes go out uncoalesced).
+    """
+    if is_viewing_thread(recipient_id, thread_id):
+        return False
+    try:
+        # With IGNORE_EXCEPTIONS a Redis error comes back as None, not an
+        # exception; only an explicit False (window already taken) suppresses
+        return cache.add(f"chat_push_window:{recipient_id}:{thread_id}", 1, timeout=PUSH_COALESCE_WINDOW) is not False
+    except Exception:
+        return True
+
+
+def reset_chat_push_window(recipient_id, thread_id):
+    """Called when the recipient reads the thread so the next message pushes again."""
+    cache.delete(f"chat_push_window:{recipient_id}:{thread_id}")
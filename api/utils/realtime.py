@@ -0,0 +1,43 @@
+# api/utils/realtime.py
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+async def abroadcast(events):
+    """
+    Async variant of `broadcast`. `events` is a list of (group, message).
+    Uses the layer's batched group_send_many when available (Redis layer),
+    otherwise runs the group_sends concurrently.
+    """
+    events = [(group, message) for group, message in events if group]
+    if not events:
+        return
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    if hasattr(layer, "group_send_many"):
+        await layer.group_send_many(events)
+    else:
+        await asyncio.gather(*(layer.group_send(group, message) for group, message in events))
+
+
+def broadcast(events):
+    """
+    Send all websocket events for one action in a single sync->async bridge.
+    Safe to call from sync views and Celery tasks; delivery failures are
+    logged and never raised, the DB write is the source of truth.
+
+        broadcast([
+            (f"user_{recipient_id}", {"type": "chat_message", "message": data}),
+            (f"user_{sender_id}", {"type": "chat_message", "message": data}),
+        ])
+    """
+    try:
+        async_to_sync(abroadcast)(events)
+    except Exception as e:
+        logger.error("Websocket broadcast failed (%s events): %s", len(events), e)
@@ -0,0 +1,70 @@
+# api/utils/slot_events.py
+"""
+Realtime slot availability.
+
+Every change to Slot.capacity_left goes through `slot_capacity_changed`,
+either from the Slot post_save receiver (`save(update_fields=["capacity_left"])`)
+or explicitly after queryset `.update(capacity_left=F(...))` calls.
+
+After the surrounding transaction commits, the current capacity of the
+touched slots is read back in one query and pushed to the
+`slots_<shop>_<service>_<YYYYMMDD>` group that SlotAvailabilityConsumer
+subscribers of that calendar day have joined. Values are absolute, so
+duplicated or reordered events are harmless.
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from api.utils.realtime import broadcast
+from api.utils.timezone_helpers import to_utc_iso
+
+logger = logging.getLogger(__name__)
+
+
+def slot_group_name(shop_id, service_id, day):
+    """`day` is a date in the server's current timezone, as SlotListView uses."""
+    return f"slots_{shop_id}_{service_id}_{day:%Y%m%d}"
+
+
+def _emit(slot_ids):
+    from api.models import Slot
+
+    slots = (
+        Slot.objects
+        .filter(id__in=slot_ids)
+        .only("id", "shop_id", "service_id", "start_time", "end_time", "capacity_left")
+    )
+    by_group = {}
+    for slot in slots:
+        group = slot_group_name(slot.shop_id, slot.service_id, timezone.localtime(slot.start_time).date())
+        by_group.setdefault(group, []).append({
+            "slot_id": slot.id,
+            "start_time": to_utc_iso(slot.start_time),
+            "end_time": to_utc_iso(slot.end_time),
+            "capacity_left": slot.capacity_left,
+        })
+    if by_group:
+        broadcast([
+            (group, {"type": "slot_capacity", "slots": changed})
+            for group, changed in by_group.items()
+        ])
+
+
+def slot_capacity_changed(slot_ids):
+    """
+    Single hook for capacity changes. Safe to call inside a transaction:
+    the push happens on commit and is dropped on rollback.
+    """
+    slot_ids = {int(s) for s in slot_ids if s}
+    if not slot_ids:
+        return
+
+    def _send():
+        try:
+            _emit(slot_ids)
+        except Exception as e:
+            logger.warning("Slot capacity push failed for slots %s: %s", sorted(slot_ids), e)
+
+    transaction.on_commit(_send)
@@ -0,0 +1,92 @@
+# api/utils/waitlist.py
+"""
+No-show auto-fill candidate ranking and offer waves.
+
+`rank_candidates` picks the next users to offer a freed slot to in one
+grouped query with LIMIT (index waitlist_shop_optin_svc_idx), one row per
+user, ranked by:
+  1. waited for this service (an "any service" entry ranks below),
+  2. past bookings at the shop that weren't cancelled,
+  3. never / least recently offered (WaitlistEntry.last_offered_at),
+  4. most recently joined the waitlist.
+Users offered anything at the shop within AUTOFILL_OFFER_COOLDOWN_MINUTES
+are skipped, which also keeps a later wave from re-offering earlier ones.
+
+The waves (`AUTOFILL_WAVES`) run as api.tasks.run_autofill_wave. Each wave
+first checks that the outreach is still open and the slot still has
+capacity, so no wave goes out after the slot is taken.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, Count, F, IntegerField, Max, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# (recipients, channel, seconds after the previous wave)
+AUTOFILL_WAVES = (
+    (5, "push", 0),
+    (20, "email", 60),
+)
+OFFER_COOLDOWN = timedelta(minutes=getattr(settings, "AUTOFILL_OFFER_COOLDOWN_MINUTES", 120))
+
+
+def rank_candidates(shop_id, service_id, limit, exclude_user_ids=()):
+    """User ids of the best `limit` opted-in waitlist users for the shop's freed slot."""
+    from api.models import SlotBooking, WaitlistEntry
+
+    past_bookings = (
+        SlotBooking.objects
+        .filter(user_id=OuterRef("user_id"), shop_id=shop_id)
+        .exclude(status="cancelled")
+        .order_by()
+        .values("user_id")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    rows = (
+        WaitlistEntry.objects
+        .filter(shop_id=shop_id, opted_in_offers=True)
+        .exclude(user_id__in=[uid for uid in exclude_user_ids if uid])
+        .values("user_id")
+        .annotate(
+            service_match=Max(Case(
+                When(service_id=service_id, then=Value(2)),
+                When(service__isnull=True, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )),
+            last_offered=Max("last_offered_at"),
+            joined=Max("created_at"),
+            past_bookings=Coalesce(Subquery(past_bookings, output_field=IntegerField()), Value(0)),
+        )
+        .filter(Q(last_offered__isnull=True) | Q(last_offered__lt=timezone.now() - OFFER_COOLDOWN))
+        .order_by(
+            F("service_match").desc(),
+            F("past_bookings").desc(),
+            F("last_offered").asc(nulls_first=True),
+            F("joined").desc(),
+            "user_id",
+        )
+        .values_list("user_id", flat=True)[:limit]
+    )
+    return list(rows)
+
+
+def mark_offered(shop_id, user_ids, at=None):
+    """Stamp the users' waitlist entries at the shop as just offered."""
+    from api.models import WaitlistEntry
+
+    return WaitlistEntry.objects.filter(shop_id=shop_id, user_id__in=user_ids).update(
+        last_offered_at=at or timezone.now()
+    )
+
+
+def outreach_open(log):
+    """True while the log's outreach may still send offers (not filled, slot not full or past)."""
+    from api.utils.autofill_offers import offer_still_open
+
+    return bool(log.offered_slot_id) and offer_still_open(log.offered_slot_id)
@@ -0,0 +1,306 @@
+# api/utils/weekly_reports.py
+"""
+Weekly AI report ("Your Week at a Glance") building blocks.
+
+`collect_weekly_metrics` computes every shop's figures with one grouped
+query per metric across all eligible shops. The figures are: completed
+appointments and top service (summed from the daily rollups), revenue and
+the previous week's revenue, the payment breakdown, rebooking rate, filled
+no-shows, and open slots next week. `build_weekly_report` turns one shop's figures into the stored
+summary fields and the texts for each delivery channel. Delivery lives in
+api.tasks.generate_weekly_ai_report_batch.
+
+The window is the same absolute 7 days for every shop. The shop timezone
+only decides the calendar dates: the summary's week dates and which days
+count as next week.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal("0.00")
+
+
+def shop_zone(shop):
+    try:
+        return ZoneInfo(shop.time_zone)
+    except Exception:
+        return ZoneInfo("UTC")
+
+
+def next_week_dates(shop, end_dt):
+    """(first, last) local date of the 7 days after the report window."""
+    start = (end_dt.astimezone(shop_zone(shop)) + timedelta(days=1)).date()
+    return start, start + timedelta(days=6)
+
+
+def collect_weekly_metrics(shops, start_dt, end_dt):
+    """{shop_id: metrics} for `shops` over [start_dt, end_dt] (plus the week before for growth)."""
+    from api.models import AutoFillLog, Service, Slot
+    from api.utils.analytics_rollups import summed_rollups
+    from payments.models import Booking, Payment, TransactionLog
+
+    shop_ids = [shop.id for shop in shops]
+    prev_start = start_dt - timedelta(days=7)
+    last_30 = end_dt - timedelta(days=30)
+    metrics = {
+        shop_id: {
+            "total_appointments": 0,
+            "total_revenue": ZERO,
+            "prev_revenue": ZERO,
+            "revenue_deposits": ZERO,
+            "revenue_tips": ZERO,
+            "revenue_checkout": ZERO,
+            "unique_clients": 0,
+            "rebooked_clients": 0,
+            "no_shows_filled": 0,
+            "top_service_name": "",
+            "top_service_count": 0,
+            "open_slots_next_week": 0,
+        }
+        for shop_id in shop_ids
+    }
+
+    # 1 + 6. Completed appointments this week and the top service, from the
+    # daily rollups of the seven days ending on end_dt's date
+    last_day = timezone.localtime(end_dt).date()
+    rollups = summed_rollups(shop_ids, last_day - timedelta(days=6), last_day)
+    top_services = {}
+    for shop_id, totals in rollups.items():
+        metrics[shop_id]["total_appointments"] = totals["bookings_completed"]
+        top = totals["completed_service_counts"].most_common(1)
+        if top:
+            top_services[shop_id] = (int(top[0][0]), top[0][1])
+    titles = dict(
+        Service.objects.filter(id__in=[sid for sid, _ in top_services.values()]).values_list("id", "title")
+    )
+    for shop_id, (service_id, count) in top_services.items():
+        metrics[shop_id]["top_service_name"] = titles.get(service_id) or ""
+        metrics[shop_id]["top_service_count"] = count
+
+    # 2 + 3. Revenue this week and the week before (payment TransactionLogs)
+    for r in (
+        TransactionLog.objects
+        .filter(shop_id__in=shop_ids, transaction_type="payment", created_at__gte=prev_start, created_at__lte=end_dt)
+        .values("shop_id")
+        .annotate(
+            current=Sum("amount", filter=Q(created_at__gte=start_dt)),
+            previous=Sum("amount", filter=Q(created_at__lte=start_dt)),
+        )
+    ):
+        metrics[r["shop_id"]]["total_revenue"] = r["current"] or ZERO
+        metrics[r["shop_id"]]["prev_revenue"] = r["previous"] or ZERO
+
+    # Revenue breakdown from succeeded payments (tips are collected at checkout)
+    for r in (
+        Payment.objects
+        .filter(booking__shop_id__in=shop_ids, status="succeeded", created_at__gte=start_dt, created_at__lte=end_dt)
+        .values("booking__shop_id")
+        .annotate(
+            deposits=Sum("deposit_paid", filter=Q(is_deposit=True)),
+            tips=Sum("tips_amount"),
+            checkout=Sum("balance_paid"),
+        )
+    ):
+        m = metrics[r["booking__shop_id"]]
+        m["revenue_deposits"] = r["deposits"] or ZERO
+        m["revenue_tips"] = r["tips"] or ZERO
+        m["revenue_checkout"] = (r["checkout"] or ZERO) + m["revenue_tips"]
+
+    # 4. Rebooking: clients served this week with >= 2 completed bookings in the last 30 days
+    for r in (
+        Booking.objects
+        .filter(shop_id__in=shop_ids, status="completed", created_at__gte=last_30, created_at__lte=end_dt)
+        .values("shop_id", "user_id")
+        .annotate(total=Count("id"), this_week=Count("id", filter=Q(created_at__gte=start_dt)))
+        .filter(this_week__gt=0)
+    ):
+        m = metrics[r["shop_id"]]
+        m["unique_clients"] += 1
+        if r["total"] >= 2:
+            m["rebooked_clients"] += 1
+
+    # 5. No-shows recovered by auto-fill
+    for r in (
+        AutoFillLog.objects
+        .filter(
+            shop_id__in=shop_ids, status="completed", filled_by_booking__isnull=False,
+            created_at__gte=start_dt, created_at__lte=end_dt,
+        )
+        .values("shop_id")
+        .annotate(filled=Count("filled_by_booking_id", distinct=True))
+    ):
+        metrics[r["shop_id"]]["no_shows_filled"] = r["filled"]
+
+    # 7. Open slots next week (dates in each shop's timezone)
+    ranges = {shop.id: next_week_dates(shop, end_dt) for shop in shops}
+    if ranges:
+        first = min(r[0] for r in ranges.values())
+        last = max(r[1] for r in ranges.values())
+        for r in (
+            Slot.objects
+            .filter(shop_id__in=shop_ids, start_time__date__gte=first, start_time__date__lte=last, capacity_left__gt=0)
+            .annotate(day=TruncDate("start_time"))
+            .values("shop_id", "day")
+            .annotate(c=Count("id"))
+        ):
+            day_from, day_to = ranges[r["shop_id"]]
+            if day_from <= r["day"] <= day_to:
+                metrics[r["shop_id"]]["open_slots_next_week"] += r["c"]
+
+    return metrics
+
+
+def build_weekly_report(shop, metrics, start_dt, end_dt):
+    """Summary fields and channel texts for one shop's week."""
+    owner = shop.owner
+    total_appointments = metrics["total_appointments"]
+    total_revenue = Decimal(metrics["total_revenue"])
+    prev_revenue = Decimal(metrics["prev_revenue"])
+    no_shows_filled = metrics["no_shows_filled"]
+    open_slots_next_week = metrics["open_slots_next_week"]
+    top_service_name = metrics["top_service_name"]
+    top_service_count = metrics["top_service_count"]
+
+    growth_rate = float(((total_revenue - prev_revenue) / prev_revenue) * 100) if prev_revenue > 0 else 0.0
+    unique_clients = metrics["unique_clients"]
+    rebooking_rate = (metrics["rebooked_clients"] / unique_clients * 100.0) if unique_clients else 0.0
+
+    avg_ticket = (total_revenue / total_appointments) if total_appointments else ZERO
+    forecast_estimated_revenue = avg_ticket * Decimal(open_slots_next_week)
+
+    ai_motivation = (
+        "You didn’t just serve clients — you built confidence and trust this week. "
+        "Let’s carry that momentum into next week."
+    )
+    revenue_booster_text = (
+        f"Promote your {top_service_name} first thing Monday. "
+        f"It was booked {top_service_count} times this week and drove great reviews. "
+        "Want me to generate an IG caption + booking link?"
+        if top_service_name
+        else
+        "Promote your top service in Stories Monday morning. "
+        "Ask people to DM you for a spot — I can draft the caption + link."
+    )
+    retention_play_text = (
+        "Some clients haven’t rebooked yet. Offer them a ‘Next Week Loyalty Boost’ — "
+        "10% off if they book within 7 days. Want me to prep that SMS blast?"
+    )
+    ai_recommendations = {
+        "revenue_booster": {
+            "headline": "Revenue Booster",
+            "text": revenue_booster_text,
+            "cta_label": "Yes, Create It",
+            "cta_action": "generate_marketing_caption",
+        },
+        "retention_play": {
+            "headline": "Retention Play",
+            "text": retention_play_text,
+            "cta_label": "Send via Email",
+            "cta_action": "send_loyalty_email",
+        },
+        "forecast": {
+            "open_slots_next_week": open_slots_next_week,
+            "forecast_estimated_revenue": float(forecast_estimated_revenue),
+        },
+    }
+
+    tz = shop_zone(shop)
+    summary_fields = {
+        "week_start_date": start_dt.astimezone(tz).date(),
+        "week_end_date": end_dt.astimezone(tz).date(),
+        "total_appointments": total_appointments,
+        "revenue_generated": total_revenue,
+        "revenue_deposits": Decimal(metrics["revenue_deposits"]),
+        "revenue_checkout": Decimal(metrics["revenue_checkout"]),
+        "revenue_tips": Decimal(metrics["revenue_tips"]),
+        "rebooking_rate": rebooking_rate,
+        "growth_rate": growth_rate,
+        "no_shows_filled": no_shows_filled,
+        "top_service": top_service_name,
+        "top_service_count": top_service_count,
+        "open_slots_next_week": open_slots_next_week,
+        "forecast_estimated_revenue": forecast_estimated_revenue,
+        "ai_motivation": ai_motivation,
+        "ai_recommendations": ai_recommendations,
+    }
+
+    report_title = "Your Weekly Business Snapshot ✨"
+    push_summary = (
+        f"Hey {getattr(owner, 'name', '') or ''} — you wrapped another great week. "
+        f"${float(total_revenue):.2f} earned, {no_shows_filled} no-shows saved. "
+        "Tap to see your gameplan."
+    )
+    detailed_message = (
+        f"Here's your weekly wrap-up from your AI partner, "
+        f"{shop.ai_partner_name or 'Amara'}!\n\n"
+        f"✨ You served {total_appointments} clients this week.\n"
+        f"💵 You earned ${float(total_revenue):.2f} in total bookings.\n"
+        f"🔁 Rebooking rate: {rebooking_rate:.0f}%.\n"
+        f"⏱ You filled {no_shows_filled} last-minute cancellations.\n"
+        f"🗓 {open_slots_next_week} open slots next week.\n\n"
+        "You’re not just running a business — you’re building a movement. "
+        "Let’s make next week your strongest yet."
+    )
+    email_body = (
+        detailed_message
+        + "\n\n"
+        + ai_motivation
+        + "\n\nRevenue Booster:\n- "
+        + revenue_booster_text
+        + "\n\nRetention Play:\n- "
+        + retention_play_text
+    )
+    return {
+        "summary": summary_fields,
+        "title": report_title,
+        "push_summary": push_summary,
+        "detailed_message": detailed_message,
+        "email_subject": f"[Fidden] {report_title}",
+        "email_body": email_body,
+    }
+
+
+def klaviyo_event(shop, summary, deep_link):
+    """Profile + event properties of the 'Weekly Recap Ready' Klaviyo event."""
+    subscription = getattr(shop, "subscription", None)
+    profile = {
+        "plan": getattr(getattr(subscription, "plan", None), "name", None),
+        "plan_status": getattr(subscription, "status", None),
+        "ai_addon": bool(getattr(subscription, "ai_assistant", False)),
+        "shop_id": shop.id,
+    }
+    event_props = {
+        "shop_id": shop.id,
+        "weekly_summary_id": str(summary.id),
+        "week_start": str(summary.week_start_date),
+        "week_end": str(summary.week_end_date),
+        "total_appointments": summary.total_appointments,
+        "total_revenue": float(summary.revenue_generated),
+        "growth_rate": summary.growth_rate,
+        "rebooking_rate": summary.rebooking_rate,
+        "no_shows_filled": summary.no_shows_filled,
+        "top_service": summary.top_service,
+        "top_service_count": summary.top_service_count,
+        "open_slots_next_week": summary.open_slots_next_week,
+        "forecast_estimated_revenue": float(summary.forecast_estimated_revenue),
+        "ai_motivation": summary.ai_motivation,
+        "ai_recommendations": summary.ai_recommendations,
+        "deep_link": deep_link,
+    }
+    return profile, event_props
+
+
+def serialize_metrics(metrics):
+    """JSON-safe copy for task arguments (Decimals as strings)."""
+    return {
+        str(shop_id): {k: str(v) if isinstance(v, Decimal) else v for k, v in m.items()}
+        for shop_id, m in metrics.items()
+    }
@@ -62,3 +62,41 @@ def send_klaviyo_event(
             exc_info=True,
         )
         return False
+
+
+def send_klaviyo_events(events):
+    """
+    Send several Klaviyo events in one webhook call. `events` is a list of
+    dicts with the send_klaviyo_event keyword arguments; Zapier catch hooks
+    run the zap once per element of a JSON array body.
+    """
+    if not events:
+        return True
+    if not ZAPIER_WEBHOOK_URL:
+        logger.warning("[klaviyo] ZAPIER_KLAVIYO_WEBHOOK not configured; skipping")
+        return False
+
+    sent_at = timezone.now().isoformat()
+    payload = [
+        {
+            "email": e["email"],
+            "event_name": e["event_name"],
+            "profile": e["profile"],
+            "event_props": e.get("event_props") or {},
+            "sent_at": sent_at,
+        }
+        for e in events
+    ]
+
+    try:
+        resp = requests.post(
+            ZAPIER_WEBHOOK_URL,
+            headers={"Content-Type": "application/json"},
+            data=json.dumps(payload, default=_json_default),
+            timeout=10,
+        )
+        logger.info("[klaviyo] batch events=%s status=%s", len(payload), resp.status_code)
+        return resp.ok
+    except Exception as e:
+        logger.error("[klaviyo] failed to send batch of %s events err=%s", len(payload), e, exc_info=True)
+        return False
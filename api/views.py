@@ -11,11 +11,9 @@ from django.shortcuts import get_object_or_404
 from django.db.models import Avg, Sum
 from django.core.cache import cache
 from django.core.mail import send_mail
-from django.utils.timezone import make_aware
 from django.core.mail import EmailMultiAlternatives, get_connection
 
 from api.utils.slots import generate_slots_for_service
-from subscriptions.models import SubscriptionPlan, ShopSubscription
 from .models import (
     AutoFillLog,
     PerformanceAnalytics,
@@ -73,18 +71,28 @@ from datetime import date, datetime, timedelta
 from django.utils import timezone
 from django.db.models import Avg, Count, Q, Value, FloatField, OuterRef, Subquery
 from django.db.models.functions import Coalesce
-from .pagination import ServicesCursorPagination, ReviewCursorPagination, MessageCursorPagination
+from .pagination import (
+    ServicesCursorPagination,
+    ReviewCursorPagination,
+    MessageCursorPagination,
+    NotificationCursorPagination,
+    ThreadCursorPagination,
+)
 from urllib.parse import urlencode
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from collections import OrderedDict
 from django.core.paginator import Paginator
 from api.utils.helper_function import haversine, get_relevance
 from django.db.models import Prefetch
 from rest_framework.pagination import PageNumberPagination
 from api.utils.fcm import notify_user
+from api.utils.notifications import adjust_unread_count, get_unread_count, mark_notifications_read
+from api.utils.presence import should_notify_chat
+from api.utils.realtime import broadcast
+from api.utils.holds import active_hold_for
+from payments.utils.helper_function import extract_validation_error_message
+from payments.utils.revenue import revenue_total
+from rest_framework.exceptions import ValidationError
 from api.utils.growth_suggestions import generate_growth_suggestions
-from .tasks import auto_cancel_booking
 import logging
 from .serializers import PerformanceAnalyticsSerializer, AIAutoFillSettingsSerializer
 from .models import AIAutoFillSettings
@@ -115,67 +123,48 @@ class AIAutoFillSettingsView(APIView):
 class HoldSlotAndBookView(APIView):
     """
     Allows a user to claim an auto-fill offer.
-    It creates a temporary, exclusive hold on the slot for a few minutes
-    to allow the user to complete the booking process.
+    It creates a temporary hold on the slot (a pending SlotBooking backed by a
+    SlotHold) for a few minutes to allow the user to complete the booking
+    process. Several users can hold the same slot while it has capacity.
     """
     permission_classes = [IsAuthenticated]
 
     def post(self, request, slot_id):
         user = request.user
-        
-        try:
-            # Use select_for_update to lock the slot row during the transaction
-            with transaction.atomic():
-                slot = Slot.objects.select_for_update().get(id=slot_id)
-
-                # 1. Check if the slot is still available
-                if slot.capacity_left <= 0:
-                    return Response(
-                        {"error": "This slot was just booked by someone else."},
-                        status=status.HTTP_409_CONFLICT  # 409 Conflict
-                    )
-
-                # 2. Check for an existing hold on the slot
-                hold_key = f"slot_hold_{slot_id}"
-                if cache.get(hold_key):
-                    return Response(
-                        {"error": "This slot is currently on hold. Please try again in a few moments."},
-                        status=status.HTTP_409_CONFLICT
-                    )
-
-                # 3. Create a 5-minute hold for the current user
-                cache.set(hold_key, user.id, timeout=300)  # 300 seconds = 5 minutes
-                logger.info(f"Slot {slot_id} is now on hold for user {user.id}.")
-
-                # 4. Create the preliminary booking record in 'pending' state
-                # This uses the Booking model from your payments app
-                new_booking = Booking.objects.create(
-                    user=user,
-                    shop=slot.shop,
-                    service=slot.service,
-                    slot=slot, # Link to the actual Slot
-                    status='pending', # Start as pending until payment is confirmed
-                    start_time=slot.start_time,
-                    end_time=slot.end_time,
-                )
-                
-                # 5. Decrement slot capacity immediately
-                slot.capacity_left -= 1
-                slot.save(update_fields=['capacity_left'])
 
+        try:
+            slot = Slot.objects.only("id").get(id=slot_id)
         except Slot.DoesNotExist:
             return Response({"error": "Slot not found."}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            logger.error(f"Error in HoldSlotAndBookView: {e}", exc_info=True)
-            return Response({"error": "An unexpected error occurred."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Re-claiming an offer returns the existing hold
+        hold = active_hold_for(user, slot)
+        if hold is None:
+            serializer = SlotBookingSerializer(
+                data={"slot_id": slot_id},
+                context={"request": request, "hold_source": "autofill"},
+            )
+            try:
+                # Locks the slot row, re-checks capacity, decrements it and records the hold
+                serializer.is_valid(raise_exception=True)
+                booking = serializer.save()
+            except ValidationError as e:
+                # 409 Conflict: someone else took the last unit first
+                return Response({"error": extract_validation_error_message(e)}, status=status.HTTP_409_CONFLICT)
+            except Exception as e:
+                logger.error(f"Error in HoldSlotAndBookView: {e}", exc_info=True)
+                return Response({"error": "An unexpected error occurred."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            hold = booking.hold
+        logger.info(f"Slot {slot_id} is now on hold for user {user.id} until {hold.expires_at}.")
 
         # The user's app should now proceed to the payment screen.
-        # The CreatePaymentIntentView will be called next by the app.
+        # The CreatePaymentIntentView will be called next by the app and pays for this booking.
         return Response({
             "success": True,
             "message": "Slot is now on hold. Please complete your payment within 5 minutes.",
-            "booking_id": new_booking.id,
+            "booking_id": hold.slot_booking_id,
             "slot_id": slot_id,
+            "hold_expires_at": hold.expires_at,
         }, status=status.HTTP_200_OK)
 
 class ShopListCreateView(APIView):
@@ -493,16 +482,12 @@ class SlotBookingView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        serializer = SlotBookingSerializer(data=request.data, context={'request': request})
+        serializer = SlotBookingSerializer(data=request.data, context={'request': request, 'hold_source': 'booking'})
         serializer.is_valid(raise_exception=True)
+        # The serializer records a SlotHold; unpaid bookings are released by
+        # the release_expired_slot_holds sweeper instead of a per-booking task
         booking = serializer.save()
 
-        # Schedule auto-cancel task after 5 minutes (best-effort)
-        try:
-            auto_cancel_booking.apply_async((booking.id,), countdown=5 * 60)
-        except Exception as exc:
-            logger.exception("Failed to enqueue auto_cancel_booking for booking_id=%s: %s", booking.id, exc)
-
         return Response(SlotBookingSerializer(booking).data, status=status.HTTP_201_CREATED)
 
 class CancelSlotBookingView(APIView):
@@ -1185,46 +1170,42 @@ class UserMessageView(APIView):
         thread, _ = ChatThread.objects.get_or_create(shop=shop, user=user)
         message = Message.objects.create(thread=thread, sender=user, content=content)
 
-        # Notify owner via FCM (notify_user creates DB notification internally)
-        chat_notification_data = {
-            "thread_id": str(thread.id),
-            "shop_id": str(shop.id),
-            "shop_name": shop.name,
-            "sender_email": user.email,
-            "is_owner": "false",  # Customer is sending
-        }
-        notification = notify_user(
-            shop.owner, 
-            f"New message from {user.email}", 
-            notification_type="chat", 
-            data=chat_notification_data
-        )
+        events = []
+
+        # Notify owner via FCM (notify_user creates DB notification internally),
+        # unless they have the thread open or were already pushed in this window
+        if should_notify_chat(shop.owner_id, thread.id):
+            chat_notification_data = {
+                "thread_id": str(thread.id),
+                "shop_id": str(shop.id),
+                "shop_name": shop.name,
+                "sender_email": user.email,
+                "is_owner": "false",  # Customer is sending
+            }
+            notification = notify_user(
+                shop.owner, 
+                f"New message from {user.email}", 
+                notification_type="chat", 
+                data=chat_notification_data
+            )
 
-        # Broadcast notification over websockets to recipient
-        channel_layer = get_channel_layer()
-        notification_data = {
-            "id": notification.id,
-            "message": notification.message,
-            "notification_type": notification.notification_type,
-            "data": notification.data,
-            "is_read": notification.is_read,
-            "created_at": notification.created_at.isoformat()
-        }
-        async_to_sync(channel_layer.group_send)(
-            f"user_{shop.owner.id}",
-            {"type": "notification", "notification": notification_data},
-        )
+            # Broadcast notification over websockets to recipient
+            notification_data = {
+                "id": notification.id,
+                "message": notification.message,
+                "notification_type": notification.notification_type,
+                "data": notification.data,
+                "is_read": notification.is_read,
+                "created_at": notification.created_at.isoformat()
+            }
+            events.append((f"user_{shop.owner_id}", {"type": "notification", "notification": notification_data}))
 
-        # Broadcast over websockets to recipient and echo to sender
-        message_data = MessageSerializer(message).data
-        async_to_sync(channel_layer.group_send)(
-            f"user_{shop.owner.id}",
-            {"type": "chat_message", "message": message_data},
-        )
-        async_to_sync(channel_layer.group_send)(
-            f"user_{user.id}",
-            {"type": "chat_message", "message": message_data},
-        )
+        # Broadcast over websockets to recipient and echo to sender, together
+        # with the notification event, in one bridge call
+        message_data = MessageSerializer(message, context={"thread": thread}).data
+        events.append((f"user_{shop.owner_id}", {"type": "chat_message", "message": message_data}))
+        events.append((f"user_{user.id}", {"type": "chat_message", "message": message_data}))
+        broadcast(events)
 
         return Response(message_data)
 
@@ -1234,52 +1215,48 @@ class OwnerMessageView(APIView):
     def post(self, request, thread_id):
         owner = request.user
         content = request.data.get("content")
-        thread = ChatThread.objects.get(id=thread_id)
+        thread = ChatThread.objects.select_related("shop", "user").get(id=thread_id)
 
-        if thread.shop.owner != owner:
+        if thread.shop.owner_id != owner.id:
             return Response({"error": "Not authorized"}, status=403)
 
         message = Message.objects.create(thread=thread, sender=owner, content=content)
-        # Notify user via FCM (notify_user creates DB notification internally)
-        chat_notification_data = {
-            "thread_id": str(thread.id),
-            "shop_id": str(thread.shop.id),
-            "shop_name": thread.shop.name,
-            "sender_email": owner.email,
-            "is_owner": "true",  # Owner is sending
-        }
-        notification = notify_user(
-            thread.user, 
-            f"Reply from {owner.email}", 
-            notification_type="chat", 
-            data=chat_notification_data
-        )
+        events = []
+
+        # Notify user via FCM (notify_user creates DB notification internally),
+        # unless they have the thread open or were already pushed in this window
+        if should_notify_chat(thread.user_id, thread.id):
+            chat_notification_data = {
+                "thread_id": str(thread.id),
+                "shop_id": str(thread.shop.id),
+                "shop_name": thread.shop.name,
+                "sender_email": owner.email,
+                "is_owner": "true",  # Owner is sending
+            }
+            notification = notify_user(
+                thread.user, 
+                f"Reply from {owner.email}", 
+                notification_type="chat", 
+                data=chat_notification_data
+            )
 
-        # Broadcast notification over websockets to recipient
-        channel_layer = get_channel_layer()
-        notification_data = {
-            "id": notification.id,
-            "message": notification.message,
-            "notification_type": notification.notification_type,
-            "data": notification.data,
-            "is_read": notification.is_read,
-            "created_at": notification.created_at.isoformat()
-        }
-        async_to_sync(channel_layer.group_send)(
-            f"user_{thread.user.id}",
-            {"type": "notification", "notification": notification_data},
-        )
+            # Broadcast notification over websockets to recipient
+            notification_data = {
+                "id": notification.id,
+                "message": notification.message,
+                "notification_type": notification.notification_type,
+                "data": notification.data,
+                "is_read": notification.is_read,
+                "created_at": notification.created_at.isoformat()
+            }
+            events.append((f"user_{thread.user_id}", {"type": "notification", "notification": notification_data}))
 
-        # Broadcast over websockets to recipient and echo to sender
-        message_data = MessageSerializer(message).data
-        async_to_sync(channel_layer.group_send)(
-            f"user_{thread.user.id}",
-            {"type": "chat_message", "message": message_data},
-        )
-        async_to_sync(channel_layer.group_send)(
-            f"user_{owner.id}",
-            {"type": "chat_message", "message": message_data},
-        )
+        # Broadcast over websockets to recipient and echo to sender, together
+        # with the notification event, in one bridge call
+        message_data = MessageSerializer(message, context={"thread": thread}).data
+        events.append((f"user_{thread.user_id}", {"type": "chat_message", "message": message_data}))
+        events.append((f"user_{owner.id}", {"type": "chat_message", "message": message_data}))
+        broadcast(events)
 
         return Response(message_data)
 
@@ -1289,68 +1266,172 @@ class ThreadListView(APIView):
     def get(self, request):
         user = request.user
 
-        # Filter threads belonging to the user or as shop owner
-        threads = ChatThread.objects.filter(
-            Q(user=user) | Q(shop__owner=user)
-        ).order_by("-created_at")
-
-        # Annotate last message
-        last_message_subquery = Message.objects.filter(
-            thread=OuterRef('pk')
-        ).order_by('-timestamp')
-
-        threads = threads.annotate(
-            last_message_id=Subquery(last_message_subquery.values('id')[:1])
+        # Filter threads belonging to the user or as shop owner.
+        # Last message / unread counts are denormalized on ChatThread, so the
+        # page is served by a single query ordered by last activity.
+        threads = (
+            ChatThread.objects
+            .filter(Q(user=user) | Q(shop__owner=user))
+            .select_related("shop", "user", "last_message_sender")
         )
 
+        paginator = ThreadCursorPagination()
+        page = paginator.paginate_queryset(threads, request)
+
         serializer = ChatThreadSerializer(
-            threads,
+            page,
             many=True,
             context={'request': request, 'last_message_only': True}
         )
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
+
+def _get_participant_thread(user, thread_id):
+    """Thread visible to `user` as customer or shop owner (shop preloaded), else None."""
+    return (
+        ChatThread.objects
+        .filter(id=thread_id)
+        .filter(Q(user=user) | Q(shop__owner=user))
+        .select_related("shop")
+        .first()
+    )
+
+def _thread_read_watermarks(thread):
+    return dict(thread.read_states.values_list("user_id", "last_read_message_id"))
 
 class ThreadDetailsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, thread_id):
-        user = request.user
-
         # Get thread and check permissions
-        thread = ChatThread.objects.filter(
-            id=thread_id
-        ).filter(
-            Q(user=user) | Q(shop__owner=user)
-        ).first()
-
+        thread = _get_participant_thread(request.user, thread_id)
         if not thread:
             return Response({"detail": "Thread not found or access denied."}, status=404)
 
-        queryset = Message.objects.filter(thread=thread).order_by('-timestamp')
+        queryset = Message.objects.filter(thread=thread).select_related("sender").order_by('-timestamp')
 
         # Apply cursor pagination manually
         paginator = MessageCursorPagination()
         page = paginator.paginate_queryset(queryset, request)
 
-        serializer = MessageSerializer(page, many=True, context={"request": request})
+        serializer = MessageSerializer(page, many=True, context={
+            "request": request,
+            "thread": thread,
+            "read_upto": _thread_read_watermarks(thread),
+        })
         return paginator.get_paginated_response(serializer.data)
 
+class ThreadSyncView(APIView):
+    """
+    Delta sync for reconnecting clients.
+    GET /threads/<thread_id>/sync/?after_id=<last message id the client has>&limit=100
+    Returns messages with id > after_id in ascending order plus the
+    participants' read watermarks.
+    """
+    permission_classes = [IsAuthenticated]
+    MAX_LIMIT = 200
+
+    def get(self, request, thread_id):
+        thread = _get_participant_thread(request.user, thread_id)
+        if not thread:
+            return Response({"detail": "Thread not found or access denied."}, status=404)
+
+        try:
+            after_id = int(request.query_params.get("after_id", 0))
+            limit = min(int(request.query_params.get("limit", 100)), self.MAX_LIMIT)
+        except ValueError:
+            return Response({"detail": "'after_id' and 'limit' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if limit <= 0:
+            limit = 100
+
+        # Uses the (thread, id) index; fetch one extra row to detect more pages
+        messages = list(
+            Message.objects
+            .filter(thread=thread, id__gt=after_id)
+            .select_related("sender")
+            .order_by("id")[:limit + 1]
+        )
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+
+        read_upto = _thread_read_watermarks(thread)
+        serializer = MessageSerializer(messages, many=True, context={
+            "request": request,
+            "thread": thread,
+            "read_upto": read_upto,
+        })
+        return Response({
+            "thread_id": thread.id,
+            "messages": serializer.data,
+            "has_more": has_more,
+            "last_id": messages[-1].id if messages else after_id,
+            "read_upto": {str(k): v for k, v in read_upto.items()},
+        })
+
+class ThreadMarkReadView(APIView):
+    """Advance the caller's read watermark to the latest message in the thread."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, thread_id):
+        thread = _get_participant_thread(request.user, thread_id)
+        if not thread:
+            return Response({"detail": "Thread not found or access denied."}, status=404)
+
+        thread.mark_read_for(request.user)
+        return Response({
+            "thread_id": thread.id,
+            "last_read_message_id": thread.last_message_id or 0,
+        })
+
 class NotificationsView(APIView):
     """
-    List all notifications for the authenticated user.
-    Option: Mark all as read when listing.
+    Cursor-paginated inbox for the authenticated user, newest first.
+    Optional: ?unread=true to only list unread notifications, ?top=N page size.
     """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         # Only fetch notifications for the logged-in user
-        notifications = Notification.objects.filter(recipient=request.user).order_by("-created_at")
+        notifications = Notification.objects.filter(recipient=request.user)
+        if request.query_params.get("unread", "").lower() in ("1", "true", "yes"):
+            notifications = notifications.filter(is_read=False)
 
-        # # Mark all as read
-        # notifications.update(is_read=True)
+        paginator = NotificationCursorPagination()
+        page = paginator.paginate_queryset(notifications, request)
+        serializer = NotificationSerializer(page, many=True)
 
-        serializer = NotificationSerializer(notifications, many=True)
-        return Response(serializer.data)
+        response = paginator.get_paginated_response(serializer.data)
+        response.data["unread_count"] = get_unread_count(request.user.id)
+        return response
+
+class NotificationUnreadCountView(APIView):
+    """Cheap badge counter backed by the cached unread count."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({"unread_count": get_unread_count(request.user.id)})
+
+class NotificationMarkReadView(APIView):
+    """
+    Bulk mark-read with a single UPDATE.
+    Body: {"ids": [1, 2, 3]} to mark specific notifications, or {} to mark all.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ids = request.data.get("ids")
+        if ids is not None:
+            if not isinstance(ids, list):
+                return Response({"detail": "'ids' must be a list."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                ids = [int(i) for i in ids]
+            except (TypeError, ValueError):
+                return Response({"detail": "'ids' must contain integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = mark_notifications_read(request.user, ids=ids)
+        return Response({
+            "updated": updated,
+            "unread_count": get_unread_count(request.user.id),
+        })
 
 class NotificationDetailView(APIView):
     """
@@ -1369,6 +1450,7 @@ class NotificationDetailView(APIView):
         if not notification.is_read:
             notification.is_read = True
             notification.save(update_fields=["is_read"])
+            adjust_unread_count(request.user.id, -1)
 
         serializer = NotificationSerializer(notification)
         return Response(serializer.data)
@@ -1377,19 +1459,19 @@ class WeeklyShopRevenueView(APIView):
 
     permission_classes = [IsAuthenticated]
     """
-    Get all revenue records for a given shop_id with shop details
+    Daily revenue records for a given shop_id with the all-time total
     Optional query param: ?day=7 to get records from today to previous 7 days
+    (default: the last REVENUE_HISTORY_DEFAULT_DAYS days)
     """
     def get(self, request, shop_id):
-        try:
-            shop = Shop.objects.get(id=shop_id)
-        except Shop.DoesNotExist:
+        if not Shop.objects.filter(id=shop_id).exists():
             return Response(
                 {"detail": f"Shop with id {shop_id} not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
-        
+
         day_param = request.query_params.get('day')
+        days = getattr(settings, "REVENUE_HISTORY_DEFAULT_DAYS", 365)
         if day_param:
             try:
                 days = int(day_param)
@@ -1400,24 +1482,16 @@ class WeeklyShopRevenueView(APIView):
                     {"detail": "Invalid 'day' parameter. Must be a non-negative integer."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            # Calculate the date from which to filter
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days - 1)
-            # Make timezone aware if your project uses timezone-aware datetimes
-            start_date = make_aware(start_date)
-            end_date = make_aware(end_date)
-            
-            revenues = Revenue.objects.filter(
-                shop=shop,
-                timestamp__range=(start_date, end_date)
-            ).order_by('-timestamp')
-        else:
-            revenues = Revenue.objects.filter(shop=shop).order_by('-timestamp')
 
-        # Total revenue (all time, not filtered)
-        total_revenue = Revenue.objects.filter(shop=shop).aggregate(
-            total=Sum('revenue')
-        )['total'] or 0
+        end_date = timezone.localdate()
+        start_date = end_date - timedelta(days=days - 1)
+        revenues = Revenue.objects.filter(
+            shop_id=shop_id,
+            timestamp__range=(start_date, end_date)
+        ).order_by('-timestamp')
+
+        # Total revenue (all time, not filtered): latest running total
+        total_revenue = revenue_total(shop_id)
 
         serializer = RevenueSerializer(revenues, many=True)
         return Response(
@@ -1591,13 +1665,7 @@ class AIReportView(APIView):
             return Response({"error": "Shop not found."}, status=status.HTTP_404_NOT_FOUND)
 
         # --- START: AI ENTITLEMENT CHECK ---
-        subscription = getattr(shop, 'subscription', None)
-        ai_enabled = False
-        if subscription and subscription.plan:
-            if subscription.plan.ai_assistant == SubscriptionPlan.AI_INCLUDED or subscription.has_ai_addon:
-                ai_enabled = True
-        
-        if not ai_enabled:
+        if not shop.entitlements.ai_enabled:
             return Response(
                 {"detail": "This feature requires an active AI Assistant subscription."},
                 status=status.HTTP_403_FORBIDDEN
@@ -1678,7 +1746,7 @@ class LatestWeeklySummaryView(APIView):
 
     def get(self, request):
         user = request.user
-        shop = Shop.objects.filter(owner=user).select_related("subscription__plan").first()
+        shop = Shop.objects.filter(owner=user).first()
         
         if not shop:
             return Response(
@@ -1687,15 +1755,8 @@ class LatestWeeklySummaryView(APIView):
             )
 
         # --- START: AI ENTITLEMENT CHECK ---
-        # Force fresh read from database to avoid connection pool staleness
-        subscription = ShopSubscription.objects.filter(shop=shop).select_related('plan').first()
-        
-        ai_enabled = False
-        if subscription and subscription.plan:
-            if subscription.plan.ai_assistant == SubscriptionPlan.AI_INCLUDED or subscription.has_ai_addon:
-                ai_enabled = True
-        
-        if not ai_enabled:
+        # Entitlements are invalidated on every ShopSubscription/plan save
+        if not shop.entitlements.ai_enabled:
             return Response(
                 {"detail": "This feature requires an active AI Assistant subscription."},
                 status=status.HTTP_403_FORBIDDEN
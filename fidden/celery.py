@@ -20,32 +20,56 @@ app.conf.beat_schedule = {
         "schedule": crontab(hour=20, minute=0),
         "args": (7,),
     },
-    # Send reminders every 15 minutes
-    "send-upcoming-reminders": {
-        "task": "api.tasks.send_upcoming_slot_reminders",
-        "schedule": crontab(minute="*/15"),
-        "args": (30,),
-    },
     # Cleanup cancelled bookings daily at 1 AM
     "cleanup-cancelled-bookings": {
         "task": "api.tasks.cleanup_old_cancelled_bookings",
         "schedule": crontab(hour=1, minute=0),
         "args": (7, 1000),
     },
+    # Archive old notifications daily at 3 AM
+    "archive-old-notifications": {
+        "task": "api.tasks.archive_old_notifications",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    # Release expired slot holds (unpaid bookings) every minute
+    "release-expired-slot-holds": {
+        "task": "api.tasks.release_expired_slot_holds",
+        "schedule": crontab(minute="*"),
+    },
     # Complete bookings every 5 minutes
     "complete-bookings-every-minute": {
         "task": "payments.tasks.complete_past_bookings",
         "schedule": crontab(minute="*/5"),  # every 5 minutes
     },
-    # Send bookings reminders every minutes
-    "send-booking-reminders": {
-        "task": "payments.tasks.send_booking_reminders",
-        "schedule": crontab(minute="*"),  # every 60 seconds
+    # Send due booking reminders every minute (scheduled BookingReminder rows)
+    "dispatch-booking-reminders": {
+        "task": "payments.tasks.dispatch_booking_reminders",
+        "schedule": crontab(minute="*"),
+    },
+    "refresh-analytics-rollups": {
+        "task": "api.tasks.refresh_analytics_rollups",
+        "schedule": crontab(minute="*/15"),
     },
     "calculate-analytics-daily": {
         "task": "api.tasks.calculate_analytics",
         "schedule": crontab(hour=2, minute=0),  # Daily at 2 AM
     },
+    "drain-outbox": {
+        "task": "payments.tasks.drain_outbox",
+        "schedule": crontab(minute="*"),
+    },
+    "drain-webhook-inbox": {
+        "task": "payments.tasks.drain_webhook_inbox",
+        "schedule": crontab(minute="*"),
+    },
+    "reconcile-stripe-subscriptions": {
+        "task": "subscriptions.tasks.reconcile_stripe_subscriptions",
+        "schedule": crontab(minute="*/15"),
+    },
+    "reconcile-revenue-rollups": {
+        "task": "payments.tasks.reconcile_revenue_rollups",
+        "schedule": crontab(hour=2, minute=30),
+    },
     'generate-weekly-ai-reports': {
         'task': 'api.tasks.generate_weekly_ai_reports',
         'schedule': crontab(day_of_week='sunday', hour=22, minute=0),  # Every Sunday at 10 PM (end of week recap)
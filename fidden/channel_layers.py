@@ -0,0 +1,256 @@
+"""
+Redis channel layer with backpressure metrics.
+
+Behaves like channels_redis' RedisChannelLayer (4.x), but counts messages
+that are dropped because a channel is at capacity (both direct `send` and
+`group_send`), and can report group sizes and per-channel queue depth across
+all sharded hosts. Counters live in a Redis hash on the first host so every
+web/worker process contributes to the same numbers.
+"""
+import logging
+import time
+
+from channels.exceptions import ChannelFull
+from channels_redis.core import RedisChannelLayer
+
+logger = logging.getLogger(__name__)
+
+GROUP_SEND_LUA = """
+    local over_capacity = 0
+    local current_time = ARGV[#ARGV - 1]
+    local expiry = ARGV[#ARGV]
+    for i=1,#KEYS do
+        if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+            redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+"""
+
+# Like GROUP_SEND_LUA but with one score per key, so several messages queued
+# on the same channel in one call keep their send order.
+BATCH_SEND_LUA = """
+    local over_capacity = 0
+    local n = #KEYS
+    local expiry = ARGV[#ARGV]
+    for i=1,n do
+        if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + n]) then
+            redis.call('ZADD', KEYS[i], ARGV[i + 2 * n], ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+"""
+
+
+class MeteredRedisChannelLayer(RedisChannelLayer):
+
+    @property
+    def metrics_key(self):
+        return f"{self.prefix}:metrics"
+
+    async def _incr_metrics(self, **fields):
+        try:
+            pipe = self.connection(0).pipeline()
+            for field, amount in fields.items():
+                pipe.hincrby(self.metrics_key, field, amount)
+            await pipe.execute()
+        except Exception as e:
+            # Metrics must never break delivery; only called on the drop path
+            logger.debug("Channel layer metrics update failed: %s", e)
+
+    async def send(self, channel, message):
+        """
+        RedisChannelLayer.send with two changes:
+        - process-specific channels ("specific.<client>!<id>") are hashed by
+          their non-local name, the same shard receive() reads from. Upstream
+          hashes the full name, which loses direct sends once hosts > 1.
+        - ChannelFull drops are counted.
+        """
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+
+        channel_non_local_name = channel
+        if "!" in channel:
+            message = dict(message.items())
+            message["__asgi_channel__"] = channel
+            channel_non_local_name = self.non_local_name(channel)
+        channel_key = self.prefix + channel_non_local_name
+
+        if "!" in channel:
+            index = self.consistent_hash(channel_non_local_name)
+        else:
+            index = next(self._send_index_generator)
+        connection = self.connection(index)
+
+        # Discard old messages based on expiry
+        await connection.zremrangebyscore(channel_key, min=0, max=int(time.time()) - int(self.expiry))
+
+        if await connection.zcount(channel_key, "-inf", "+inf") >= self.get_capacity(channel):
+            await self._incr_metrics(dropped_send=1, dropped_total=1)
+            raise ChannelFull()
+
+        await connection.zadd(channel_key, {self.serialize(message): time.time()})
+        await connection.expire(channel_key, int(self.expiry))
+
+    async def group_send(self, group, message):
+        """
+        Same algorithm as RedisChannelLayer.group_send (channels_redis 4.x),
+        but the number of channels that were over capacity is recorded
+        instead of only being logged.
+        """
+        assert self.require_valid_group_name(group), "Group name not valid"
+        key = self._group_key(group)
+        connection = self.connection(self.consistent_hash(group))
+        # Discard old channels based on group_expiry
+        await connection.zremrangebyscore(key, min=0, max=int(time.time()) - self.group_expiry)
+
+        channel_names = [x.decode("utf8") for x in await connection.zrange(key, 0, -1)]
+
+        (
+            connection_to_channel_keys,
+            channel_keys_to_message,
+            channel_keys_to_capacity,
+        ) = self._map_channel_keys_to_connection(channel_names, message)
+
+        dropped = 0
+        for connection_index, channel_redis_keys in connection_to_channel_keys.items():
+            connection = self.connection(connection_index)
+            pipe = connection.pipeline()
+            for channel_key in channel_redis_keys:
+                pipe.zremrangebyscore(channel_key, min=0, max=int(time.time()) - int(self.expiry))
+            await pipe.execute()
+
+            args = [channel_keys_to_message[k] for k in channel_redis_keys]
+            args += [channel_keys_to_capacity[k] for k in channel_redis_keys]
+            args += [time.time(), self.expiry]
+
+            dropped += await connection.eval(
+                GROUP_SEND_LUA, len(channel_redis_keys), *channel_redis_keys, *args
+            )
+
+        if dropped > 0:
+            logger.warning("%s of %s channels over capacity in group %s", dropped, len(channel_names), group)
+            await self._incr_metrics(dropped_group_send=dropped, dropped_total=dropped)
+
+    async def group_send_many(self, events):
+        """
+        Send several (group, message) events with the minimum number of
+        round trips: one pipeline per shard to resolve all group members,
+        one pipeline to expire old messages and one Lua call per shard to
+        enqueue everything.
+        """
+        if not events:
+            return
+        now = time.time()
+
+        # 1) Resolve group members, grouped by the shard that owns each group
+        by_shard = {}
+        for position, (group, _message) in enumerate(events):
+            assert self.require_valid_group_name(group), "Group name not valid"
+            by_shard.setdefault(self.consistent_hash(group), []).append(position)
+        members = [None] * len(events)
+        for index, positions in by_shard.items():
+            pipe = self.connection(index).pipeline()
+            for position in positions:
+                key = self._group_key(events[position][0])
+                pipe.zremrangebyscore(key, min=0, max=int(now) - self.group_expiry)
+                pipe.zrange(key, 0, -1)
+            results = await pipe.execute()
+            for i, position in enumerate(positions):
+                members[position] = [x.decode("utf8") for x in results[i * 2 + 1]]
+
+        # 2) Merge per-event channel keys into one batch per destination shard
+        keys_by_shard, messages_by_shard, capacities_by_shard = {}, {}, {}
+        for (group, message), channel_names in zip(events, members):
+            if not channel_names:
+                continue
+            conn_keys, key_messages, key_capacities = self._map_channel_keys_to_connection(channel_names, message)
+            for index, channel_keys in conn_keys.items():
+                keys_by_shard.setdefault(index, []).extend(channel_keys)
+                messages_by_shard.setdefault(index, []).extend(key_messages[k] for k in channel_keys)
+                capacities_by_shard.setdefault(index, []).extend(key_capacities[k] for k in channel_keys)
+
+        dropped = 0
+        for index, channel_keys in keys_by_shard.items():
+            connection = self.connection(index)
+            pipe = connection.pipeline()
+            for channel_key in set(channel_keys):
+                pipe.zremrangebyscore(channel_key, min=0, max=int(now) - int(self.expiry))
+            await pipe.execute()
+
+            # Strictly increasing scores preserve event order per channel
+            scores = [now + i * 1e-6 for i in range(len(channel_keys))]
+            args = messages_by_shard[index] + capacities_by_shard[index] + scores + [self.expiry]
+            dropped += await connection.eval(BATCH_SEND_LUA, len(channel_keys), *channel_keys, *args)
+
+        if dropped > 0:
+            logger.warning("%s channels over capacity in batched group send (%s events)", dropped, len(events))
+            await self._incr_metrics(dropped_group_send=dropped, dropped_total=dropped)
+
+    async def collect_stats(self, top=20):
+        """
+        Snapshot of layer health across all shards:
+        counters, group count/sizes and channel queue depth.
+        """
+        group_prefix = f"{self.prefix}:group:"
+        group_sizes = {}
+        queue_depths = {}
+
+        for index in range(self.ring_size):
+            connection = self.connection(index)
+            group_keys, channel_keys = [], []
+            async for raw in connection.scan_iter(match=f"{self.prefix}*", count=500):
+                name = raw.decode("utf8") if isinstance(raw, bytes) else raw
+                if name.startswith(group_prefix):
+                    group_keys.append(name)
+                elif name != self.metrics_key and not name.endswith("$inflight"):
+                    channel_keys.append(name)
+            if not group_keys and not channel_keys:
+                continue
+            pipe = connection.pipeline()
+            for name in group_keys + channel_keys:
+                pipe.zcard(name)
+            # raise_on_error=False: a foreign key under the prefix yields an error, not a crash
+            sizes = [v if isinstance(v, int) else 0 for v in await pipe.execute(raise_on_error=False)]
+            for name, size in zip(group_keys, sizes[:len(group_keys)]):
+                group_sizes[name[len(group_prefix):]] = size
+            for name, size in zip(channel_keys, sizes[len(group_keys):]):
+                queue_depths[name[len(self.prefix):]] = size
+
+        raw_counters = await self.connection(0).hgetall(self.metrics_key)
+        counters = {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in (raw_counters or {}).items()
+        }
+
+        def _top(d):
+            return dict(sorted(d.items(), key=lambda kv: kv[1], reverse=True)[:top])
+
+        return {
+            "hosts": self.ring_size,
+            "capacity": self.capacity,
+            "expiry": self.expiry,
+            "counters": counters,
+            "groups": {
+                "count": len(group_sizes),
+                "members_total": sum(group_sizes.values()),
+                "largest": _top(group_sizes),
+            },
+            "queues": {
+                "count": len(queue_depths),
+                "depth_total": sum(queue_depths.values()),
+                "depth_max": max(queue_depths.values(), default=0),
+                "at_capacity": sum(1 for d in queue_depths.values() if d >= self.capacity),
+                "deepest": _top(queue_depths),
+            },
+        }
+
+    async def reset_metrics(self):
+        await self.connection(0).delete(self.metrics_key)
@@ -77,6 +77,10 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# Websocket connects cache the verified token's user principal (per jti) for
+# at most this long, and never beyond the token's own expiry
+WS_AUTH_CACHE_TTL_SECONDS = int(os.getenv("WS_AUTH_CACHE_TTL_SECONDS", "300"))
+
 # ==============================
 # Middleware
 # ==============================
@@ -150,17 +154,33 @@ if RAW_REDIS_URL and RAW_REDIS_URL.startswith("rediss://"):
 # ==============================
 ASGI_APPLICATION = "fidden.asgi.application"
 
-CHANNEL_LAYER_BACKEND = os.getenv("CHANNEL_LAYER_BACKEND", "memory").lower()
+# Redis is the default whenever REDIS_URL is configured: the in-memory layer
+# only delivers within a single process, so group_send from Celery workers or
+# other uvicorn workers would never reach sockets. Set
+# CHANNEL_LAYER_BACKEND=memory explicitly for single-process development.
+CHANNEL_LAYER_BACKEND = os.getenv("CHANNEL_LAYER_BACKEND", "redis" if RAW_REDIS_URL else "memory").lower()
+
+# Optional comma-separated list of Redis URLs to shard the layer across;
+# groups and process-specific channels are consistently hashed over them.
+CHANNEL_REDIS_HOSTS = [h.strip() for h in os.getenv("CHANNEL_REDIS_HOSTS", "").split(",") if h.strip()]
 
-if CHANNEL_LAYER_BACKEND == "redis" and RAW_REDIS_URL:
+if CHANNEL_LAYER_BACKEND == "redis" and (CHANNEL_REDIS_HOSTS or RAW_REDIS_URL):
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "fidden.channel_layers.MeteredRedisChannelLayer",
             "CONFIG": {
-                # Use the CLEANED URL here
-                "hosts": [CLEAN_REDIS_URL],
-                # Pass the SSL options generated above
-                **SSL_OPTIONS, 
+                # Use the CLEANED URL here; SSL options go on each host entry
+                "hosts": [
+                    {"address": url, **(SSL_OPTIONS if url.startswith("rediss://") else {})}
+                    for url in (CHANNEL_REDIS_HOSTS or [CLEAN_REDIS_URL])
+                ],
+                "prefix": os.getenv("CHANNEL_LAYER_PREFIX", "fidden_asgi"),
+                # Per-channel queue bound; beyond this messages are dropped (and counted)
+                "capacity": int(os.getenv("CHANNEL_LAYER_CAPACITY", "500")),
+                # Undelivered messages older than this are discarded
+                "expiry": int(os.getenv("CHANNEL_LAYER_EXPIRY", "30")),
+                # Longer than any websocket session; stale members are pruned on send
+                "group_expiry": int(os.getenv("CHANNEL_LAYER_GROUP_EXPIRY", "86400")),
             },
         },
     }
@@ -335,6 +355,64 @@ CELERY_TIMEZONE = TIME_ZONE
 
 
 
+# Unpaid bookings keep their slot capacity for this long (SlotHold ledger)
+SLOT_HOLD_TTL_SECONDS = int(os.getenv("SLOT_HOLD_TTL_SECONDS", "300"))
+# Once a PaymentIntent is created for a held booking, the hold is extended to
+# this long so the payment sheet / 3DS can finish
+SLOT_HOLD_PAYMENT_TTL_SECONDS = int(os.getenv("SLOT_HOLD_PAYMENT_TTL_SECONDS", "1800"))
+
+# Re-engagement campaigns (payments.utils.audiences): a user gets the same
+# campaign at most once per cooldown; audiences are delivered in batches
+REBOOKING_PROMPT_COOLDOWN_DAYS = int(os.getenv("REBOOKING_PROMPT_COOLDOWN_DAYS", "14"))
+GHOST_CLIENT_COOLDOWN_DAYS = int(os.getenv("GHOST_CLIENT_COOLDOWN_DAYS", "30"))
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "500"))
+
+# Weekly AI reports: shops per delivery subtask (api.tasks.generate_weekly_ai_report_batch)
+WEEKLY_REPORT_BATCH_SIZE = int(os.getenv("WEEKLY_REPORT_BATCH_SIZE", "25"))
+
+# Growth suggestions screen: per-shop result cache (api.utils.growth_suggestions)
+GROWTH_SUGGESTIONS_CACHE_SECONDS = int(os.getenv("GROWTH_SUGGESTIONS_CACHE_SECONDS", "300"))
+
+# Revenue chart: days returned by WeeklyShopRevenueView when no ?day= is given
+REVENUE_HISTORY_DEFAULT_DAYS = int(os.getenv("REVENUE_HISTORY_DEFAULT_DAYS", "365"))
+
+# Side-effect outbox (payments.utils.outbox): attempts before a job is marked
+# failed, and how long a claimed job stays invisible to other workers
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+
+# Webhook inbox (payments.utils.webhook_inbox): attempts per event before it
+# is marked failed, and the processing lease
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", "300"))
+
+# SubscriptionDetailsView payload cache; also dropped on every ShopSubscription save
+SUBSCRIPTION_DETAILS_CACHE_SECONDS = int(os.getenv("SUBSCRIPTION_DETAILS_CACHE_SECONDS", "60"))
+
+# Per-shop plan entitlements (subscriptions.utils.entitlements); dropped on
+# ShopSubscription and SubscriptionPlan saves
+ENTITLEMENTS_CACHE_SECONDS = int(os.getenv("ENTITLEMENTS_CACHE_SECONDS", "300"))
+
+# Foundation shops updated per chunk when GlobalSettings change
+GLOBAL_SETTINGS_PROPAGATION_BATCH_SIZE = int(os.getenv("GLOBAL_SETTINGS_PROPAGATION_BATCH_SIZE", "200"))
+
+# Auto-fill offers sent between two "is the slot still open?" checks
+AUTOFILL_DISPATCH_BATCH_SIZE = int(os.getenv("AUTOFILL_DISPATCH_BATCH_SIZE", "10"))
+
+# ==============================
+# Chat (websocket) tuning
+# ==============================
+# Echo latency above this budget is logged as a warning by ChatConsumer
+CHAT_ECHO_LATENCY_BUDGET_MS = int(os.getenv("CHAT_ECHO_LATENCY_BUDGET_MS", "250"))
+# Postgres statement_timeout for the chat insert transaction (a timed-out
+# insert rolls back) and upper bound for the channel-layer fan-out
+CHAT_DB_TIMEOUT_SECONDS = float(os.getenv("CHAT_DB_TIMEOUT_SECONDS", "5"))
+CHAT_FANOUT_TIMEOUT_SECONDS = float(os.getenv("CHAT_FANOUT_TIMEOUT_SECONDS", "2"))
+# Presence heartbeat TTL (clients send {"action": "heartbeat"} well within this)
+CHAT_PRESENCE_TTL_SECONDS = int(os.getenv("CHAT_PRESENCE_TTL_SECONDS", "90"))
+# At most one chat push per (recipient, thread) per window
+CHAT_PUSH_COALESCE_SECONDS = int(os.getenv("CHAT_PUSH_COALESCE_SECONDS", "60"))
+
 FCM_SERVER_KEY = os.getenv("FCM_SERVER_KEY", "")
 FCM_SERVICE_ACCOUNT_FILE = os.environ.get("FCM_SERVICE_ACCOUNT_JSON", "{}")
 #laod FCM from config env variable
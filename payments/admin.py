@@ -6,10 +6,14 @@ from .models import (
     UserStripeCustomer, 
     Payment, 
     Booking,
+    BookingReminder,
     Refund,
     TransactionLog,
     CouponUsage,
     ShopPayout,
+    ShopEarningsDay,
+    OutboxJob,
+    WebhookEvent,
 )
 
 # -----------------------------
@@ -52,6 +56,50 @@ class BookingAdmin(admin.ModelAdmin):
     actions = ['mark_as_no_show', 'mark_as_late_cancel']
 
 
+# -----------------------------
+# BookingReminder Admin
+# -----------------------------
+@admin.register(BookingReminder)
+class BookingReminderAdmin(admin.ModelAdmin):
+    list_display = ("id", "booking", "kind", "due_at", "status", "sent_at")
+    list_filter = ("status", "kind")
+    search_fields = ("booking__user__email", "booking__shop__name")
+    readonly_fields = ("created_at",)
+
+
+# -----------------------------
+# ShopEarningsDay Admin
+# -----------------------------
+@admin.register(ShopEarningsDay)
+class ShopEarningsDayAdmin(admin.ModelAdmin):
+    list_display = ("shop", "date", "service_revenue", "tips_total", "commission_total", "bookings_total", "computed_at")
+    list_filter = ("date",)
+    search_fields = ("shop__name",)
+    readonly_fields = ("computed_at",)
+
+
+# -----------------------------
+# OutboxJob Admin
+# -----------------------------
+@admin.register(OutboxJob)
+class OutboxJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "attempts", "available_at", "created_at", "processed_at")
+    list_filter = ("status", "kind")
+    search_fields = ("dedupe_key",)
+    readonly_fields = ("created_at", "processed_at")
+
+
+# -----------------------------
+# WebhookEvent Admin
+# -----------------------------
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "provider", "event_type", "object_id", "status", "attempts", "received_at", "processed_at")
+    list_filter = ("provider", "status", "event_type")
+    search_fields = ("event_id", "object_id")
+    readonly_fields = ("received_at", "processed_at")
+
+
 # -----------------------------
 # Refund Admin
 # -----------------------------
@@ -0,0 +1,26 @@
+"""
+Repair the revenue buckets: Revenue running totals and ShopEarningsDay rows.
+
+    python manage.py rebuild_revenue_rollups              # payments changed in the last 25 hours
+    python manage.py rebuild_revenue_rollups --hours 72
+    python manage.py rebuild_revenue_rollups --full       # every day with succeeded payments (first deploy)
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.utils.revenue import reconcile_revenue_rollups
+
+
+class Command(BaseCommand):
+    help = "Repair Revenue running totals and rebuild ShopEarningsDay rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the earnings days of every succeeded payment')
+        parser.add_argument('--hours', type=int, default=25, help='Payments changed within this many hours (default: 25)')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        fixed, days = reconcile_revenue_rollups(since=since, full=options['full'])
+        self.stdout.write(f"Fixed {fixed} running totals, rebuilt {days} earnings days")
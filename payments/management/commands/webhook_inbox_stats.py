@@ -0,0 +1,21 @@
+"""
+Webhook inbox health: backlog, failures and processing lag per provider.
+
+    python manage.py webhook_inbox_stats
+    python manage.py webhook_inbox_stats --hours 24
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from payments.utils.webhook_inbox import inbox_stats
+
+
+class Command(BaseCommand):
+    help = "Show webhook inbox backlog and processing lag"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=1, help='Look-back window for processed/failed/lag (default: 1)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(inbox_stats(hours=options['hours']), indent=2))
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:50
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+# Mirrors payments.utils.reminders.REMINDER_OFFSETS at the time of this migration
+REMINDER_OFFSETS = (
+    ('1_day', timedelta(days=1)),
+    ('1_hour', timedelta(hours=1)),
+    ('15_minutes', timedelta(minutes=15)),
+)
+
+
+def schedule_existing_reminders(apps, schema_editor):
+    Booking = apps.get_model('payments', 'Booking')
+    BookingReminder = apps.get_model('payments', 'BookingReminder')
+
+    now = timezone.now()
+    upcoming = (
+        Booking.objects
+        .filter(status='active', slot__start_time__gt=now)
+        .values_list('id', 'slot__start_time')
+    )
+    rows = [
+        BookingReminder(booking_id=booking_id, kind=kind, due_at=start_time - offset)
+        for booking_id, start_time in upcoming.iterator()
+        for kind, offset in REMINDER_OFFSETS
+        if start_time - offset > now
+    ]
+    BookingReminder.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_checkout_payment_method'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('due_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('skipped', 'Skipped')], default='pending', max_length=10)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='payments.booking')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['due_at'], name='bookingreminder_due_idx')],
+                'constraints': [models.UniqueConstraint(fields=('booking', 'kind'), name='uniq_booking_reminder_kind')],
+            },
+        ),
+        migrations.RunPython(schedule_existing_reminders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_shop_daily_rollups'),
+        ('payments', '0009_campaigndelivery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['updated_at'], name='booking_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['shop', 'created_at'], name='booking_shop_created_idx'),
+        ),
+    ]
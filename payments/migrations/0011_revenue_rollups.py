@@ -0,0 +1,66 @@
+# Generated by Django 5.2.5 on 2026-10-18 22:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_earnings_days(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    ShopEarningsDay = apps.get_model('payments', 'ShopEarningsDay')
+
+    per_day = (
+        Payment.objects
+        .filter(status='succeeded', booking__isnull=False)
+        .annotate(day=TruncDate('created_at'))
+        .values('booking__shop_id', 'day')
+        .annotate(
+            service_revenue=Sum('service_price'),
+            tips_total=Sum('tips_amount'),
+            commission_total=Sum('application_fee_amount'),
+            deposit_credited=Sum('deposit_amount', filter=Q(deposit_status='credited')),
+            deposit_forfeited=Sum('deposit_amount', filter=Q(deposit_status='forfeited')),
+            bookings_total=Count('id'),
+            bookings_credited=Count('id', filter=Q(deposit_status='credited')),
+            bookings_forfeited=Count('id', filter=Q(deposit_status='forfeited')),
+        )
+    )
+    rows = []
+    for r in per_day.iterator():
+        shop_id, day = r.pop('booking__shop_id'), r.pop('day')
+        rows.append(ShopEarningsDay(shop_id=shop_id, date=day, **{k: v or 0 for k, v in r.items()}))
+    ShopEarningsDay.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_revenue_rollups'),
+        ('payments', '0010_booking_rollup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopEarningsDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('service_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('tips_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('commission_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('deposit_credited', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('deposit_forfeited', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('bookings_total', models.PositiveIntegerField(default=0)),
+                ('bookings_credited', models.PositiveIntegerField(default=0)),
+                ('bookings_forfeited', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earnings_days', to='api.shop')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('shop', 'date'), name='uniq_shop_earnings_day')],
+            },
+        ),
+        migrations.RunPython(backfill_earnings_days, migrations.RunPython.noop),
+    ]
@@ -1,24 +1,17 @@
 # payments/models.py
-from datetime import timedelta
 from decimal import Decimal
 import os
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
-from django.db.models import F
 from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 from django.utils import timezone
 import stripe
-from django.core.mail import send_mail
 from accounts.models import User
-from api.models import AutoFillLog, Shop, SlotBooking, Revenue, Coupon
-from api.utils.fcm import notify_user
+from api.models import AutoFillLog, Shop, SlotBooking, Coupon
 import logging
 import traceback
-from django.apps import apps as django_apps
 
-from api.utils.phones import get_user_phone
-from api.utils.sms import send_sms
 
 logger = logging.getLogger(__name__)
 
@@ -184,9 +177,24 @@ class Booking(models.Model):
         help_text="Timestamp when review reminder was sent (max 1 per booking)"
     )
 
+    class Meta:
+        indexes = [
+            # Incremental analytics rollups: changed rows, per-shop day ranges
+            models.Index(fields=["updated_at"], name="booking_updated_at_idx"),
+            models.Index(fields=["shop", "created_at"], name="booking_shop_created_idx"),
+        ]
+
     def __str__(self):
         return f"Booking {self.id} - {self.status}"
 
+    def save(self, *args, **kwargs):
+        # auto_now only fires for fields being saved; the analytics rollups
+        # find changed bookings by updated_at, so partial saves must bump it
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "updated_at" not in update_fields:
+            kwargs["update_fields"] = [*update_fields, "updated_at"]
+        super().save(*args, **kwargs)
+
     def cancel_booking(self, reason="requested_by_customer"):
         if self.status == "cancelled":
             return False, "Booking already cancelled"
@@ -267,6 +275,194 @@ class Booking(models.Model):
         except Exception as e:
             return False, str(e)
 
+# -----------------------------
+# Booking Reminders
+# -----------------------------
+class BookingReminder(models.Model):
+    """
+    One scheduled reminder for a booking, written when the booking is created
+    (see payments.utils.reminders). The dispatcher only reads pending rows
+    whose due_at has passed, so a tick costs O(due reminders).
+    """
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_SKIPPED = "skipped"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_SKIPPED, "Skipped"),
+    ]
+
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name="reminders")
+    kind = models.CharField(max_length=20)  # "1_day", "1_hour", "15_minutes"
+    due_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["booking", "kind"], name="uniq_booking_reminder_kind"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["due_at"],
+                condition=models.Q(status="pending"),
+                name="bookingreminder_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Reminder {self.kind} for Booking {self.booking_id} - {self.status}"
+
+# -----------------------------
+# Campaign Deliveries
+# -----------------------------
+class CampaignDelivery(models.Model):
+    """
+    Last time a user received a marketing campaign (rebooking prompt, ghost
+    re-engagement). Audiences exclude users still inside the cooldown.
+    """
+    campaign = models.CharField(max_length=50)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="campaign_deliveries")
+    last_sent_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["campaign", "user"], name="uniq_campaign_delivery_user"),
+        ]
+
+    def __str__(self):
+        return f"{self.campaign} -> user {self.user_id} at {self.last_sent_at}"
+
+# -----------------------------
+# Shop Earnings (daily rollup)
+# -----------------------------
+class ShopEarningsDay(models.Model):
+    """
+    Succeeded payments of one shop on one day, as summed by the earnings
+    report. Recomputed for the payment's day whenever a Payment is saved.
+    """
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name="earnings_days")
+    date = models.DateField()
+    service_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    tips_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    commission_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    deposit_credited = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    deposit_forfeited = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    bookings_total = models.PositiveIntegerField(default=0)
+    bookings_credited = models.PositiveIntegerField(default=0)
+    bookings_forfeited = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-date"]
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "date"], name="uniq_shop_earnings_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.shop_id} earnings on {self.date}"
+
+# -----------------------------
+# Side-effect Outbox
+# -----------------------------
+class OutboxJob(models.Model):
+    """
+    A side effect (notification, bookkeeping) recorded in the same transaction
+    as the state change that caused it and run by a worker after commit
+    (see payments.utils.outbox). Rows survive broker outages; the drain task
+    picks up anything whose dispatch was lost.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    dedupe_key = models.CharField(max_length=120, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available_at"],
+                condition=models.Q(status="pending"),
+                name="outboxjob_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} - {self.status}"
+
+# -----------------------------
+# Webhook Inbox
+# -----------------------------
+class WebhookEvent(models.Model):
+    """
+    A verified provider webhook delivery, stored before it is acknowledged
+    and processed later by a worker (see payments.utils.webhook_inbox).
+    The unique (provider, event_id) makes redeliveries no-ops; events for the
+    same provider object are processed in the order they occurred.
+    """
+    PROVIDER_STRIPE = "stripe"
+    PROVIDER_PAYPAL = "paypal"
+    PROVIDER_CHOICES = [
+        (PROVIDER_STRIPE, "Stripe"),
+        (PROVIDER_PAYPAL, "PayPal"),
+    ]
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSED = "processed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_PROCESSED, "Processed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    provider = models.CharField(max_length=10, choices=PROVIDER_CHOICES)
+    event_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=255, blank=True, default="")
+    payload = models.JSONField()
+    occurred_at = models.DateTimeField(default=timezone.now)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["provider", "event_id"], name="uniq_webhook_provider_event"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["available_at"],
+                condition=models.Q(status="pending"),
+                name="webhookevent_due_idx",
+            ),
+            models.Index(
+                fields=["provider", "object_id", "occurred_at"],
+                condition=models.Q(status="pending"),
+                name="webhookevent_object_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} {self.event_id} - {self.status}"
+
 # -----------------------------
 # Transaction Log Table
 # -----------------------------
@@ -368,6 +564,10 @@ def can_use_coupon(user, coupon):
 # Signals
 # -----------------------------
 
+# Sent once per completed batch by payments.tasks.complete_past_bookings
+# (after commit), with booking_ids=[...]. Bulk UPDATE skips Booking post_save.
+bookings_completed = Signal()
+
 # Stripe account for Shop
 @receiver(post_save, sender=Shop)
 def create_shop_stripe_account(sender, instance, created, **kwargs):
@@ -404,10 +604,12 @@ def delete_user_stripe_customer(sender, instance, **kwargs):
 @receiver(post_save, sender=Payment)
 def handle_payment_status(sender, instance, created, **kwargs):
     """
-    Robust version:
-    - Always defines booking_obj/created_booking before use
-    - Only references them inside the 'succeeded' branch
-    - Wraps all side-effects with try/except
+    Only the database state transitions run here (inside the caller's
+    request or webhook): payment status, hold conversion, Booking,
+    reminders, TransactionLog. Autofill bookkeeping and notifications are
+    queued as OutboxJobs (payments.utils.payment_side_effects). A payment
+    that lands after the hold sweeper cancelled its booking either takes the
+    slot back or is refunded; it never books a released unit.
     """
     # Make sure these exist even if we never reach the succeeded block
     booking_obj = None
@@ -419,177 +621,57 @@ def handle_payment_status(sender, instance, created, **kwargs):
 
         # ---------------- Payment Succeeded ----------------
         if instance.status == "succeeded":
-            # Idempotent payment status update
-            if slot_booking.payment_status != "success":
-                slot_booking.payment_status = "success"
-                slot_booking.save(update_fields=["payment_status"])
-
-            # Create Booking exactly once for this Payment
-            booking_obj, created_booking = Booking.objects.get_or_create(
-                payment=instance,
-                defaults={
-                    "user": instance.user,
-                    "shop": shop,
-                    "slot": slot_booking,
-                    "status": "active",
-                    "stripe_payment_intent_id": instance.stripe_payment_intent_id,
-                },
-            )
+            # Paid after the hold expired and the sweeper released the slot:
+            # take the unit back if it is still free, otherwise refund
+            placed = True
+            if (
+                not Booking.objects.filter(payment=instance).exists()
+                and SlotBooking.objects.filter(id=slot_booking.id, status="cancelled").exists()
+            ):
+                from api.utils.holds import reclaim_expired_booking
+                placed = reclaim_expired_booking(slot_booking)
+                if not placed:
+                    from payments.utils.outbox import enqueue_job
+                    logger.warning(
+                        "Payment %s succeeded for cancelled booking %s; refunding", instance.id, slot_booking.id
+                    )
+                    enqueue_job(
+                        "refund_unbookable", {"payment_id": instance.id},
+                        dedupe_key=f"refund_unbookable:{instance.id}",
+                    )
 
-            # ---- Close the AutoFillLog loop if this booking filled an offer ----
-            try:
-                AutoFillLog = django_apps.get_model("api", "AutoFillLog")
+            if placed:
+                # Idempotent payment status update
+                if slot_booking.payment_status != "success":
+                    slot_booking.payment_status = "success"
+                    slot_booking.save(update_fields=["payment_status"])
 
-                ai_settings = getattr(shop, "ai_settings", None)
-                scope_hours = getattr(ai_settings, "auto_fill_scope_hours", 48) or 48
-                window_start = timezone.now() - timedelta(hours=scope_hours)
+                # The held capacity is now a paid booking (hold-to-booking conversion)
+                from api.utils.holds import convert_hold
+                convert_hold(slot_booking.id)
 
-                logger.info(
-                    "[AutoFillClose] start shop_id=%s service_id=%s slot_id=%s window_start=%s payment_id=%s booking_obj_id=%s",
-                    shop.id, slot_booking.service_id, slot_booking.slot_id,
-                    window_start.isoformat(), instance.id, getattr(booking_obj, "id", None)
+                # Create Booking exactly once for this Payment
+                booking_obj, created_booking = Booking.objects.get_or_create(
+                    payment=instance,
+                    defaults={
+                        "user": instance.user,
+                        "shop": shop,
+                        "slot": slot_booking,
+                        "status": "active",
+                        "stripe_payment_intent_id": instance.stripe_payment_intent_id,
+                    },
                 )
-
-                # Prefer exact offered_slot match (SlotBooking.slot -> Slot)
-                log_to_close = (
-                    AutoFillLog.objects
-                    .filter(
-                        shop=shop,
-                        status__in=("initiated", "outreach_started"),
-                        created_at__gte=window_start,
-                        offered_slot=getattr(slot_booking, "slot", None),
+                if created_booking:
+                    from payments.utils.outbox import enqueue_job
+                    from payments.utils.reminders import schedule_booking_reminders
+                    schedule_booking_reminders(booking_obj)
+
+                    # Autofill bookkeeping and owner/client notifications run after commit
+                    enqueue_job("autofill_close", {"payment_id": instance.id}, dedupe_key=f"autofill_close:{instance.id}")
+                    enqueue_job(
+                        "booking_notifications", {"payment_id": instance.id},
+                        dedupe_key=f"booking_notifications:{instance.id}",
                     )
-                    .order_by("-created_at")
-                    .first()
-                )
-
-                if not log_to_close:
-                    # Fallback: any open log for the same service in window
-                    log_to_close = (
-                        AutoFillLog.objects
-                        .select_related("original_booking", "offered_slot")
-                        .filter(
-                            shop=shop,
-                            status__in=("initiated", "outreach_started"),
-                            created_at__gte=window_start,
-                            original_booking__slot__service_id=slot_booking.service_id,
-                        )
-                        .order_by("-created_at")
-                        .first()
-                    )
-
-                if log_to_close:
-                    fields = ["filled_by_booking", "status"]
-                    log_to_close.filled_by_booking = booking_obj
-                    log_to_close.status = "completed"
-                    recovered = getattr(instance, "amount", 0) or 0
-                    if recovered:
-                        log_to_close.revenue_recovered = recovered
-                        fields.append("revenue_recovered")
-                    log_to_close.save(update_fields=fields)
-                    logger.info(
-                        "[AutoFillClose] ✅ COMPLETED log_id=%s recovered=%.2f via booking_id=%s",
-                        log_to_close.id, float(recovered), getattr(booking_obj, "id", None)
-                    )
-                else:
-                    open_logs = list(
-                        AutoFillLog.objects
-                        .select_related("offered_slot", "original_booking")
-                        .filter(
-                            shop=shop,
-                            status__in=("initiated", "outreach_started"),
-                            created_at__gte=window_start,
-                        )
-                        .order_by("-created_at")
-                        .values("id", "created_at", "offered_slot_id", "original_booking_id", "status")
-                    )
-                    logger.info(
-                        "[AutoFillClose] ❌ NO MATCH. Inspect recent open logs for shop_id=%s: %s",
-                        shop.id, open_logs
-                    )
-            except Exception as e:
-                logger.error("[AutoFillClose] ERROR: %s", e, exc_info=True)
-
-            # ---- Owner email & push & SMS (only on first creation) ----
-            if created_booking and booking_obj:
-                try:
-                    # Friendly time strings
-                    start_dt_local = timezone.localtime(slot_booking.start_time)
-                    end_dt_local = timezone.localtime(slot_booking.end_time)
-                    start_time_str = start_dt_local.strftime("%A, %d %B %Y at %I:%M %p")
-                    end_time_str = end_dt_local.strftime("%I:%M %p")
-
-                    shop_name = shop.name
-                    service_title = slot_booking.service.title
-                    customer_name = getattr(instance.user, "name", None) or getattr(instance.user, "email", "")
-
-                    # Email the shop owner (if present)
-                    owner = getattr(shop, "owner", None)
-                    owner_email = getattr(owner, "email", None)
-                    if owner_email:
-                        from_email = settings.DEFAULT_FROM_EMAIL
-                        subject = "New Appointment Booked"
-                        owner_message = (
-                            f"Hello {getattr(owner, 'name', '') or 'Shop Owner'},\n\n"
-                            f"A new appointment has been booked.\n\n"
-                            f"👤 Customer: {customer_name}\n"
-                            f"🏬 Shop: {shop_name}\n"
-                            f"💆 Service: {service_title}\n"
-                            f"🗓 Date & Time: {start_time_str} – {end_time_str}\n\n"
-                            f"Please prepare accordingly."
-                        )
-                        try:
-                            send_mail(subject, owner_message, from_email, [owner_email])
-                        except Exception:
-                            logger.exception("Failed to email shop owner %s", getattr(owner, "id", "unknown"))
-
-                    # Push to owner
-                    try:
-                        if owner:
-                            notify_user(
-                                owner,
-                                message=f"New appointment from {customer_name} for {service_title} on {start_time_str}.",
-                                notification_type="booking",
-                                data={
-                                    "shop_id": shop.id,
-                                    "booking_id": slot_booking.id,
-                                    "service": service_title,
-                                    "start_time": str(slot_booking.start_time),
-                                    "end_time": str(slot_booking.end_time),
-                                },
-                                debug=True
-                            )
-                    except Exception:
-                        logger.exception("Failed to push to shop owner %s", getattr(owner, "id", "unknown"))
-
-                    # SMS to client
-                    client_phone = get_user_phone(instance.user)
-                    if client_phone:
-                        try:
-                            send_sms(
-                                client_phone,
-                                f"Fidden Booking Confirmed: {service_title} at {shop_name} on {start_time_str}. See you there!"
-                            )
-                        except Exception:
-                            logger.exception("Cannot send booking confirmation SMS to client %s", getattr(instance.user, "id", None))
-                    else:
-                        logger.info("Client %s has no phone; skipping confirmation SMS.", getattr(instance.user, "id", None))
-
-                    # SMS to owner
-                    owner_phone = get_user_phone(owner) if owner else None
-                    if owner_phone:
-                        try:
-                            send_sms(
-                                owner_phone,
-                                f"Fidden New Booking: {customer_name} booked {service_title} for {start_time_str}."
-                            )
-                        except Exception:
-                            logger.exception("Cannot send new booking SMS to owner %s", getattr(owner, "id", None))
-                    else:
-                        logger.info("Owner has no phone; skipping owner SMS.")
-
-                except Exception:
-                    logger.exception("Post-booking notifications failed for Payment %s", instance.id)
 
             # Payment transaction log (idempotent)
             if not TransactionLog.objects.filter(payment=instance, transaction_type="payment").exists():
@@ -622,9 +704,9 @@ def handle_payment_status(sender, instance, created, **kwargs):
                     payment=instance,
                     refund=refund,
                     user=instance.user,
-                    shop=instance.booking.shop if hasattr(instance, "booking_record") else None,
-                    slot=instance.booking if hasattr(instance, "booking_record") else None,
-                    service=instance.booking.service if hasattr(instance, "booking_record") else None,
+                    shop=shop,
+                    slot=slot_booking,
+                    service=slot_booking.service,
                     amount=refund.amount,
                     currency=instance.currency,
                     status=refund.status,
@@ -643,9 +725,10 @@ def log_refund_transaction(sender, instance, created, **kwargs):
                 payment=instance.payment,
                 refund=instance,
                 user=instance.payment.user,
-                shop=instance.payment.booking_record.shop if hasattr(instance.payment, "booking_record") else None,
-                slot=instance.payment.booking_record.slot if hasattr(instance.payment, "booking_record") else None,
-                service=instance.payment.booking_record.slot.service if hasattr(instance.payment, "booking_record") and instance.payment.booking_record.slot else None,
+                # The SlotBooking is there even when no Booking was created
+                shop=instance.payment.booking.shop,
+                slot=instance.payment.booking,
+                service=instance.payment.booking.service,
                 amount=instance.amount,
                 currency=instance.payment.currency,
                 status=instance.status,
@@ -658,24 +741,21 @@ def update_daily_revenue(sender, instance, created, **kwargs):
     Update or create daily revenue for the shop whenever a transaction log is added.
     - Payment -> add amount
     - Refund -> subtract amount
-    - One row per shop per day
+    - One row per shop per day (atomic upsert, see payments.utils.revenue)
     """
-    if not created:
+    if not created or not instance.shop_id:
         return  # Only act on newly created transaction logs
 
-    shop = instance.shop
-    transaction_date = instance.created_at.date()
-    amount = instance.amount
+    from payments.utils.revenue import record_revenue
 
     # Determine revenue delta: + for payment, - for refund
-    delta = amount if instance.transaction_type == "payment" else -amount
+    delta = instance.amount if instance.transaction_type == "payment" else -instance.amount
+    record_revenue(instance.shop_id, instance.created_at.date(), delta)
+
 
-    # Try to get today's revenue row
-    revenue_obj = Revenue.objects.filter(shop=shop, timestamp=transaction_date).first()
+# Keep the payment's earnings day current
+@receiver(post_save, sender=Payment)
+def refresh_shop_earnings_day(sender, instance, **kwargs):
+    from payments.utils.revenue import refresh_earnings_for_payment
 
-    if revenue_obj:
-        # Update existing revenue
-        Revenue.objects.filter(pk=revenue_obj.pk).update(revenue=F('revenue') + delta)
-    else:
-        # Create new revenue row for today
-        Revenue.objects.create(shop=shop, timestamp=transaction_date, revenue=delta)
+    transaction.on_commit(lambda: refresh_earnings_for_payment(instance.booking_id, instance.created_at))
@@ -7,235 +7,180 @@ from accounts.models import User
 from api.utils.fcm import notify_user
 from payments.models import Booking
 from subscriptions.models import ShopSubscription, SubscriptionPlan
-from .utils.helper_function import send_booking_reminder_email
 import logging
 import traceback
-from django.db.models import Max, OuterRef, Subquery
 from django.db import transaction
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True, name="payments.tasks.complete_past_bookings", max_retries=3, default_retry_delay=60)
-def complete_past_bookings(self):
+def complete_past_bookings(self, batch_size=1000, max_batches=10):
     """
-    Mark bookings as 'completed' once the appointment's effective end-time has passed.
+    Mark bookings as 'completed' once their SlotBooking.end_time has passed.
 
-    Priority for end-time:
-      1) SlotBooking.end_time (instance-specific)
-      2) SlotBooking.start_time + duration (SlotBooking.duration_minutes or service.duration or 30)
-      3) LAST RESORT: treat start_time as end (legacy fallback)
+    Set-based: each batch is a single UPDATE ... RETURNING id over bookings
+    joined to their slot booking (SlotBooking.save always fills end_time).
+    Rows locked by another worker are skipped, not waited on. Listeners of
+    `bookings_completed` get the completed ids of each batch after commit.
     """
-    from payments.models import Booking  # adjust import if your Booking model lives elsewhere
+    from django.db import connection
+    from payments.models import bookings_completed
 
     now = timezone.now()
-
-    candidates = (
-        Booking.objects
-        .select_related("slot", "slot__service")  # prefer service over slot__slot
-        .filter(
-            status__in=["active", "confirmed"],
-            slot__start_time__lte=now,  # already started
-        )
-        .exclude(status__in=["cancelled", "no-show", "completed"])
-    )
-
-    def _effective_end(b) -> "datetime":
-        sb = b.slot  # SlotBooking
-        # 1) explicit instance end
-        if getattr(sb, "end_time", None):
-            return sb.end_time
-
-        # try to derive a duration (minutes)
-        duration = (
-            getattr(sb, "duration_minutes", None)
-            or getattr(sb, "duration", None)  # sometimes stored as 'duration'
-            or getattr(getattr(sb, "service", None), "duration_minutes", None)
-            or getattr(getattr(sb, "service", None), "duration", None)
-            or 30  # sensible default
-        )
-        try:
-            duration = int(duration)
-        except Exception:
-            duration = 30
-
-        # 2) compute from start + duration
-        if getattr(sb, "start_time", None):
-            return sb.start_time + timedelta(minutes=duration)
-
-        # 3) legacy fallback (should rarely hit)
-        # if we somehow do not have start_time, return 'now' so it won’t flip early
-        return now
-
-    updated = 0
-    for b in candidates:
-        end_dt = _effective_end(b)
-        if end_dt > now:
-            continue  # appointment not finished yet
-
+    total = 0
+    for _ in range(max_batches):
         with transaction.atomic():
-            fresh = (
+            due = (
                 Booking.objects
-                .select_for_update()
-                .filter(id=b.id)
-                .exclude(status__in=["cancelled", "no-show", "completed"])
-                .first()
+                .select_for_update(skip_locked=True, of=("self",))
+                .filter(status__in=["active", "confirmed"], slot__end_time__lte=now)
+                .order_by("slot__end_time")
+                .values("id")[:batch_size]
             )
-            if not fresh:
-                continue
-
-            fresh.status = "completed"
-            # Save minimally; include updated_at if present
-            try:
-                fresh.save(update_fields=["status", "updated_at"])
-            except Exception:
-                fresh.save(update_fields=["status"])
-            updated += 1
-            logger.info("Booking %s marked as completed (end=%s)", fresh.id, end_dt.isoformat())
-
-    msg = f"{updated} bookings completed"
+            due_sql, due_params = due.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {Booking._meta.db_table} SET status = %s, updated_at = %s "
+                    f"WHERE id IN ({due_sql}) RETURNING id",
+                    ["completed", connection.ops.adapt_datetimefield_value(now), *due_params],
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+            if ids:
+                transaction.on_commit(
+                    lambda ids=ids: bookings_completed.send_robust(sender=Booking, booking_ids=ids)
+                )
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+
+    msg = f"{total} bookings completed"
     logger.info(msg)
     return msg
 
 
-@shared_task
-def send_booking_reminders():
+@shared_task(bind=True, name="payments.tasks.dispatch_booking_reminders", max_retries=3, default_retry_delay=60)
+def dispatch_booking_reminders(self, batch_size=500, max_batches=20):
     """
-    Send reminders to users for their active bookings:
-    - 1 day before
-    - 1 hour before
-    - 15 minutes before
+    Send the booking reminders (1 day / 1 hour / 15 minutes before) that are
+    due, from the BookingReminder schedule. Missed ticks are caught up.
     """
-    now = timezone.now()
+    from payments.utils.reminders import dispatch_due_reminders
 
+    sent = skipped = 0
     try:
-        bookings = Booking.objects.filter(status="active").select_related("slot", "user", "shop")
-
-        reminders_sent = 0
-
-        for booking in bookings:
-            slot_end = booking.slot.end_time
-            slot_start = booking.slot.start_time
-
-            # Check if the booking is still in the future
-            if slot_start <= now:
-                continue
-
-            reminder_times = {
-                "1_day": slot_start - timedelta(days=1),
-                "1_hour": slot_start - timedelta(hours=1),
-                "15_minutes": slot_start - timedelta(minutes=15),
-            }
-
-            for reminder_label, reminder_time in reminder_times.items():
-                # Allow a 1 minute window to send the reminder
-                if reminder_time <= now <= reminder_time + timedelta(minutes=1):
-                    try:
-                        send_booking_reminder_email(booking, reminder_label)
-                        reminders_sent += 1
-                    except Exception as e:
-                        logger.error(
-                            "Failed to send booking reminder for Booking %s (%s): %s\n%s",
-                            booking.id,
-                            reminder_label,
-                            str(e),
-                            traceback.format_exc()
-                        )
-
-        return f"{reminders_sent} booking reminders sent."
+        for _ in range(max_batches):
+            batch_sent, batch_skipped = dispatch_due_reminders(batch_size=batch_size)
+            sent += batch_sent
+            skipped += batch_skipped
+            if batch_sent + batch_skipped < batch_size:
+                break
     except Exception as e:
-        logger.error("Error in send_booking_reminders task: %s\n%s", str(e), traceback.format_exc())
-        return "Booking reminder task failed."
+        logger.error("Error in dispatch_booking_reminders task: %s\n%s", str(e), traceback.format_exc())
+        raise self.retry(exc=e)
 
-# payments/tasks.py
-@shared_task
-def send_smart_rebooking_prompts():
-    """
-    Analyzes booking history and sends notifications to users when it's
-    time to rebook, based on their last completed appointment.
-    """
-    logger.info("Running smart rebooking prompts task...")
+    return f"{sent} booking reminders sent, {skipped} skipped."
 
-    # --- Configuration ---
-    REBOOKING_CADENCE_DAYS = 30 # Default: prompt if last completed booking was > 30 days ago
-    NOTIFICATION_TYPE = "rebooking_prompt" # For DB and push data
 
-    # --- Logic ---
-    now = timezone.now()
-    rebooking_threshold_date = now - timedelta(days=REBOOKING_CADENCE_DAYS)
-    sent_count = 0
+@shared_task(name="payments.tasks.run_outbox_job")
+def run_outbox_job(job_id):
+    """Run one outbox job (dispatched after the transaction that wrote it commits)."""
+    from payments.utils.outbox import run_job
 
-    # 1. Find the most recent completed booking date for each user
-    latest_completed_subquery = Booking.objects.filter(
-        user=OuterRef('pk'),
-        status='completed'
-    ).order_by('-created_at').values('created_at')[:1]
+    return run_job(job_id)
 
-    # 2. Find users whose latest completed booking is older than the threshold
-    users_to_prompt_qs = User.objects.annotate(
-        last_completed_booking_date=Subquery(latest_completed_subquery)
-    ).filter(
-        last_completed_booking_date__isnull=False,
-        last_completed_booking_date__lt=rebooking_threshold_date
-    )
 
-    # 3. Exclude users who already have an upcoming active booking
-    users_with_upcoming_bookings = Booking.objects.filter(
-        status='active',
-        slot__start_time__gt=now # Check against slot start time
-    ).values_list('user_id', flat=True).distinct()
+@shared_task(bind=True, name="payments.tasks.drain_outbox", max_retries=3, default_retry_delay=60)
+def drain_outbox(self, batch_size=100, max_batches=10):
+    """Run outbox jobs whose dispatch was lost or whose retry backoff has passed."""
+    from payments.utils.outbox import drain_due_jobs
 
-    users_to_prompt = users_to_prompt_qs.exclude(id__in=users_with_upcoming_bookings)
+    succeeded = attempted = 0
+    try:
+        for _ in range(max_batches):
+            batch_succeeded, batch_attempted = drain_due_jobs(batch_size=batch_size)
+            succeeded += batch_succeeded
+            attempted += batch_attempted
+            if batch_attempted < batch_size:
+                break
+    except Exception as e:
+        logger.error("Error in drain_outbox task: %s\n%s", str(e), traceback.format_exc())
+        raise self.retry(exc=e)
+    return f"{succeeded}/{attempted} outbox jobs succeeded."
 
-    logger.info(f"Found {users_to_prompt.count()} potential users to prompt for rebooking.")
 
-    # 4. For each eligible user, get their last completed service and send notification
-    for user in users_to_prompt:
-        # Get the details of their most recent completed booking
-        latest_booking = Booking.objects.filter(
-            user=user,
-            status='completed'
-        ).select_related('slot__service', 'shop').order_by('-created_at').first()
+@shared_task(name="payments.tasks.process_webhook_object")
+def process_webhook_object(provider, object_id):
+    """Process the pending webhook events of one provider object, in order."""
+    from payments.utils.webhook_inbox import process_object_events
 
-        if not latest_booking or not latest_booking.slot or not latest_booking.slot.service:
-            logger.warning(f"Could not find valid last booking details for user {user.id}. Skipping.")
-            continue
+    return process_object_events(provider, object_id)
 
-        service = latest_booking.slot.service
-        shop = latest_booking.shop
 
-        # Construct notification message
-        title = "Time to Rebook Your Appointment!"
-        message = (
-            f"Ready for your next session of {service.title} at {shop.name}? "
-            f"It's been a little while since your last visit. Book now to keep up the great work!"
-        )
-        push_data = {
-            "type": NOTIFICATION_TYPE,
-            "shop_id": str(shop.id),
-            "service_id": str(service.id),
-            "title": title, # Include title in data
-            # Add deeplink info if available, e.g., to the service or shop page
-            # "deeplink": f"fidden://service/{service.id}"
-        }
+@shared_task(bind=True, name="payments.tasks.drain_webhook_inbox", max_retries=3, default_retry_delay=60)
+def drain_webhook_inbox(self, batch_size=100):
+    """Process webhook events whose dispatch was lost or whose retry is due."""
+    from payments.utils.webhook_inbox import drain_webhook_inbox as drain
 
-        # Send notification (saves to DB and sends push)
-        try:
-            notify_user(
-                user=user,
-                message=message, # Use full message for DB/email, push uses body from data or this
-                notification_type=NOTIFICATION_TYPE,
-                data=push_data
-            )
-            sent_count += 1
-            logger.info(f"Sent rebooking prompt for service '{service.title}' to user {user.id}")
-            # Optional: Add a short delay between sends if needed
-            # time.sleep(0.1)
-        except Exception as e:
-            logger.error(f"Failed to send rebooking prompt to user {user.id}: {e}", exc_info=True)
+    try:
+        processed, objects = drain(batch_size=batch_size)
+    except Exception as e:
+        logger.error("Error in drain_webhook_inbox task: %s\n%s", str(e), traceback.format_exc())
+        raise self.retry(exc=e)
+    return f"{processed} webhook events processed across {objects} objects."
 
-    logger.info(f"Finished smart rebooking task. Sent {sent_count} prompts.")
-    return f"Sent {sent_count} rebooking prompts."
+
+@shared_task(bind=True, name="payments.tasks.reconcile_revenue_rollups", max_retries=3, default_retry_delay=60)
+def reconcile_revenue_rollups(self):
+    """Nightly repair of Revenue running totals and recently changed earnings days."""
+    from payments.utils.revenue import reconcile_revenue_rollups as reconcile
+
+    try:
+        fixed, days = reconcile()
+    except Exception as e:
+        logger.error("Error in reconcile_revenue_rollups task: %s\n%s", str(e), traceback.format_exc())
+        raise self.retry(exc=e)
+    return f"{fixed} running totals fixed, {days} earnings days rebuilt."
+
+
+@shared_task
+def send_booking_reminders():
+    """Superseded by dispatch_booking_reminders; kept so queued calls still run."""
+    return dispatch_booking_reminders()
+
+# payments/tasks.py
+@shared_task
+def send_smart_rebooking_prompts(cadence_days=30):
+    """
+    Prompt clients to rebook when their last completed appointment is more
+    than `cadence_days` old and nothing is booked ahead. The audience is built
+    in one query and delivered in batches; a client is prompted at most once
+    per REBOOKING_PROMPT_COOLDOWN_DAYS.
+    """
+    from payments.utils.audiences import REBOOKING_PROMPT, iter_audience_chunks, rebooking_audience
+
+    logger.info("Running smart rebooking prompts task...")
+    batches = audience_size = 0
+    for chunk in iter_audience_chunks(rebooking_audience(cadence_days)):
+        deliver_campaign_batch.delay(REBOOKING_PROMPT, chunk)
+        batches += 1
+        audience_size += len(chunk)
+
+    logger.info(f"Queued {audience_size} rebooking prompts in {batches} batches.")
+    return f"Queued {audience_size} rebooking prompts."
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=60)
+def deliver_campaign_batch(self, campaign, rows):
+    """Send one batch of a campaign audience (see payments.utils.audiences)."""
+    from payments.utils.audiences import deliver_campaign_batch as deliver
+
+    try:
+        sent = deliver(campaign, rows)
+    except Exception as e:
+        logger.error(f"[Campaign] {campaign} batch failed: {e}", exc_info=True)
+        raise self.retry(exc=e)
+    return f"{campaign}: {sent} sent."
 
 
 @shared_task(name="api.tasks.send_auto_followups")
@@ -432,24 +377,18 @@ def send_review_reminders():
 
 
 @shared_task
-def reengage_ghost_clients():
+def reengage_ghost_clients(inactive_days=90):
     """
-    Identifies inactive users and sends them targeted promotions to re-engage them.
+    Send a come-back offer to clients who booked before but not in the last
+    `inactive_days`. Shop owners and never-booked users are not targeted; a
+    client gets it at most once per GHOST_CLIENT_COOLDOWN_DAYS.
     """
+    from payments.utils.audiences import GHOST_CLIENT, ghost_audience, iter_audience_chunks
+
     logger.info("Running ghost client re-engagement task...")
-    # Example: Find users who haven't booked in the last 90 days
-    ninety_days_ago = timezone.now() - timedelta(days=90)
-    active_users = Booking.objects.filter(
-        created_at__gte=ninety_days_ago
-    ).values_list('user_id', flat=True)
-
-    ghost_users = User.objects.exclude(id__in=active_users)
-
-    for user in ghost_users:
-        notify_user(
-            user,
-            "We miss you!",
-            "It's been a while! Come back and enjoy a 10% discount on your next booking.",
-            data={"discount_code": "COMEBACK10"}
-        )
-    logger.info(f"Sent {ghost_users.count()} re-engagement notifications.")
\ No newline at end of file
+    audience_size = 0
+    for chunk in iter_audience_chunks(ghost_audience(inactive_days)):
+        deliver_campaign_batch.delay(GHOST_CLIENT, chunk)
+        audience_size += len(chunk)
+    logger.info(f"Queued {audience_size} re-engagement notifications.")
+    return f"Queued {audience_size} re-engagement notifications."
@@ -0,0 +1,156 @@
+# payments/utils/audiences.py
+"""
+Campaign audiences for client re-engagement.
+
+An audience is one query: every booking ranked per user with a window
+function, keeping each user's latest booking (with its shop and service) and
+filtering on it. Users inside the campaign cooldown (CampaignDelivery) are
+excluded in the same query. `iter_audience_chunks` streams the audience by
+user id; each chunk is handed to `deliver_campaign_batch`, which sends and
+records the deliveries in bulk.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Window
+from django.db.models.functions import FirstValue, RowNumber
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+REBOOKING_PROMPT = "rebooking_prompt"
+GHOST_CLIENT = "ghost_reengagement"
+
+AUDIENCE_FIELDS = ("user_id", "shop_id", "shop__name", "slot__service_id", "slot__service__title")
+
+
+def _cooldown_days(campaign):
+    return {
+        REBOOKING_PROMPT: getattr(settings, "REBOOKING_PROMPT_COOLDOWN_DAYS", 14),
+        GHOST_CLIENT: getattr(settings, "GHOST_CLIENT_COOLDOWN_DAYS", 30),
+    }[campaign]
+
+
+def _latest_booking_per_user(bookings, campaign, older_than, now):
+    """
+    Latest booking of each user in `bookings`, if it was created before
+    `older_than` and the user is out of the campaign cooldown.
+    """
+    from payments.models import CampaignDelivery
+
+    per_user = {"partition_by": [F("user_id")], "order_by": [F("created_at").desc(), F("id").desc()]}
+    recently_sent = CampaignDelivery.objects.filter(
+        campaign=campaign,
+        user_id=OuterRef("user_id"),
+        last_sent_at__gte=now - timedelta(days=_cooldown_days(campaign)),
+    )
+    return (
+        bookings
+        .exclude(Exists(recently_sent))
+        .annotate(
+            user_rank=Window(RowNumber(), **per_user),
+            latest_created_at=Window(FirstValue("created_at"), **per_user),
+        )
+        # Both conditions reference window expressions, so they apply after ranking
+        .filter(user_rank=1, latest_created_at__lt=older_than)
+        .values(*AUDIENCE_FIELDS)
+        .order_by("user_id")
+    )
+
+
+def rebooking_audience(cadence_days=30, now=None):
+    """Clients whose latest completed booking is older than the cadence and who have nothing upcoming."""
+    from payments.models import Booking
+
+    now = now or timezone.now()
+    upcoming = Booking.objects.filter(
+        user_id=OuterRef("user_id"), status="active", slot__start_time__gt=now
+    )
+    completed = Booking.objects.filter(status="completed").exclude(Exists(upcoming))
+    return _latest_booking_per_user(completed, REBOOKING_PROMPT, now - timedelta(days=cadence_days), now)
+
+
+def ghost_audience(inactive_days=90, now=None):
+    """Clients (not shop owners) who booked before but not within the last `inactive_days`."""
+    from payments.models import Booking
+
+    now = now or timezone.now()
+    bookings = Booking.objects.filter(user__role="user", user__is_active=True)
+    return _latest_booking_per_user(bookings, GHOST_CLIENT, now - timedelta(days=inactive_days), now)
+
+
+def iter_audience_chunks(audience, chunk_size=None):
+    """Stream an audience in user-id order, one bounded query per chunk."""
+    chunk_size = chunk_size or getattr(settings, "CAMPAIGN_BATCH_SIZE", 500)
+    last_user_id = 0
+    while True:
+        chunk = list(audience.filter(user_id__gt=last_user_id)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_user_id = chunk[-1]["user_id"]
+
+
+def _campaign_message(campaign, row):
+    """(message, notification_type, data) for one audience row."""
+    if campaign == REBOOKING_PROMPT:
+        title = "Time to Rebook Your Appointment!"
+        message = (
+            f"Ready for your next session of {row['slot__service__title']} at {row['shop__name']}? "
+            f"It's been a little while since your last visit. Book now to keep up the great work!"
+        )
+        data = {
+            "type": REBOOKING_PROMPT,
+            "shop_id": str(row["shop_id"]),
+            "service_id": str(row["slot__service_id"]),
+            "title": title,
+        }
+        return message, REBOOKING_PROMPT, data
+
+    message = "It's been a while! Come back and enjoy a 10% discount on your next booking."
+    return message, GHOST_CLIENT, {"title": "We miss you!", "discount_code": "COMEBACK10"}
+
+
+def deliver_campaign_batch(campaign, rows):
+    """
+    Notify one chunk of an audience and record the deliveries with a single
+    upsert. Users delivered since the audience was built are skipped.
+    """
+    from django.contrib.auth import get_user_model
+    from payments.models import CampaignDelivery
+    from api.utils.fcm import notify_user
+
+    now = timezone.now()
+    user_ids = [row["user_id"] for row in rows]
+    already_sent = set(
+        CampaignDelivery.objects.filter(
+            campaign=campaign,
+            user_id__in=user_ids,
+            last_sent_at__gte=now - timedelta(days=_cooldown_days(campaign)),
+        ).values_list("user_id", flat=True)
+    )
+    users = get_user_model().objects.in_bulk([u for u in user_ids if u not in already_sent])
+
+    delivered = []
+    for row in rows:
+        user = users.get(row["user_id"])
+        if user is None:
+            continue
+        message, notification_type, data = _campaign_message(campaign, row)
+        try:
+            notify_user(user=user, message=message, notification_type=notification_type, data=data)
+            delivered.append(user.id)
+        except Exception as e:
+            logger.error("Campaign %s failed for user %s: %s", campaign, user.id, e)
+
+    if delivered:
+        CampaignDelivery.objects.bulk_create(
+            [CampaignDelivery(campaign=campaign, user_id=uid, last_sent_at=now) for uid in delivered],
+            update_conflicts=True,
+            unique_fields=["campaign", "user"],
+            update_fields=["last_sent_at"],
+        )
+    return len(delivered)
@@ -0,0 +1,110 @@
+# payments/utils/outbox.py
+"""
+Transactional outbox for side effects (payments.models.OutboxJob).
+
+`enqueue_job` writes the job in the caller's transaction and dispatches it
+to a worker once that transaction commits, so a rolled-back payment never
+notifies anyone and a committed one is never lost. A job is claimed with a
+single conditional UPDATE that pushes its available_at one lease ahead;
+whoever claims it runs the handler, and a crashed worker's job becomes due
+again when the lease runs out. `drain_due_jobs` (beat, every minute) runs
+whatever the broker dropped and the retries whose backoff has passed.
+Handlers must tolerate running more than once.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {
+    "autofill_close": "payments.utils.payment_side_effects.close_autofill_log",
+    "booking_notifications": "payments.utils.payment_side_effects.send_booking_notifications",
+    "refund_unbookable": "payments.utils.payment_side_effects.refund_unbookable_payment",
+}
+
+MAX_ATTEMPTS = getattr(settings, "OUTBOX_MAX_ATTEMPTS", 5)
+LEASE_SECONDS = getattr(settings, "OUTBOX_LEASE_SECONDS", 300)
+
+
+def enqueue_job(kind, payload, dedupe_key=None):
+    """Record a side effect in the current transaction; it runs after commit."""
+    from payments.models import OutboxJob
+
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown outbox job kind: {kind}")
+    try:
+        with transaction.atomic():
+            job = OutboxJob.objects.create(kind=kind, payload=payload, dedupe_key=dedupe_key)
+    except IntegrityError:
+        return None  # Already queued under this dedupe_key
+
+    transaction.on_commit(lambda: _dispatch(job.id))
+    return job
+
+
+def _dispatch(job_id):
+    from payments.tasks import run_outbox_job
+
+    try:
+        run_outbox_job.delay(job_id)
+    except Exception as e:
+        # The row is committed; the drain task will run it
+        logger.warning("Outbox job %s not dispatched (%s); left for the drain task", job_id, e)
+
+
+def _claim(job_id, now):
+    from payments.models import OutboxJob
+
+    return OutboxJob.objects.filter(
+        id=job_id, status=OutboxJob.STATUS_PENDING, available_at__lte=now
+    ).update(available_at=now + timedelta(seconds=LEASE_SECONDS), attempts=F("attempts") + 1)
+
+
+def run_job(job_id):
+    """Claim and run one job. Returns True if it ran successfully."""
+    from payments.models import OutboxJob
+
+    now = timezone.now()
+    if not _claim(job_id, now):
+        return False  # Done, failed, not yet due, or claimed by another worker
+
+    job = OutboxJob.objects.get(id=job_id)
+    try:
+        import_string(HANDLERS[job.kind])(**job.payload)
+    except Exception as e:
+        logger.exception("Outbox job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts)
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = OutboxJob.STATUS_FAILED
+            job.processed_at = timezone.now()
+        else:
+            # Exponential backoff: 1, 2, 4, 8 ... minutes
+            job.available_at = timezone.now() + timedelta(minutes=2 ** (job.attempts - 1))
+        job.last_error = str(e)[:2000]
+        job.save(update_fields=["status", "processed_at", "available_at", "last_error"])
+        return False
+
+    job.status = OutboxJob.STATUS_DONE
+    job.processed_at = timezone.now()
+    job.last_error = ""
+    job.save(update_fields=["status", "processed_at", "last_error"])
+    return True
+
+
+def drain_due_jobs(batch_size=100):
+    """Run one batch of due jobs. Returns (succeeded, attempted)."""
+    from payments.models import OutboxJob
+
+    due = list(
+        OutboxJob.objects
+        .filter(status=OutboxJob.STATUS_PENDING, available_at__lte=timezone.now())
+        .order_by("available_at")
+        .values_list("id", flat=True)[:batch_size]
+    )
+    succeeded = sum(1 for job_id in due if run_job(job_id))
+    return succeeded, len(due)
@@ -0,0 +1,226 @@
+# payments/utils/payment_side_effects.py
+"""
+Side effects of a succeeded Payment, run as outbox jobs (payments.utils.outbox)
+after the webhook or request that created the Booking has committed.
+"""
+import logging
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.core.mail import send_mail
+from django.utils import timezone
+
+from api.utils.fcm import notify_user
+from api.utils.phones import get_user_phone
+from api.utils.sms import send_sms
+
+logger = logging.getLogger(__name__)
+
+
+def _load_payment(payment_id):
+    from payments.models import Payment
+
+    payment = (
+        Payment.objects
+        .select_related("user", "booking__service", "booking__slot", "booking__shop__owner", "booking_record")
+        .filter(id=payment_id)
+        .first()
+    )
+    if payment is None:
+        logger.warning("Payment %s no longer exists; side effect dropped", payment_id)
+    return payment
+
+
+def close_autofill_log(payment_id):
+    """Close the AutoFillLog loop if this payment's booking filled an offer."""
+    from api.models import AutoFillLog
+
+    payment = _load_payment(payment_id)
+    if payment is None:
+        return
+    slot_booking = payment.booking
+    shop = slot_booking.shop
+    booking_obj = getattr(payment, "booking_record", None)
+
+    ai_settings = getattr(shop, "ai_settings", None)
+    scope_hours = getattr(ai_settings, "auto_fill_scope_hours", 48) or 48
+    window_start = timezone.now() - timedelta(hours=scope_hours)
+    open_logs = AutoFillLog.objects.filter(
+        shop=shop,
+        status__in=("initiated", "outreach_started"),
+        created_at__gte=window_start,
+    )
+
+    # Prefer exact offered_slot match (SlotBooking.slot -> Slot)
+    log_to_close = (
+        open_logs.filter(offered_slot_id=slot_booking.slot_id).order_by("-created_at").first()
+        # Fallback: any open log for the same service in window
+        or open_logs.filter(original_booking__slot__service_id=slot_booking.service_id).order_by("-created_at").first()
+    )
+    if not log_to_close:
+        logger.info(
+            "[AutoFillClose] no open log for shop_id=%s slot_id=%s payment_id=%s",
+            shop.id, slot_booking.slot_id, payment.id,
+        )
+        return
+
+    fields = ["filled_by_booking", "status"]
+    log_to_close.filled_by_booking = booking_obj
+    log_to_close.status = "completed"
+    recovered = getattr(payment, "amount", 0) or 0
+    if recovered:
+        log_to_close.revenue_recovered = recovered
+        fields.append("revenue_recovered")
+    log_to_close.save(update_fields=fields)
+    logger.info(
+        "[AutoFillClose] ✅ COMPLETED log_id=%s recovered=%.2f via booking_id=%s",
+        log_to_close.id, float(recovered), getattr(booking_obj, "id", None)
+    )
+
+
+def send_booking_notifications(payment_id):
+    """Email and push the shop owner, SMS the client and the owner (new booking)."""
+    payment = _load_payment(payment_id)
+    if payment is None:
+        return
+    slot_booking = payment.booking
+    shop = slot_booking.shop
+    user = payment.user
+
+    # Friendly time strings
+    start_dt_local = timezone.localtime(slot_booking.start_time)
+    end_dt_local = timezone.localtime(slot_booking.end_time)
+    start_time_str = start_dt_local.strftime("%A, %d %B %Y at %I:%M %p")
+    end_time_str = end_dt_local.strftime("%I:%M %p")
+
+    shop_name = shop.name
+    service_title = slot_booking.service.title
+    customer_name = getattr(user, "name", None) or getattr(user, "email", "")
+
+    # Email the shop owner (if present)
+    owner = getattr(shop, "owner", None)
+    owner_email = getattr(owner, "email", None)
+    if owner_email:
+        owner_message = (
+            f"Hello {getattr(owner, 'name', '') or 'Shop Owner'},\n\n"
+            f"A new appointment has been booked.\n\n"
+            f"👤 Customer: {customer_name}\n"
+            f"🏬 Shop: {shop_name}\n"
+            f"💆 Service: {service_title}\n"
+            f"🗓 Date & Time: {start_time_str} – {end_time_str}\n\n"
+            f"Please prepare accordingly."
+        )
+        try:
+            send_mail("New Appointment Booked", owner_message, settings.DEFAULT_FROM_EMAIL, [owner_email])
+        except Exception:
+            logger.exception("Failed to email shop owner %s", getattr(owner, "id", "unknown"))
+
+    # Push to owner
+    try:
+        if owner:
+            notify_user(
+                owner,
+                message=f"New appointment from {customer_name} for {service_title} on {start_time_str}.",
+                notification_type="booking",
+                data={
+                    "shop_id": shop.id,
+                    "booking_id": slot_booking.id,
+                    "service": service_title,
+                    "start_time": str(slot_booking.start_time),
+                    "end_time": str(slot_booking.end_time),
+                },
+                debug=True
+            )
+    except Exception:
+        logger.exception("Failed to push to shop owner %s", getattr(owner, "id", "unknown"))
+
+    # SMS to client
+    client_phone = get_user_phone(user)
+    if client_phone:
+        try:
+            send_sms(
+                client_phone,
+                f"Fidden Booking Confirmed: {service_title} at {shop_name} on {start_time_str}. See you there!"
+            )
+        except Exception:
+            logger.exception("Cannot send booking confirmation SMS to client %s", getattr(user, "id", None))
+    else:
+        logger.info("Client %s has no phone; skipping confirmation SMS.", getattr(user, "id", None))
+
+    # SMS to owner
+    owner_phone = get_user_phone(owner) if owner else None
+    if owner_phone:
+        try:
+            send_sms(
+                owner_phone,
+                f"Fidden New Booking: {customer_name} booked {service_title} for {start_time_str}."
+            )
+        except Exception:
+            logger.exception("Cannot send new booking SMS to owner %s", getattr(owner, "id", None))
+    else:
+        logger.info("Owner has no phone; skipping owner SMS.")
+
+
+def refund_unbookable_payment(payment_id):
+    """
+    Refund a payment that succeeded after its booking was cancelled and the
+    slot could not be taken back (handle_payment_status queues this).
+    """
+    from api.models import SlotBooking
+    from payments.models import Refund
+
+    payment = _load_payment(payment_id)
+    if payment is None or hasattr(payment, "refund"):
+        return
+    slot_booking = payment.booking
+    if slot_booking.status != "cancelled" or hasattr(payment, "booking_record"):
+        logger.info("Payment %s was placed after all; no refund", payment.id)
+        return
+
+    reason = "slot_unavailable"
+    if payment.payment_method == "paypal":
+        from payments.utils.paypal_refund import process_paypal_refund
+        result = process_paypal_refund(payment.paypal_capture_id, float(payment.amount), reason)
+        if not result.get("success"):
+            # Raising lets the outbox retry with backoff
+            raise RuntimeError(f"PayPal refund failed: {result.get('error', 'Unknown error')}")
+        Refund.objects.create(
+            payment=payment,
+            paypal_refund_id=result.get("refund_id"),
+            amount=payment.amount,
+            status="succeeded",
+            reason=reason,
+        )
+    else:
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        refund = stripe.Refund.create(
+            payment_intent=payment.stripe_payment_intent_id,
+            reason="requested_by_customer",
+            idempotency_key=f"refund_unbookable_{payment.id}",
+        )
+        Refund.objects.create(
+            payment=payment,
+            stripe_refund_id=refund.id,
+            amount=payment.amount,
+            status=refund.status if refund.status in ("pending", "succeeded", "failed") else "pending",
+            reason=reason,
+        )
+
+    SlotBooking.objects.filter(id=slot_booking.id).update(payment_status="refund")
+    payment.status = "refunded"
+    payment.save(update_fields=["status", "updated_at"])
+    logger.info("Refunded payment %s: booking %s could not be placed", payment.id, slot_booking.id)
+
+    try:
+        notify_user(
+            payment.user,
+            message=(
+                f"Your {slot_booking.service.title} slot was no longer available, "
+                f"so your payment has been refunded."
+            ),
+            notification_type="booking",
+            data={"booking_id": slot_booking.id, "shop_id": slot_booking.shop_id},
+        )
+    except Exception:
+        logger.exception("Failed to notify user %s of refund for payment %s", payment.user_id, payment.id)
@@ -0,0 +1,103 @@
+# payments/utils/reminders.py
+"""
+Booking reminders, scheduled once and dispatched by due time.
+
+`schedule_booking_reminders` writes one BookingReminder row per offset when a
+Booking is created. `dispatch_due_reminders` (beat task, every minute) claims
+only pending rows whose due_at has passed, so a tick costs O(due reminders)
+instead of scanning every active booking.
+
+Claiming flips status before anything is sent (at-most-once), and rows locked
+by another worker are skipped. Reminders missed while beat was down are still
+pending and go out on the next tick, as long as the appointment has not
+started; when several are due for the same booking only the latest one is
+sent and the older ones are skipped.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+REMINDER_OFFSETS = (
+    ("1_day", timedelta(days=1)),
+    ("1_hour", timedelta(hours=1)),
+    ("15_minutes", timedelta(minutes=15)),
+)
+
+
+def reminder_rows(start_time, now):
+    """(kind, due_at) pairs still ahead of `now` for an appointment at `start_time`."""
+    return [
+        (kind, start_time - offset)
+        for kind, offset in REMINDER_OFFSETS
+        if start_time - offset > now
+    ]
+
+
+def schedule_booking_reminders(booking):
+    """Create the booking's future reminders (idempotent)."""
+    from payments.models import BookingReminder
+
+    now = timezone.now()
+    rows = [
+        BookingReminder(booking_id=booking.id, kind=kind, due_at=due_at)
+        for kind, due_at in reminder_rows(booking.slot.start_time, now)
+    ]
+    if rows:
+        BookingReminder.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+def dispatch_due_reminders(batch_size=500):
+    """Claim and send one batch of due reminders. Returns (sent, skipped)."""
+    from payments.models import BookingReminder
+    from payments.utils.helper_function import send_booking_reminder_email
+
+    now = timezone.now()
+    with transaction.atomic():
+        due = list(
+            BookingReminder.objects
+            .select_for_update(skip_locked=True, of=("self",))
+            .select_related("booking__slot__service", "booking__shop", "booking__user")
+            .filter(status=BookingReminder.STATUS_PENDING, due_at__lte=now)
+            .order_by("due_at")[:batch_size]
+        )
+        if not due:
+            return 0, 0
+
+        # Latest due reminder per still-upcoming active booking; the rest are stale
+        latest = {}
+        for reminder in due:
+            booking = reminder.booking
+            if booking.status != "active" or booking.slot.start_time <= now:
+                continue
+            current = latest.get(booking.id)
+            if current is None or reminder.due_at > current.due_at:
+                latest[booking.id] = reminder
+
+        to_send = list(latest.values())
+        send_ids = [r.id for r in to_send]
+        latest_ids = set(send_ids)
+        skip_ids = [r.id for r in due if r.id not in latest_ids]
+        if send_ids:
+            BookingReminder.objects.filter(id__in=send_ids).update(
+                status=BookingReminder.STATUS_SENT, sent_at=now
+            )
+        if skip_ids:
+            BookingReminder.objects.filter(id__in=skip_ids).update(
+                status=BookingReminder.STATUS_SKIPPED, sent_at=now
+            )
+
+    # Claimed and committed: send outside the transaction
+    for reminder in to_send:
+        try:
+            send_booking_reminder_email(reminder.booking, reminder.kind)
+        except Exception as e:
+            logger.error(
+                "Failed to send booking reminder for Booking %s (%s): %s",
+                reminder.booking_id, reminder.kind, e,
+            )
+    return len(to_send), len(skip_ids)
@@ -0,0 +1,215 @@
+# payments/utils/revenue.py
+"""
+Per-shop revenue and earnings buckets.
+
+Revenue (api.models.Revenue) has one row per shop per day. It is written by
+an atomic INSERT ... ON CONFLICT from the TransactionLog signal and carries a
+running total, so any date range costs two indexed lookups:
+total(end) - total(day before start).
+
+ShopEarningsDay holds the earnings report figures (succeeded payments) per
+shop and local day. Each Payment save recomputes that payment's day, so a
+day, week or month report sums at most 31 rows however many payments there
+are. `reconcile_revenue_rollups` (nightly) repairs anything a crash or a
+concurrent midnight write left behind.
+"""
+import logging
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum, Window
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal("0.00")
+
+EARNINGS_SUMS = {
+    "service_revenue": Sum("service_price"),
+    "tips_total": Sum("tips_amount"),
+    "commission_total": Sum("application_fee_amount"),
+    "deposit_credited": Sum("deposit_amount", filter=Q(deposit_status="credited")),
+    "deposit_forfeited": Sum("deposit_amount", filter=Q(deposit_status="forfeited")),
+}
+EARNINGS_COUNTS = {
+    "bookings_total": Count("id"),
+    "bookings_credited": Count("id", filter=Q(deposit_status="credited")),
+    "bookings_forfeited": Count("id", filter=Q(deposit_status="forfeited")),
+}
+
+
+# -----------------------------
+# Daily revenue (running totals)
+# -----------------------------
+def record_revenue(shop_id, day, delta):
+    """Add `delta` to the shop's revenue on `day` (single atomic upsert)."""
+    from api.models import Revenue
+
+    qn = connection.ops.quote_name
+    table = qn(Revenue._meta.db_table)
+    day_col = qn("timestamp")
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (shop_id, {day_col}, revenue, running_total) "
+                f"VALUES (%s, %s, %s, COALESCE(("
+                f"SELECT prev.running_total FROM {table} prev "
+                f"WHERE prev.shop_id = %s AND prev.{day_col} < %s "
+                f"ORDER BY prev.{day_col} DESC LIMIT 1), 0) + %s) "
+                f"ON CONFLICT (shop_id, {day_col}) DO UPDATE SET "
+                f"revenue = {table}.revenue + EXCLUDED.revenue, "
+                f"running_total = {table}.running_total + EXCLUDED.revenue",
+                [shop_id, day, delta, shop_id, day, delta],
+            )
+        # Back-dated entry (rare): later days include it in their running total
+        Revenue.objects.filter(shop_id=shop_id, timestamp__gt=day).update(
+            running_total=F("running_total") + delta
+        )
+
+
+def _running_total_at(shop_id, day):
+    """Running total at the end of `day` (the last row on or before it)."""
+    from api.models import Revenue
+
+    total = (
+        Revenue.objects
+        .filter(shop_id=shop_id, timestamp__lte=day)
+        .order_by("-timestamp")
+        .values_list("running_total", flat=True)
+        .first()
+    )
+    return total or ZERO
+
+
+def revenue_total(shop_id):
+    """All-time revenue of the shop."""
+    from api.models import Revenue
+
+    total = (
+        Revenue.objects
+        .filter(shop_id=shop_id)
+        .order_by("-timestamp")
+        .values_list("running_total", flat=True)
+        .first()
+    )
+    return total or ZERO
+
+
+def revenue_between(shop_id, start_date, end_date):
+    """Revenue of the shop from `start_date` to `end_date` inclusive."""
+    return _running_total_at(shop_id, end_date) - _running_total_at(shop_id, start_date - timedelta(days=1))
+
+
+def rebuild_running_totals(shop_ids=None, batch_size=1000):
+    """Recompute Revenue.running_total from the daily amounts. Returns rows fixed."""
+    from api.models import Revenue
+
+    rows = Revenue.objects.all()
+    if shop_ids is not None:
+        rows = rows.filter(shop_id__in=shop_ids)
+    rows = rows.annotate(
+        expected=Window(Sum("revenue"), partition_by=[F("shop_id")], order_by=[F("timestamp").asc()])
+    ).order_by()
+
+    stale = []
+    for row in rows.only("id", "running_total").iterator(chunk_size=batch_size):
+        if row.running_total != row.expected:
+            row.running_total = row.expected
+            stale.append(row)
+    Revenue.objects.bulk_update(stale, ["running_total"], batch_size=batch_size)
+    return len(stale)
+
+
+# -----------------------------
+# Earnings days
+# -----------------------------
+def _day_bounds(days):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(min(days), time.min), tz)
+    end = timezone.make_aware(datetime.combine(max(days) + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def rebuild_earnings_days(shop_id, days):
+    """Recompute the shop's ShopEarningsDay rows for `days` (upsert)."""
+    from payments.models import Payment, ShopEarningsDay
+
+    days = set(days)
+    if not days:
+        return 0
+    start, end = _day_bounds(days)
+    rows = {day: ShopEarningsDay(shop_id=shop_id, date=day) for day in days}
+    for r in (
+        Payment.objects
+        .filter(booking__shop_id=shop_id, status="succeeded", created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate("created_at"))
+        .values("day")
+        .annotate(**EARNINGS_SUMS, **EARNINGS_COUNTS)
+    ):
+        row = rows.get(r["day"])
+        if row is None:
+            continue
+        for field in EARNINGS_SUMS:
+            setattr(row, field, r[field] or ZERO)
+        for field in EARNINGS_COUNTS:
+            setattr(row, field, r[field])
+
+    ShopEarningsDay.objects.bulk_create(
+        rows.values(),
+        update_conflicts=True,
+        unique_fields=["shop", "date"],
+        update_fields=[*EARNINGS_SUMS, *EARNINGS_COUNTS, "computed_at"],
+    )
+    return len(rows)
+
+
+def refresh_earnings_for_payment(booking_id, created_at):
+    """Recompute the earnings day a payment belongs to (runs after commit)."""
+    from api.models import SlotBooking
+
+    try:
+        shop_id = SlotBooking.objects.filter(id=booking_id).values_list("shop_id", flat=True).first()
+        if shop_id:
+            rebuild_earnings_days(shop_id, [timezone.localdate(created_at)])
+    except Exception:
+        logger.exception("Failed to refresh earnings for SlotBooking %s", booking_id)
+
+
+def earnings_between(shop_id, start_date, end_date):
+    """Earnings report figures summed over the shop's days in [start_date, end_date]."""
+    from payments.models import ShopEarningsDay
+
+    totals = ShopEarningsDay.objects.filter(
+        shop_id=shop_id, date__gte=start_date, date__lte=end_date
+    ).aggregate(**{field: Sum(field) for field in (*EARNINGS_SUMS, *EARNINGS_COUNTS)})
+    return {
+        field: value if value is not None else (ZERO if field in EARNINGS_SUMS else 0)
+        for field, value in totals.items()
+    }
+
+
+def reconcile_revenue_rollups(since=None, full=False):
+    """
+    Repair running totals and recompute the earnings days of payments changed
+    since `since` (default: the last 25 hours; every payment with `full`).
+    Returns (totals fixed, days rebuilt).
+    """
+    from payments.models import Payment
+
+    fixed = rebuild_running_totals()
+
+    payments = Payment.objects.filter(status="succeeded", booking__isnull=False)
+    if not full:
+        since = since or timezone.now() - timedelta(hours=25)
+        # Any status: a payment that stopped being succeeded must leave its day too
+        payments = Payment.objects.filter(updated_at__gte=since, booking__isnull=False)
+
+    dirty = {}
+    for shop_id, created_at in payments.values_list("booking__shop_id", "created_at").iterator():
+        dirty.setdefault(shop_id, set()).add(timezone.localdate(created_at))
+
+    days = sum(rebuild_earnings_days(shop_id, shop_days) for shop_id, shop_days in dirty.items())
+    logger.info("[Revenue] Fixed %s running totals, rebuilt %s earnings days", fixed, days)
+    return fixed, days
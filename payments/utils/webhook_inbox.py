@@ -0,0 +1,192 @@
+# payments/utils/webhook_inbox.py
+"""
+Webhook inbox (payments.models.WebhookEvent).
+
+The webhook endpoints only verify the delivery, insert it and acknowledge.
+A delivery whose (provider, event_id) is already stored is acknowledged
+without doing anything, which covers provider retries.
+
+Processing is per provider object (a PaymentIntent, a subscription, ...):
+`process_object_events` takes the oldest pending event of that object,
+claims it with a lease, and runs the provider handler. An event waiting for
+a retry blocks the later events of the same object, so a
+`customer.subscription.updated` never overtakes the `created` before it.
+After WEBHOOK_MAX_ATTEMPTS an event is marked failed and the queue moves on.
+`drain_webhook_inbox` (beat, every minute) covers lost dispatches and due
+retries; `inbox_stats` reports backlog and lag.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, F, Max, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PROCESSORS = {
+    "stripe": "payments.utils.webhook_inbox.process_stripe_event",
+    "paypal": "payments.utils.webhook_inbox.process_paypal_event",
+}
+
+MAX_ATTEMPTS = getattr(settings, "WEBHOOK_MAX_ATTEMPTS", 8)
+LEASE_SECONDS = getattr(settings, "WEBHOOK_LEASE_SECONDS", 300)
+
+
+def process_stripe_event(payload):
+    import stripe
+    from payments.views import StripeWebhookView
+
+    StripeWebhookView().process_event(stripe.Event.construct_from(payload, stripe.api_key))
+
+
+def process_paypal_event(payload):
+    from payments.views import PayPalWebhookView
+
+    PayPalWebhookView().process_event(payload)
+
+
+def record_event(provider, event_id, event_type, object_id, payload, occurred_at=None):
+    """
+    Store a verified delivery and queue its object for processing after
+    commit. Returns the new WebhookEvent, or None for a redelivery.
+    """
+    from payments.models import WebhookEvent
+
+    try:
+        with transaction.atomic():
+            event = WebhookEvent.objects.create(
+                provider=provider,
+                event_id=event_id,
+                event_type=event_type or "",
+                object_id=object_id or "",
+                payload=payload,
+                occurred_at=occurred_at or timezone.now(),
+            )
+    except IntegrityError:
+        logger.info("Duplicate %s webhook %s acknowledged", provider, event_id)
+        return None
+
+    transaction.on_commit(lambda: _dispatch(event.provider, event.object_id))
+    return event
+
+
+def _dispatch(provider, object_id):
+    from payments.tasks import process_webhook_object
+
+    try:
+        process_webhook_object.delay(provider, object_id)
+    except Exception as e:
+        logger.warning("Webhook queue %s/%s not dispatched (%s); left for the drain task", provider, object_id, e)
+
+
+def _run(event):
+    """Claim and process one event. Returns True if it was processed."""
+    from payments.models import WebhookEvent
+
+    now = timezone.now()
+    claimed = WebhookEvent.objects.filter(
+        id=event.id, status=WebhookEvent.STATUS_PENDING, available_at__lte=now
+    ).update(available_at=now + timedelta(seconds=LEASE_SECONDS), attempts=F("attempts") + 1)
+    if not claimed:
+        return False
+    event.attempts += 1
+
+    try:
+        import_string(PROCESSORS[event.provider])(event.payload)
+    except Exception as e:
+        logger.exception("%s webhook %s (%s) failed on attempt %s", event.provider, event.event_id, event.event_type, event.attempts)
+        if event.attempts >= MAX_ATTEMPTS:
+            event.status = WebhookEvent.STATUS_FAILED
+            event.processed_at = timezone.now()
+        else:
+            # Exponential backoff capped at one hour
+            event.available_at = timezone.now() + timedelta(minutes=min(2 ** (event.attempts - 1), 60))
+        event.last_error = str(e)[:2000]
+        event.save(update_fields=["status", "processed_at", "available_at", "last_error"])
+        return False
+
+    event.status = WebhookEvent.STATUS_PROCESSED
+    event.processed_at = timezone.now()
+    event.last_error = ""
+    event.save(update_fields=["status", "processed_at", "last_error"])
+    return True
+
+
+def process_object_events(provider, object_id, limit=50):
+    """Process the object's pending events in order, stopping at the first one not ready."""
+    from payments.models import WebhookEvent
+
+    processed = 0
+    for _ in range(limit):
+        head = (
+            WebhookEvent.objects
+            .filter(provider=provider, object_id=object_id, status=WebhookEvent.STATUS_PENDING)
+            .order_by("occurred_at", "id")
+            .first()
+        )
+        # Leased by another worker, waiting for a retry, or failed just now
+        if head is None or head.available_at > timezone.now() or not _run(head):
+            break
+        processed += 1
+    return processed
+
+
+def drain_webhook_inbox(batch_size=100):
+    """Process the objects that have due pending events. Returns (events processed, objects visited)."""
+    from payments.models import WebhookEvent
+
+    objects = list(
+        WebhookEvent.objects
+        .filter(status=WebhookEvent.STATUS_PENDING, available_at__lte=timezone.now())
+        .values("provider", "object_id")
+        .annotate(oldest=Min("occurred_at"))
+        .order_by("oldest")
+        .values_list("provider", "object_id")[:batch_size]
+    )
+    processed = sum(process_object_events(provider, object_id) for provider, object_id in objects)
+    return processed, len(objects)
+
+
+def inbox_stats(hours=1):
+    """Backlog and processing lag per provider over the last `hours`."""
+    from payments.models import WebhookEvent
+
+    now = timezone.now()
+    since = now - timedelta(hours=hours)
+    stats = {}
+    rows = (
+        WebhookEvent.objects
+        .filter(Q(status=WebhookEvent.STATUS_PENDING) | Q(received_at__gte=since))
+        .values("provider")
+        .annotate(
+            pending=Count("id", filter=Q(status=WebhookEvent.STATUS_PENDING)),
+            oldest_pending=Min("received_at", filter=Q(status=WebhookEvent.STATUS_PENDING)),
+            processed=Count("id", filter=Q(status=WebhookEvent.STATUS_PROCESSED, received_at__gte=since)),
+            failed=Count("id", filter=Q(status=WebhookEvent.STATUS_FAILED, received_at__gte=since)),
+            avg_lag=Avg(
+                F("processed_at") - F("received_at"),
+                filter=Q(status=WebhookEvent.STATUS_PROCESSED, received_at__gte=since),
+            ),
+            max_lag=Max(
+                F("processed_at") - F("received_at"),
+                filter=Q(status=WebhookEvent.STATUS_PROCESSED, received_at__gte=since),
+            ),
+        )
+    )
+    def seconds(delta):
+        return round(delta.total_seconds(), 3) if delta is not None else None
+
+    for r in rows:
+        stats[r["provider"]] = {
+            "pending": r["pending"],
+            "processed": r["processed"],
+            "failed": r["failed"],
+            "oldest_pending_seconds": seconds(now - r["oldest_pending"]) if r["oldest_pending"] else None,
+            "avg_lag_seconds": seconds(r["avg_lag"]),
+            "max_lag_seconds": seconds(r["max_lag"]),
+        }
+    stats["window_hours"] = hours
+    return stats
@@ -14,20 +14,25 @@ from api.utils.zapier import send_klaviyo_event
 import logging
 from decimal import Decimal
 import json
+import hashlib
 from datetime import timedelta, datetime
 from django.utils.timezone import now
+from django.utils.dateparse import parse_datetime
 from django.conf import settings
 from rest_framework.exceptions import ValidationError
 from api.models import Shop, Coupon
 from api.serializers import SlotBookingSerializer, CouponSerializer
 from accounts.models import User
 from api.utils.slots import assert_slot_bookable
+from api.utils.holds import active_hold_for, add_ons_to_hold, extend_hold
 from payments.utils.emitters import emit_subscription_updated_to_zapier
 from .models import Payment, UserStripeCustomer, Booking, TransactionLog, CouponUsage, can_use_coupon
 from subscriptions.models import SubscriptionPlan, ShopSubscription
 from .serializers import userBookingSerializer, ownerBookingSerializer, TransactionLogSerializer, ApplyCouponSerializer
 from .pagination import BookingCursorPagination, TransactionCursorPagination
 from .utils.helper_function import extract_validation_error_message
+from .utils.revenue import earnings_between
+from .utils.webhook_inbox import record_event as record_webhook_event
 from django.http import HttpResponse, HttpResponseRedirect
 from urllib.parse import urlencode, urljoin
 # views.py
@@ -176,6 +181,9 @@ def _update_shop_from_subscription_obj(sub_obj, shop_hint=None):
         ss.end_date   = timezone.now() + dt.timedelta(days=30)
     ss.status = "active" if sub.get("status") == "active" else sub.get("status")
     ss.stripe_subscription_id = sub_id
+    # Mirror for SubscriptionDetailsView (no live Stripe reads there)
+    ss.cancel_at_period_end = bool(sub.get("cancel_at_period_end"))
+    ss.stripe_synced_at = timezone.now()
     ss.save()
 
     emit_subscription_updated_to_zapier(
@@ -232,26 +240,38 @@ class CreatePaymentIntentView(APIView):
                 if not slot:
                     return Response({"detail": "Slot not found."}, status=status.HTTP_404_NOT_FOUND)
 
-                # hard guard (future, capacity, disabled times, etc.)
-                try:
-                    assert_slot_bookable(slot)
-                except ValidationError as e:
-                    return Response(
-                        {"detail": str(e.detail[0] if isinstance(e.detail, list) else e.detail)},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+                # A claimed auto-fill offer already holds capacity for this user:
+                # pay for that pending booking instead of taking another unit
+                hold = active_hold_for(user, slot)
+                if hold:
+                    try:
+                        booking = add_ons_to_hold(hold, request.data.get("add_on_ids"))
+                    except ValidationError as e:
+                        return Response(
+                            {"detail": extract_validation_error_message(e)},
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
+                else:
+                    # hard guard (future, capacity, disabled times, etc.)
+                    try:
+                        assert_slot_bookable(slot)
+                    except ValidationError as e:
+                        return Response(
+                            {"detail": str(e.detail[0] if isinstance(e.detail, list) else e.detail)},
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
 
-                # create the booking while the slot is locked
-                data = {"slot_id": slot_id}
-                if "add_on_ids" in request.data:
-                    data["add_on_ids"] = request.data["add_on_ids"]
+                    # create the booking while the slot is locked
+                    data = {"slot_id": slot_id}
+                    if "add_on_ids" in request.data:
+                        data["add_on_ids"] = request.data["add_on_ids"]
 
-                serializer = SlotBookingSerializer(
-                    data=data,
-                    context={"request": request},
-                )
-                serializer.is_valid(raise_exception=True)
-                booking = serializer.save()
+                    serializer = SlotBookingSerializer(
+                        data=data,
+                        context={"request": request},
+                    )
+                    serializer.is_valid(raise_exception=True)
+                    booking = serializer.save()
         except DatabaseError as e:
             logger.exception("DB error while locking/booking slot %s: %s", slot_id, e)
             return Response({"detail": "Could not reserve this slot. Please try another time."},
@@ -276,9 +296,9 @@ class CreatePaymentIntentView(APIView):
                 )
 
             # 5) Resolve a plan for commission (do NOT gate booking)
-            shop_subscription = getattr(shop, "subscription", None)
-            plan = getattr(shop_subscription, "plan", None)
-            if not plan:
+            entitlements = shop.entitlements
+            plan_name, plan_commission = entitlements.plan_name, entitlements.commission_rate
+            if not entitlements.plan_id:
                 try:
                     plan = (
                         SubscriptionPlan.objects.filter(name=SubscriptionPlan.FOUNDATION).first()
@@ -286,7 +306,9 @@ class CreatePaymentIntentView(APIView):
                     )
                 except Exception:
                     plan = None
-                if not shop_subscription and plan:
+                if plan:
+                    plan_name, plan_commission = plan.name, plan.commission_rate
+                if not entitlements.has_subscription and plan:
                     ShopSubscription.objects.update_or_create(
                         shop=shop,
                         defaults={
@@ -297,7 +319,6 @@ class CreatePaymentIntentView(APIView):
                             "stripe_subscription_id": None,
                         },
                     )
-                    shop_subscription = getattr(shop, "subscription", None)
 
             # 6) Price (consider discount price), then deposit logic
             total_amount = (
@@ -354,7 +375,7 @@ class CreatePaymentIntentView(APIView):
 
             # 8) Compute application fee (commission)
             try:
-                commission_rate = float(plan.commission_rate) if plan and plan.commission_rate is not None else 0.0
+                commission_rate = float(plan_commission) if plan_commission is not None else 0.0
             except Exception:
                 commission_rate = 0.0
             application_fee_cents = 0
@@ -404,6 +425,8 @@ class CreatePaymentIntentView(APIView):
                         "tip_base": full_service_amount,  # Tip calculated on full service price
                     },
                 )
+                # A held booking keeps its unit while the payment sheet / 3DS runs
+                extend_hold(booking.id)
 
             # 11) Ephemeral key for mobile SDKs
             ephemeral_key = stripe.EphemeralKey.create(
@@ -419,7 +442,7 @@ class CreatePaymentIntentView(APIView):
                     "ephemeral_key": ephemeral_key.secret,
                     "customer_id": user_customer.stripe_customer_id,
                     "coupon_applied": bool(coupon),
-                    "shop_plan": getattr(plan, "name", None),
+                    "shop_plan": plan_name,
                     "application_fee_cents": application_fee_cents,
                 },
                 status=status.HTTP_200_OK,
@@ -734,14 +757,12 @@ class ShopEarningsReportView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, shop_id):
-        from django.db.models import Sum, Count, Q
-        
         try:
             shop = get_object_or_404(Shop, id=shop_id, owner=request.user)
             
             # Get period filter (default: this month)
             period = request.query_params.get('period', 'month')  # day, week, month
-            now = timezone.now()
+            now = timezone.localtime()
             
             if period == 'day':
                 start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -751,37 +772,24 @@ class ShopEarningsReportView(APIView):
             else:  # month
                 start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
             
-            # Get completed bookings for this shop in period
-            payments = Payment.objects.filter(
-                booking__shop=shop,
-                status='succeeded',
-                created_at__gte=start_date
-            )
-            
-            # Aggregate earnings
-            totals = payments.aggregate(
-                service_revenue=Sum('service_price'),
-                tips_total=Sum('tips_amount'),
-                commission_total=Sum('application_fee_amount'),
-                deposit_credited=Sum('deposit_amount', filter=Q(deposit_status='credited')),
-                deposit_forfeited=Sum('deposit_amount', filter=Q(deposit_status='forfeited')),
-            )
+            # Aggregate earnings from the shop's daily buckets (succeeded payments)
+            totals = earnings_between(shop.id, start_date.date(), now.date())
             
-            service_revenue = float(totals['service_revenue'] or 0)
-            tips_total = float(totals['tips_total'] or 0)
-            commission_total = float(totals['commission_total'] or 0)
-            deposit_credited = float(totals['deposit_credited'] or 0)
-            deposit_forfeited = float(totals['deposit_forfeited'] or 0)
+            service_revenue = float(totals['service_revenue'])
+            tips_total = float(totals['tips_total'])
+            commission_total = float(totals['commission_total'])
+            deposit_credited = float(totals['deposit_credited'])
+            deposit_forfeited = float(totals['deposit_forfeited'])
             
             # Net payout = service revenue + tips - commission
             net_payout = service_revenue + tips_total - commission_total
             
             # Count bookings
-            booking_counts = payments.aggregate(
-                total_bookings=Count('id'),
-                completed=Count('id', filter=Q(deposit_status='credited')),
-                forfeited=Count('id', filter=Q(deposit_status='forfeited')),
-            )
+            booking_counts = {
+                'total_bookings': totals['bookings_total'],
+                'completed': totals['bookings_credited'],
+                'forfeited': totals['bookings_forfeited'],
+            }
             
             return Response({
                 "shop_id": shop.id,
@@ -1098,19 +1106,15 @@ class StripeWebhookView(APIView):
         return False
 
     def post(self, request, *args, **kwargs):
+        """Verify, store in the webhook inbox and acknowledge; a worker processes it."""
         payload = request.body
         sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
-        logger.info("=" * 80)
-        logger.info("🔔 WEBHOOK RECEIVED at %s", timezone.now())
-        logger.info("Signature present: %s", bool(sig_header))
-        logger.info("=" * 80)
 
         # 1️⃣ Verify and parse event
         try:
             event = stripe.Webhook.construct_event(
                 payload, sig_header, settings.STRIPE_ENDPOINT_SECRET
             )
-            logger.info("Webhook signature verified")
         except ValueError as e:
             logger.error("❌ Invalid payload: %s", str(e))
             return Response({"error": "Invalid payload"}, status=400)
@@ -1118,25 +1122,31 @@ class StripeWebhookView(APIView):
             logger.error("❌ Invalid signature: %s", str(e))
             return Response({"error": "Invalid signature"}, status=400)
 
+        # 2️⃣ Store (redeliveries are no-ops) and ack. Invoice and checkout
+        # events queue behind the events of their subscription.
+        obj = event["data"]["object"]
+        created = event.get("created")
+        record_webhook_event(
+            "stripe",
+            event["id"],
+            event["type"],
+            obj.get("subscription") or obj.get("id"),
+            json.loads(payload),
+            occurred_at=datetime.fromtimestamp(created, tz=dt.timezone.utc) if created else None,
+        )
+        return Response(status=200)
+
+    def process_event(self, event):
+        """Apply one stored Stripe event (run by payments.tasks.process_webhook_object)."""
         event_type = event["type"]
         event_id = event.get("id")
         data = event["data"]["object"]
 
-        # ⚠️ TEMPORARILY DISABLED: Cache-based dedupe is blocking all events
-        # TODO: Investigate why cache.get() returns True for new events
-        # burst_key = f"stripe_evt:{event_id}"
-        # if cache.get(burst_key):
-        #     logger.info("⚠️ Duplicate Stripe event %s suppressed (already processed)", event_id)
-        #     return Response(status=200)
-        # cache.set(burst_key, True, timeout=60)
-        
-        logger.info("📨 Processing event: %s (id=%s)", event_type, event_id)
-
         logger.info(
             "📨 Event: %s (livemode=%s, id=%s)",
             event_type,
             bool(event.get("livemode")),
-            event.get("id")
+            event_id
         )
 
         # ------------------------------------------------------------------
@@ -1145,38 +1155,38 @@ class StripeWebhookView(APIView):
         # Subscription created or updated
         if event_type in ("customer.subscription.created", "customer.subscription.updated"):
             self.handle_subscription_created_or_updated(data)
-            return Response(status=200)
+            return
 
         # Payment succeeded
         elif event_type == "payment_intent.succeeded":
             self._update_payment_status(data, "succeeded")
-            return Response(status=200)
+            return
 
         # Handle AI add-on and other events
         elif event_type == "checkout.session.completed":
             self.handle_checkout_session_completed(data)
-            return Response(status=200)
+            return
         elif event_type == "payment_intent.payment_failed":
             self._update_payment_status(data, "failed")
-            return Response(status=200)
+            return
         elif event_type == "payment_intent.canceled":
             self._update_payment_status(data, "cancelled")
-            return Response(status=200)
+            return
         
         # Ignore charge events; they are redundant with payment_intent events
         elif event_type == "charge.succeeded":
             logger.info("Ignoring charge.succeeded, handled by payment_intent.succeeded")
-            return Response(status=200)
+            return
         elif event_type == "charge.failed":
             logger.info("Ignoring charge.failed, handled by payment_intent.failed")
-            return Response(status=200)
+            return
 
         # ------------------------------------------------------------------
         # Transfer events (Connect payouts etc.)
         # ------------------------------------------------------------------
         if event_type.startswith("transfer."):
             logger.info("Transfer event: %s %s", event_type, data.get("id"))
-            return Response(status=200)
+            return
 
         # ------------------------------------------------------------------
         # checkout.session.completed
@@ -1381,7 +1391,7 @@ class StripeWebhookView(APIView):
                                 "(invoice.*) AI add-on active for shop %s",
                                 shop.id,
                             )
-                        return Response(status=200)
+                        return
 
                     # normal plan invoice paid
                     _update_shop_from_subscription_obj(sub)
@@ -1389,7 +1399,7 @@ class StripeWebhookView(APIView):
                     logger.exception(
                         "invoice handler failed for %s: %s", sub_id, e
                     )
-            return Response(status=200)
+            return
 
         # ------------------------------------------------------------------
         # customer.subscription.deleted
@@ -1441,9 +1451,9 @@ class StripeWebhookView(APIView):
                     try:
                         # 1. Update the database flags
                         ss.has_ai_addon = False
-                        ss.ai_subscription_id = None
+                        ss.ai_stripe_subscription_id = None
                         ss.ai_subscription_item_id = None
-                        ss.save(update_fields=["has_ai_addon", "ai_subscription_id", "ai_subscription_item_id"])
+                        ss.save(update_fields=["has_ai_addon", "ai_stripe_subscription_id", "ai_subscription_item_id"])
 
                         # 2. Send Klaviyo "AI Addon Canceled" event
                         owner = ss.shop.owner
@@ -1477,7 +1487,7 @@ class StripeWebhookView(APIView):
                     except Exception as e:
                         logger.error("[klaviyo] AI cancel sync failed: %s", e, exc_info=True)
                 
-                return Response(status=200)
+                return
 
             else:
                 # --- BASE SUBSCRIPTION WAS CANCELLED ---
@@ -1495,6 +1505,7 @@ class StripeWebhookView(APIView):
                         shop_sub.status = ShopSubscription.STATUS_ACTIVE
                         shop_sub.stripe_subscription_id = None # NOW we clear the ID
                         shop_sub.end_date = timezone.now() + relativedelta(years=100)
+                        shop_sub.cancel_at_period_end = False
                         shop_sub.save()
 
                         # 2. Get owner email
@@ -1539,14 +1550,14 @@ class StripeWebhookView(APIView):
                 except Exception as e:
                     logger.error("[klaviyo] Base plan cancel sync failed: %s", e, exc_info=True)
 
-                return Response(status=200)
+                return
         
         
         # ------------------------------------------------------------------
         # Fallback
         # ------------------------------------------------------------------
         logger.warning("⚠️ Unhandled event: %s", event_type)
-        return Response(status=200)
+        return
     
     
     def handle_subscription_created_or_updated(self, sub):
@@ -1599,7 +1610,7 @@ class StripeWebhookView(APIView):
 
             # ---------- Mark AI add-on active ----------
             ss.has_ai_addon = True
-            ss.ai_subscription_id = sub.get("id")
+            ss.ai_stripe_subscription_id = sub.get("id")
 
             ai_item = next(
                 (
@@ -1619,7 +1630,7 @@ class StripeWebhookView(APIView):
             ss.save(
                 update_fields=[
                     "has_ai_addon",
-                    "ai_subscription_id",
+                    "ai_stripe_subscription_id",
                     "ai_subscription_item_id",
                     "legacy_ai_promo_used",
                 ]
@@ -1690,7 +1701,7 @@ class StripeWebhookView(APIView):
         profile_payload = build_profile_payload_for_shop(
             shop=shop,
             shop_sub=ss,
-            stripe_subscription_id=ss.ai_subscription_id,
+            stripe_subscription_id=ss.ai_stripe_subscription_id,
             price_id=None,
             cancel_at_period_end=False,
             is_canceled=False,
@@ -2206,7 +2217,7 @@ class MarkBookingNoShowView(APIView):
 
         # Update the status to 'no-show'
         booking.status = 'no-show'
-        booking.save(update_fields=['status'])
+        booking.save(update_fields=['status', 'updated_at'])
         
         logger.info(f"Booking {booking_id} was marked as 'no-show' by owner {request.user.email}.")
         
@@ -2267,11 +2278,18 @@ class CreatePayPalOrderView(APIView):
                 slot = Slot.objects.select_for_update().select_related("service", "service__shop").filter(id=slot_id).first()
                 if not slot:
                     return Response({"detail": "Slot not found."}, status=404)
-                assert_slot_bookable(slot)
+                # Same as the Stripe branch: a held booking is paid for, not rebooked
+                hold = active_hold_for(user, slot)
+                if hold:
+                    booking = hold.slot_booking
+                else:
+                    assert_slot_bookable(slot)
 
-                serializer = SlotBookingSerializer(data={"slot_id": slot_id}, context={"request": request})
-                serializer.is_valid(raise_exception=True)
-                booking = serializer.save()
+                    serializer = SlotBookingSerializer(data={"slot_id": slot_id}, context={"request": request})
+                    serializer.is_valid(raise_exception=True)
+                    booking = serializer.save()
+                # Keep the unit while the buyer is on the PayPal approval page
+                extend_hold(booking.id)
         except Exception as e:
             return Response({"detail": str(e)}, status=409)
 
@@ -2447,7 +2465,22 @@ class PayPalWebhookView(APIView):
     permission_classes = []      # you can enforce IP verification or webhook signature later
 
     def post(self, request, *args, **kwargs):
+        """Store in the webhook inbox and acknowledge; a worker processes it."""
         event = request.data
+        resource = event.get("resource") or {}
+        record_webhook_event(
+            "paypal",
+            event.get("id") or hashlib.sha256(json.dumps(event, sort_keys=True, default=str).encode()).hexdigest(),
+            event.get("event_type"),
+            # Sale events queue behind their subscription's events
+            resource.get("billing_agreement_id") or resource.get("id"),
+            event,
+            occurred_at=parse_datetime(event.get("create_time") or ""),
+        )
+        return Response(status=status.HTTP_200_OK)
+
+    def process_event(self, event):
+        """Apply one stored PayPal event (run by payments.tasks.process_webhook_object)."""
         event_type = event.get("event_type")
         resource = event.get("resource") or {}
 
@@ -2457,7 +2490,7 @@ class PayPalWebhookView(APIView):
         subscription_id = resource.get("id") or resource.get("billing_agreement_id")
 
         if not subscription_id:
-            return Response(status=status.HTTP_200_OK)  # Nothing to do
+            return  # Nothing to do
 
         if event_type == "BILLING.SUBSCRIPTION.ACTIVATED":
             self._handle_subscription_activated(subscription_id, resource)
@@ -2470,8 +2503,6 @@ class PayPalWebhookView(APIView):
         elif event_type == "BILLING.SUBSCRIPTION.SUSPENDED":
             self._handle_subscription_suspended(subscription_id, resource)
 
-        return Response(status=status.HTTP_200_OK)
-
     def _handle_subscription_activated(self, subscription_id, resource):
         try:
             sub = ShopSubscription.objects.get(paypal_subscription_id=subscription_id)
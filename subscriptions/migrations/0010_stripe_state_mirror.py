@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 22:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0009_remove_shopsubscription_ai_subscription_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopsubscription',
+            name='cancel_at_period_end',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='shopsubscription',
+            name='stripe_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -2,7 +2,7 @@
 
 from django.db import models
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
@@ -151,6 +151,10 @@ class ShopSubscription(models.Model):
     # NEW
     ai_paypal_subscription_id = models.CharField(max_length=255, blank=True, null=True)
     ai_subscription_item_id = models.CharField(max_length=100, blank=True, null=True)
+    # Mirrored from Stripe by the webhook pipeline and the reconciliation job
+    # (subscriptions.utils.stripe_state); status/end_date hold the rest
+    cancel_at_period_end = models.BooleanField(default=False)
+    stripe_synced_at = models.DateTimeField(null=True, blank=True)
 
     @property
     def ai_enabled(self):
@@ -186,6 +190,25 @@ class ShopSubscription(models.Model):
         return self.plan.priority_boost if self.plan else 0
 
 
+@receiver(post_save, sender=ShopSubscription)
+@receiver(post_delete, sender=ShopSubscription)
+def invalidate_shop_entitlements(sender, instance, **kwargs):
+    from subscriptions.utils.entitlements import forget_entitlements, invalidate_entitlements
+
+    invalidate_entitlements([instance.shop_id])
+    shop = instance._state.fields_cache.get("shop")
+    if shop is not None:
+        forget_entitlements(shop)
+
+
+@receiver(post_save, sender=SubscriptionPlan)
+def invalidate_plan_entitlements(sender, instance, created, **kwargs):
+    if not created:
+        from subscriptions.utils.entitlements import invalidate_plan_entitlements as invalidate
+
+        invalidate(instance.id)
+
+
 # Signal to create a default (Foundation) subscription for a new shop
 @receiver(post_save, sender='api.Shop')
 def create_default_subscription_for_new_shop(sender, instance, created, **kwargs):
@@ -227,3 +250,11 @@ def apply_defaults_on_subscription_change(sender, instance, created, **kwargs):
     """
     if instance.shop:
         instance.shop.apply_plan_defaults(overwrite=False)
+
+
+@receiver(post_save, sender=ShopSubscription)
+def invalidate_subscription_details_cache(sender, instance, **kwargs):
+    """SubscriptionDetailsView caches its payload; drop it on any change."""
+    from subscriptions.utils.stripe_state import invalidate_subscription_details
+
+    invalidate_subscription_details(instance.shop_id)
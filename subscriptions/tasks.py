@@ -0,0 +1,20 @@
+# subscriptions/tasks.py
+
+from celery import shared_task
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, name="subscriptions.tasks.reconcile_stripe_subscriptions", max_retries=3, default_retry_delay=60)
+def reconcile_stripe_subscriptions(self, batch_size=100):
+    """Re-sync ShopSubscriptions whose Stripe mirror has gone stale (missed webhooks)."""
+    from subscriptions.utils.stripe_state import reconcile_stale_subscriptions
+
+    try:
+        synced, failed = reconcile_stale_subscriptions(batch_size=batch_size)
+    except Exception as e:
+        logger.error("Error in reconcile_stripe_subscriptions task: %s\n%s", str(e), traceback.format_exc())
+        raise self.retry(exc=e)
+    return f"{synced} subscriptions reconciled with Stripe, {failed} failed."
@@ -0,0 +1,163 @@
+# subscriptions/utils/entitlements.py
+"""
+Plan entitlements of a shop, resolved in one place.
+
+`get_entitlements(shop)` returns a frozen `Entitlements` built from the
+shop's ShopSubscription and SubscriptionPlan (one query on a miss). It is
+memoized on the shop instance, so a request that reuses `request.user.shop`
+resolves it once, and cached for ENTITLEMENTS_CACHE_SECONDS; the receivers
+in subscriptions.models drop the cache on ShopSubscription and
+SubscriptionPlan saves. `is_active` is evaluated on read, so an expiring
+period never outlives its end_date in the cache.
+"""
+import logging
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = getattr(settings, "ENTITLEMENTS_CACHE_SECONDS", 300)
+_MEMO_ATTR = "_entitlements"
+
+PLAN_FEATURES = (
+    "deposit_customization",
+    "priority_marketplace_ranking",
+    "advanced_calendar_tools",
+    "auto_followups",
+    "ai_assistant",
+    "performance_analytics",
+    "ghost_client_reengagement",
+)
+# Features for inactive/no subscription (most restrictive)
+DEFAULT_FEATURES = {
+    "deposit_customization": "default",
+    "priority_marketplace_ranking": False,
+    "advanced_calendar_tools": False,
+    "auto_followups": False,
+    "ai_assistant": "addon",
+    "performance_analytics": "none",
+    "ghost_client_reengagement": False,
+}
+
+
+@dataclass(frozen=True)
+class Entitlements:
+    shop_id: int
+    has_subscription: bool = False
+    status: str = ""
+    end_date: object = None
+    has_ai_addon: bool = False
+    plan_id: int = None
+    plan_name: str = None
+    commission_rate: Decimal = None
+    priority_boost: int = 0
+    # Plan feature values, in PLAN_FEATURES order (empty without a plan)
+    plan_features: tuple = ()
+
+    @property
+    def is_active(self):
+        from subscriptions.models import ShopSubscription
+
+        return (
+            self.status == ShopSubscription.STATUS_ACTIVE
+            and self.end_date is not None
+            and self.end_date > timezone.now()
+        )
+
+    @property
+    def active_plan_name(self):
+        """Plan that gates features: the plan while active, else Foundation."""
+        from subscriptions.models import SubscriptionPlan
+
+        if self.is_active and self.plan_name:
+            return self.plan_name
+        return SubscriptionPlan.FOUNDATION
+
+    @property
+    def features(self):
+        if self.is_active and self.plan_features:
+            return dict(zip(PLAN_FEATURES, self.plan_features))
+        return dict(DEFAULT_FEATURES)
+
+    @property
+    def ranking_power(self):
+        return self.priority_boost if self.is_active else 0
+
+    @property
+    def ai_enabled(self):
+        """AI Assistant included in the plan or bought as an add-on."""
+        from subscriptions.models import SubscriptionPlan
+
+        if self.plan_id is None:
+            return False
+        included = dict(zip(PLAN_FEATURES, self.plan_features)).get("ai_assistant") == SubscriptionPlan.AI_INCLUDED
+        return included or self.has_ai_addon
+
+
+def cache_key(shop_id):
+    return f"entitlements_v1_{shop_id}"
+
+
+def invalidate_entitlements(shop_ids):
+    cache.delete_many([cache_key(shop_id) for shop_id in shop_ids])
+
+
+def invalidate_plan_entitlements(plan_id):
+    """Drop the cached entitlements of every shop on `plan_id`."""
+    from subscriptions.models import ShopSubscription
+
+    shop_ids = list(ShopSubscription.objects.filter(plan_id=plan_id).values_list("shop_id", flat=True))
+    if shop_ids:
+        invalidate_entitlements(shop_ids)
+
+
+def _resolve(shop_id):
+    from subscriptions.models import ShopSubscription
+
+    sub = ShopSubscription.objects.select_related("plan").filter(shop_id=shop_id).first()
+    if sub is None:
+        return Entitlements(shop_id=shop_id)
+    plan = sub.plan
+    return Entitlements(
+        shop_id=shop_id,
+        has_subscription=True,
+        status=sub.status,
+        end_date=sub.end_date,
+        has_ai_addon=sub.has_ai_addon,
+        plan_id=plan.id if plan else None,
+        plan_name=plan.name if plan else None,
+        commission_rate=plan.commission_rate if plan else None,
+        priority_boost=plan.priority_boost if plan else 0,
+        plan_features=tuple(getattr(plan, f) for f in PLAN_FEATURES) if plan else (),
+    )
+
+
+def get_entitlements(shop):
+    """Entitlements of `shop` (a Shop or a shop id)."""
+    shop_id = getattr(shop, "pk", shop)
+    memo = getattr(shop, _MEMO_ATTR, None) if shop is not shop_id else None
+    if memo is not None:
+        return memo
+
+    key = cache_key(shop_id)
+    data = cache.get(key)
+    try:
+        ent = Entitlements(**data) if data is not None else None
+    except TypeError:
+        ent = None  # Written by an older layout
+    if ent is None:
+        ent = _resolve(shop_id)
+        cache.set(key, asdict(ent), CACHE_TTL)
+
+    if shop is not shop_id:
+        setattr(shop, _MEMO_ATTR, ent)
+    return ent
+
+
+def forget_entitlements(shop):
+    """Drop the per-instance memo (after changing the shop's subscription in-process)."""
+    shop.__dict__.pop(_MEMO_ATTR, None)
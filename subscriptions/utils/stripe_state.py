@@ -0,0 +1,148 @@
+# subscriptions/utils/stripe_state.py
+"""
+Stripe subscription state mirrored onto ShopSubscription.
+
+The webhook pipeline writes status, period end (end_date),
+cancel_at_period_end and the AI add-on item as events arrive.
+`reconcile_stale_subscriptions` (beat) re-reads subscriptions not synced
+for a while, to repair missed or failed webhooks. SubscriptionDetailsView
+reads only the database (plus a short cache) and never calls Stripe.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = {"active", "trialing", "past_due"}
+DETAILS_CACHE_TTL = getattr(settings, "SUBSCRIPTION_DETAILS_CACHE_SECONDS", 60)
+
+
+def details_cache_key(shop_id):
+    return f"subscription_details_{shop_id}"
+
+
+def invalidate_subscription_details(shop_id):
+    cache.delete(details_cache_key(shop_id))
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(int(value), tz=dt_timezone.utc) if value else None
+
+
+def _items(sub):
+    return (sub.get("items") or {}).get("data") or []
+
+
+def period_end(sub):
+    """current_period_end, wherever this API version puts it (subscription or item)."""
+    end = sub.get("current_period_end") or (sub.get("current_period") or {}).get("end")
+    if not end:
+        end = next((it.get("current_period_end") for it in _items(sub) if it.get("current_period_end")), None)
+    return _timestamp(end)
+
+
+def apply_base_subscription(ss, sub):
+    """Copy a plan subscription's state onto `ss` (not saved). Returns the changed fields."""
+    from subscriptions.models import SubscriptionPlan
+
+    ai_price_id = getattr(settings, "STRIPE_AI_PRICE_ID", None)
+    fields = {"status", "cancel_at_period_end", "stripe_synced_at"}
+    ss.status = sub.get("status") or ss.status
+    ss.cancel_at_period_end = bool(sub.get("cancel_at_period_end"))
+    ss.stripe_synced_at = timezone.now()
+
+    end = period_end(sub)
+    if end:
+        ss.end_date = end
+        fields.add("end_date")
+
+    price_ids = [(it.get("price") or {}).get("id") for it in _items(sub)]
+    base_price = next((p for p in price_ids if p and p != ai_price_id), None)
+    plan = SubscriptionPlan.objects.filter(stripe_price_id=base_price).first() if base_price else None
+    if plan and plan.id != ss.plan_id:
+        ss.plan = plan
+        fields.add("plan")
+
+    # AI add-on sold as an item of the plan subscription
+    ai_item = next((it for it in _items(sub) if (it.get("price") or {}).get("id") == ai_price_id), None)
+    if ai_price_id and ai_item:
+        ss.has_ai_addon = ss.status in ACTIVE_STATUSES
+        ss.ai_subscription_item_id = ai_item.get("id")
+        fields |= {"has_ai_addon", "ai_subscription_item_id"}
+    return fields
+
+
+def apply_ai_subscription(ss, sub):
+    """Copy a separate AI add-on subscription's state onto `ss` (not saved)."""
+    ai_price_id = getattr(settings, "STRIPE_AI_PRICE_ID", None)
+    ss.has_ai_addon = sub.get("status") in ACTIVE_STATUSES
+    ai_item = next((it for it in _items(sub) if (it.get("price") or {}).get("id") == ai_price_id), None)
+    if ai_item:
+        ss.ai_subscription_item_id = ai_item.get("id")
+    ss.stripe_synced_at = timezone.now()
+    return {"has_ai_addon", "ai_subscription_item_id", "stripe_synced_at"}
+
+
+def _retrieve(sub_id):
+    try:
+        return stripe.Subscription.retrieve(sub_id, expand=["items.data.price"])
+    except stripe.error.InvalidRequestError as e:
+        if getattr(e, "code", None) == "resource_missing":
+            return None
+        raise
+
+
+def reconcile_shop_subscription(ss):
+    """Re-read the shop's Stripe subscriptions and mirror them. Returns the saved fields."""
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    fields = {"stripe_synced_at"}
+    ss.stripe_synced_at = timezone.now()
+
+    if ss.stripe_subscription_id:
+        sub = _retrieve(ss.stripe_subscription_id)
+        if sub is None:
+            logger.warning("Stripe subscription %s of shop %s no longer exists", ss.stripe_subscription_id, ss.shop_id)
+        else:
+            fields |= apply_base_subscription(ss, sub)
+
+    if ss.ai_stripe_subscription_id and ss.ai_stripe_subscription_id != ss.stripe_subscription_id:
+        sub = _retrieve(ss.ai_stripe_subscription_id)
+        if sub is None:
+            ss.has_ai_addon = False
+            ss.ai_stripe_subscription_id = None
+            ss.ai_subscription_item_id = None
+            fields |= {"has_ai_addon", "ai_stripe_subscription_id", "ai_subscription_item_id"}
+        else:
+            fields |= apply_ai_subscription(ss, sub)
+
+    ss.save(update_fields=sorted(fields))
+    return fields
+
+
+def reconcile_stale_subscriptions(batch_size=100, stale_after=timedelta(hours=6)):
+    """Reconcile one batch of Stripe-backed subscriptions, least recently synced first."""
+    from django.db.models import F
+    from subscriptions.models import ShopSubscription
+
+    cutoff = timezone.now() - stale_after
+    stale = (
+        ShopSubscription.objects
+        .filter(Q(stripe_subscription_id__isnull=False) | Q(ai_stripe_subscription_id__isnull=False))
+        .filter(Q(stripe_synced_at__isnull=True) | Q(stripe_synced_at__lt=cutoff))
+        .order_by(F("stripe_synced_at").asc(nulls_first=True))[:batch_size]
+    )
+    synced = failed = 0
+    for ss in stale:
+        try:
+            reconcile_shop_subscription(ss)
+            synced += 1
+        except Exception:
+            failed += 1
+            logger.exception("Stripe reconciliation failed for ShopSubscription %s", ss.id)
+    return synced, failed
@@ -1,6 +1,7 @@
 # subscriptions/views.py
 import stripe
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
@@ -12,6 +13,7 @@ from decimal import Decimal
 from .models import SubscriptionPlan, ShopSubscription
 from api.models import Shop
 from .serializers import SubscriptionPlanSerializer
+from .utils.stripe_state import DETAILS_CACHE_TTL, details_cache_key
 from payments.models import UserStripeCustomer
 import logging
 from datetime import timezone as dt_timezone
@@ -95,24 +97,26 @@ class SubscriptionDetailsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
+        # Database only: webhooks and the reconcile task keep the mirror fresh
         ai_price_id = getattr(settings, "STRIPE_AI_PRICE_ID", None)
 
-        plan = None
-        status = "none"
-        renews_on = None
-        expires_on = None          # 👈 NEW
-        cancel_at_period_end = False
-        ai_state = "not_enabled"
-        ai_legacy = False
-
         # find shop
         try:
             shop = request.user.shop
         except Shop.DoesNotExist:
             shop = None
 
-        # Prefer DB
+        if shop:
+            payload = cache.get(details_cache_key(shop.id))
+            if payload is not None:
+                return Response(payload, status=200)
+
+        plan = None
+        status = "none"
+        renews_on = None
+        expires_on = None
+        cancel_at_period_end = False
+
         shop_sub = getattr(shop, "subscription", None) if shop else None
         if shop_sub and shop_sub.plan:
             plan = shop_sub.plan
@@ -120,81 +124,20 @@ class SubscriptionDetailsView(APIView):
             if shop_sub.end_date:
                 expires_on = shop_sub.end_date.astimezone(dt_timezone.utc).isoformat()
 
-
             if shop_sub.stripe_subscription_id:
-                try:
-                    s = stripe.Subscription.retrieve(shop_sub.stripe_subscription_id)
-                    status = s.get("status", "none")
-                    cpe = s.get("current_period_end")
-                    if cpe:
-                        # Next billing (Stripe)
-                        renews_on = timezone.datetime.fromtimestamp(int(cpe), tz=dt_timezone.utc).isoformat()
-                    # DO NOT overwrite expires_on here; keep DB value below
-                    cancel_at_period_end = bool(s.get("cancel_at_period_end"))
-                except Exception:
-                    pass
-            else:
-                status = "none"
-
-            # Always prefer DB for the current period window we show in the app
-            if shop_sub.end_date:
-                expires_on = shop_sub.end_date.astimezone(dt_timezone.utc).isoformat()
-
-        # If plan still None, optionally fall back to Stripe (active-ish only)…
-        if plan is None and shop:
-            try:
-                owner_cus = _ensure_shop_customer_id(shop)
-                subs = stripe.Subscription.list(
-                    customer=owner_cus,
-                    status="all",
-                    expand=["data.items.data.price"],
-                    limit=20,
-                )
-                ALLOWED = {"active", "trialing", "past_due"}
-                priority = {"active": 3, "trialing": 2, "past_due": 1}
-                chosen, best = None, -1
-                for s in subs.get("data", []):
-                    st = s.get("status")
-                    if st not in ALLOWED:
-                        continue
-                    sc = priority.get(st, 0)
-                    if sc > best:
-                        chosen, best = s, sc
-
-                if chosen:
-                    status = chosen.get("status", "none")
-                    cpe = chosen.get("current_period_end")
-                    if cpe:
-                        renews_on = timezone.datetime.fromtimestamp(int(cpe), tz=dt_timezone.utc).isoformat()
-                        expires_on = renews_on  # 👈 NEW
-                    cancel_at_period_end = bool(chosen.get("cancel_at_period_end"))
-
-                    price_ids = [it["price"]["id"] for it in chosen["items"]["data"]]
-                    base_plan = (SubscriptionPlan.objects
-                                 .filter(stripe_price_id__in=price_ids)
-                                 .order_by("id").first())
-                    if base_plan:
-                        plan = base_plan
-
-                    ai_price_id and ai_price_id in price_ids and (ai_state := "addon_active")
-            except Exception:
-                pass
+                status = shop_sub.status or "none"
+                # end_date mirrors Stripe's current_period_end (next billing)
+                renews_on = expires_on
+                cancel_at_period_end = shop_sub.cancel_at_period_end
 
         # Final fallback → Foundation
         if plan is None:
             plan = (SubscriptionPlan.objects.filter(name__iexact=SubscriptionPlan.FOUNDATION).first()
                     or SubscriptionPlan.objects.order_by("id").first())
             status = "none"
-            renews_on = renews_on or None
-            # keep expires_on as-is (may be None or long free-plan date if set above)
-
-        # AI override if plan includes it
-        if getattr(plan, "ai_assistant", "") == "included":
-            ai_state = "included"
 
         commission = plan.commission_rate if plan.commission_rate is not None else Decimal("0.10")
 
-        #  Determine AI state correctly (do NOT reset it earlier)
         ai_state = "none"
         if shop_sub:
             # Included automatically for Icon plan
@@ -223,6 +166,8 @@ class SubscriptionDetailsView(APIView):
                 "price_id": ai_price_id,
             },
         }
+        if shop:
+            cache.set(details_cache_key(shop.id), payload, DETAILS_CACHE_TTL)
         return Response(payload, status=200)
 
 
@@ -389,7 +334,7 @@ class CancelAIAddonView(APIView):
             return Response({"error": "AI add-on configuration error."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         # ---- 2) Check provider: Stripe or PayPal ---------------------------------
-        ai_stripe_sub_id = getattr(shop_sub, "ai_subscription_id", None) or getattr(shop_sub, "ai_stripe_subscription_id", None)
+        ai_stripe_sub_id = shop_sub.ai_stripe_subscription_id
         ai_paypal_sub_id = getattr(shop_sub, "ai_paypal_subscription_id", None)
         
         # Determine which provider
@@ -433,9 +378,9 @@ class CancelAIAddonView(APIView):
                 # e.g. "No such subscription"
                 logger.warning("Stripe: could not retrieve AI subscription %s for shop %s: %s", ai_stripe_sub_id, shop.id, e)
                 shop_sub.has_ai_addon = False
-                shop_sub.ai_subscription_id = None
+                shop_sub.ai_stripe_subscription_id = None
                 shop_sub.ai_subscription_item_id = None
-                shop_sub.save(update_fields=["has_ai_addon", "ai_subscription_id", "ai_subscription_item_id"])
+                shop_sub.save(update_fields=["has_ai_addon", "ai_stripe_subscription_id", "ai_subscription_item_id"])
                 return Response({"error": "AI add-on not found in your active subscription details."}, status=status.HTTP_404_NOT_FOUND)
 
             # ---- 3) Ensure we know the correct AI SubscriptionItem ID --------------
@@ -446,9 +391,9 @@ class CancelAIAddonView(APIView):
             if not ai_item_id:
                 logger.warning("AI item not present on AI subscription %s for shop %s; cleaning up.", ai_stripe_sub_id, shop.id)
                 shop_sub.has_ai_addon = False
-                shop_sub.ai_subscription_id = None
+                shop_sub.ai_stripe_subscription_id = None
                 shop_sub.ai_subscription_item_id = None
-                shop_sub.save(update_fields=["has_ai_addon", "ai_subscription_id", "ai_subscription_item_id"])
+                shop_sub.save(update_fields=["has_ai_addon", "ai_stripe_subscription_id", "ai_subscription_item_id"])
                 return Response({"error": "AI add-on not found in your active subscription details."}, status=status.HTTP_404_NOT_FOUND)
 
             # ---- 4) Cancel: whole sub if single-item, else just remove the item ----
@@ -464,10 +409,10 @@ class CancelAIAddonView(APIView):
 
                 # ---- 5) DB cleanup --------------------------------------------------
                 shop_sub.has_ai_addon = False
-                shop_sub.ai_subscription_id = None
+                shop_sub.ai_stripe_subscription_id = None
                 shop_sub.ai_subscription_item_id = None
                 # legacy_ai_promo_used stays as-is (true if they redeemed lifetime)
-                shop_sub.save(update_fields=["has_ai_addon", "ai_subscription_id", "ai_subscription_item_id"])
+                shop_sub.save(update_fields=["has_ai_addon", "ai_stripe_subscription_id", "ai_subscription_item_id"])
 
                 return Response({"success": True, "message": "AI Assistant add-on successfully cancelled."}, status=status.HTTP_200_OK)
 